@@ -0,0 +1,535 @@
+# bench.py — benchmark / carga da API unificada (main.py)
+# =========================================================
+# Gera planilhas sintéticas (CODIGOS e pendente) e um volume de chamados,
+# sobe a API em processo (httpx + ASGITransport) e/ou num uvicorn local e
+# mede p50/p99, throughput e pico de RSS por endpoint. Selenium é trocado
+# por um driver stub. O resultado vai para JSON, identificado pelo commit,
+# para comparar entre versões:
+#
+#   python bench.py --sizes 10k,100k --mode both
+#   python bench.py --sizes 1M --mode inproc --compare bench_results/<anterior>.json
+# =========================================================
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import shutil
+import io
+import zipfile
+import platform
+import resource
+import subprocess
+import threading
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parent
+ADMIN = {"username": "jaya", "password": "697843"}
+COMUM = {"username": "NovaSP", "password": "cmnsp2025"}
+AUTORES = ["NovaSP", "jaya", "renan", "ana"]
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * mult)
+
+
+def git_sha() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+# ---------------- Dados sintéticos ----------------
+PALAVRAS = [
+    "ABRACADEIRA", "TUBO", "REPARO", "CURVA", "LUVA", "REGISTRO", "VALVULA", "TE",
+    "FLANGE", "COLAR", "TOMADA", "ADAPTADOR", "HIDROMETRO", "CAIXA", "TAMPA", "PVC", "PEAD", "FF",
+]
+CATEGORIAS = ["AGUA", "ESGOTO", "PAVIMENTO", "HIDROMETRIA", "GERAL"]
+CONTRATOS = [f"CT-{i:03d}" for i in range(20)]
+
+
+def catalog_frames(n: int, seed: int, chunk: int = 100_000):
+    rng = np.random.default_rng(seed)
+    palavras = np.array(PALAVRAS, dtype=object)
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        desc = (
+            palavras[rng.integers(0, len(palavras), m)] + " "
+            + palavras[rng.integers(0, len(palavras), m)] + " DN"
+            + rng.integers(20, 400, m).astype(str)
+        )
+        yield pd.DataFrame({
+            "Codigo Material SAP": np.arange(30_000_000 + start, 30_000_000 + start + m),
+            "Descrição Material SAP": desc,
+            "CATEGORIA": np.array(CATEGORIAS, dtype=object)[rng.integers(0, len(CATEGORIAS), m)],
+        })
+
+
+def pendente_frames(n: int, seed: int, chunk: int = 100_000):
+    rng = np.random.default_rng(seed)
+    contratos = np.array(CONTRATOS, dtype=object)
+    atcs = np.array([f"ATC{i:02d} - Região {i}" for i in range(40)], dtype=object)
+    familias = np.array([f"FAM {i}" for i in range(12)], dtype=object)
+    descricoes = np.array([f"Serviço {w.title()}" for w in PALAVRAS], dtype=object)
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        yield pd.DataFrame({
+            "Contrato": contratos[rng.integers(0, len(contratos), m)],
+            "ATC": atcs[rng.integers(0, len(atcs), m)],
+            "Família": familias[rng.integers(0, len(familias), m)],
+            "Descrição TSS": descricoes[rng.integers(0, len(descricoes), m)],
+            "OS": np.arange(start, start + m),
+            "Valor": rng.random(m).round(2) * 1000,
+        })
+
+
+def write_workbook(path: Path, frames):
+    # usa o próprio writer de streaming da API (bem mais rápido que to_excel)
+    import main
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        for part in main.stream_xlsx(frames):
+            f.write(part)
+    os.replace(tmp, path)
+
+
+def write_tickets_snapshot(directory: Path, n: int, seed: int):
+    # snapshot no formato do ChamadosJournal: o store carrega sem replay de eventos
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    chamados = []
+    for i in range(n):
+        autor = AUTORES[i % len(AUTORES)]
+        mensagens = [
+            {"autor": AUTORES[(i + k) % len(AUTORES)], "texto": f"mensagem {k}", "data": "2025-01-01 10:00:00"}
+            for k in range(rng.randint(0, 4))
+        ]
+        chamados.append({
+            "id": f"bench-{i:07d}",
+            "titulo": f"Chamado sintético {i}",
+            "categoria": rng.choice(["Sistema", "Rede", "Acesso", "Outros"]),
+            "descricao": "Gerado pelo bench.py",
+            "status": rng.choice(["Aberto", "Em andamento", "Fechado"]),
+            "autor": autor,
+            "autor_role": "comum" if autor == "NovaSP" else "admin",
+            "mensagens": mensagens,
+            "criado_em": "2025-01-01 09:00:00",
+            "nao_lido_por": ["admin", "ti"] if rng.random() < 0.2 else [],
+        })
+    (directory / "journal.jsonl").write_text("", encoding="utf-8")
+    (directory / "snapshot.json").write_text(json.dumps({"seq": n, "chamados": chamados}), encoding="utf-8")
+
+
+# ---------------- Selenium stub ----------------
+class _StubSwitch:
+    def window(self, handle):
+        pass
+
+
+class StubDriver:
+    # o mínimo que BrowserPool/BrowserSession usam
+    def __init__(self):
+        self.window_handles = ["stub-0"]
+        self.switch_to = _StubSwitch()
+        self.current_url = "about:blank"
+
+    def quit(self):
+        self.window_handles = []
+
+
+def install_selenium_stub(main, login_ms: float):
+    def login(driver, wait):
+        time.sleep(login_ms / 1000)
+        driver.current_url = "http://stub/logado"
+
+    main.BROWSER_POOL.driver_factory = StubDriver
+    for site in main.SELENIUM_SITES:
+        main.SELENIUM_SITES[site] = {"login": login, "logado": lambda d: True}
+
+
+# ---------------- Ambiente ----------------
+def prepare_env(workdir: Path, catalog: Path):
+    # precisa rodar antes do import de main (config lida no import; main usa
+    # caminhos relativos ao diretório atual)
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ.update({
+        "MATERIAIS_PATH": str(catalog),
+        "CHAMADOS_DIR": str(workdir / "files" / "chamados"),
+        "STATE_DB": str(workdir / "files" / "state.db"),
+        "TMP_CLEANUP_INTERVAL": "0",
+        "LOG_LEVEL": "WARNING",
+    })
+    os.chdir(workdir)
+    if str(BACKEND_DIR) not in sys.path:
+        sys.path.insert(0, str(BACKEND_DIR))
+
+
+def rss_bytes(pid: Optional[int] = None) -> int:
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # sem /proc: pico do próprio processo (ru_maxrss em KiB no Linux, bytes no macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    def __init__(self, pid: Optional[int], interval: float = 0.02):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = rss_bytes(self.pid)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes(self.pid))
+
+
+# ---------------- Medição ----------------
+def percentile(values: List[float], pct: float) -> float:
+    return float(np.percentile(values, pct)) if values else 0.0
+
+
+async def measure(name: str, call, n: int, concurrency: int, pid: Optional[int], ok=(200,)) -> Dict[str, Any]:
+    # call(i) -> response; latência por requisição, erros = status fora de ok
+    sem = asyncio.Semaphore(concurrency)
+    latencias: List[float] = []
+    erros = 0
+    bytes_out = 0
+
+    async def one(i: int):
+        nonlocal erros, bytes_out
+        async with sem:
+            inicio = time.perf_counter()
+            try:
+                r = await call(i)
+                bytes_out += len(r.content)
+                if r.status_code not in ok:
+                    erros += 1
+            except Exception:
+                erros += 1
+            latencias.append(time.perf_counter() - inicio)
+
+    with RssSampler(pid) as rss:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        total = time.perf_counter() - inicio
+
+    return {
+        "endpoint": name,
+        "requests": n,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencias, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencias, 99) * 1000, 3),
+        "mean_ms": round(float(np.mean(latencias)) * 1000, 3) if latencias else 0.0,
+        "throughput_rps": round(n / total, 2) if total else 0.0,
+        "errors": erros,
+        "response_bytes": bytes_out,
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+    }
+
+
+def zip_variant(data: bytes, i: int) -> bytes:
+    # mesmo conteúdo, bytes diferentes: só o comentário do zip muda
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as src, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            dst.writestr(item, src.read(item.filename))
+        dst.comment = f"bench {i}".encode()
+    return out.getvalue()
+
+
+async def run_suite(client, pid: Optional[int], pendente_path: Path, args) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    c, n, rodadas = args.concurrency, args.requests, args.upload_repeats
+    results = []
+
+    async def token(cred):
+        r = await client.post("/login", json=cred)
+        return {"Authorization": "Bearer " + r.json()["token"]}
+
+    admin, comum = await token(ADMIN), await token(COMUM)
+
+    # ---- materiais ----
+    primeiro = await client.get("/materiais")
+    etag = primeiro.headers.get("etag", "")
+    results.append(await measure("GET /materiais", lambda i: client.get("/materiais"), max(5, n // 10), c, pid))
+    results.append(await measure(
+        "GET /materiais (304)", lambda i: client.get("/materiais", headers={"If-None-Match": etag}),
+        n, c, pid, ok=(304,),
+    ))
+    termos = [w.lower()[:4] for w in PALAVRAS]
+    results.append(await measure(
+        "GET /materiais/search",
+        lambda i: client.get("/materiais/search", params={"q": termos[i % len(termos)], "limit": 50}),
+        n, c, pid,
+    ))
+
+    # ---- pendente ----
+    # "parse": cada rodada manda bytes diferentes (mesmas linhas), então o
+    # cache de parse por hash nunca acerta; "cache": o mesmo arquivo de novo
+    data = pendente_path.read_bytes()
+    variantes = [zip_variant(data, i) for i in range(rodadas)]
+    ids: List[str] = []
+
+    async def upload(payload: bytes):
+        r = await client.post("/pendente/upload", files={"file": (pendente_path.name, payload)})
+        if r.status_code == 200:
+            ids.append(r.json()["file_id"])
+        return r
+
+    results.append(await measure("POST /pendente/upload (parse)", lambda i: upload(variantes[i]), rodadas, 1, pid))
+    results.append(await measure("POST /pendente/upload (cache)", lambda i: upload(variantes[0]), rodadas, 1, pid))
+    if not ids:
+        return results
+    file_id = ids[-1]
+
+    def filtros(i):
+        return {"contratos": rng.sample(CONTRATOS, 1 + i % 5)}
+
+    results.append(await measure(
+        "POST /pendente/filter",
+        lambda i: client.post("/pendente/filter", json={"file_id": file_id, "filtros": filtros(i)}),
+        n, c, pid,
+    ))
+
+    for formato in ("csv", "xlsx"):
+        # frio: filtro novo antes de cada exportação (sem cache), sequencial
+        async def cold(i, formato=formato):
+            await client.post("/pendente/filter", json={"file_id": file_id, "filtros": filtros(i + 1000)})
+            return await client.post(f"/pendente/format?formato={formato}", json={"file_id": file_id})
+
+        results.append(await measure(f"POST /pendente/format {formato} (frio)", cold, rodadas, 1, pid))
+        results.append(await measure(
+            f"POST /pendente/format {formato} (cache)",
+            lambda i, formato=formato: client.post(f"/pendente/format?formato={formato}", json={"file_id": file_id}),
+            max(5, n // 10), c, pid,
+        ))
+
+    # ---- chamados / notificações ----
+    results.append(await measure(
+        "GET /notifications/count", lambda i: client.get("/notifications/count", headers=admin), n, c, pid,
+    ))
+    results.append(await measure(
+        "GET /chamados (página summary)",
+        lambda i: client.get("/chamados", params={"limit": 50, "view": "summary"}, headers=admin), n, c, pid,
+    ))
+    results.append(await measure(
+        "GET /meus-chamados (página summary)",
+        lambda i: client.get("/meus-chamados", params={"limit": 50, "view": "summary"}, headers=comum), n, c, pid,
+    ))
+    results.append(await measure(
+        "GET /chamados (lista completa)", lambda i: client.get("/chamados", headers=admin), max(3, n // 50), 1, pid,
+    ))
+
+    # ---- automação (driver stub) ----
+    async def job(i):
+        r = await client.post("/rastreador/abrir-site", headers=admin)
+        while r.status_code in (200, 202) and r.json().get("status") in ("queued", "running"):
+            await asyncio.sleep(0.01)
+            r = await client.get(f"/jobs/{r.json()['job_id']}", headers=admin)
+        return r
+
+    results.append(await measure("POST /rastreador/abrir-site (job)", job, max(3, n // 20), 1, pid))
+    return results
+
+
+# ---------------- Modos ----------------
+async def bench_inproc(pendente_path: Path, args) -> List[Dict[str, Any]]:
+    import httpx
+    import main
+
+    install_selenium_stub(main, args.stub_login_ms)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        return await run_suite(client, None, pendente_path, args)
+
+
+async def bench_uvicorn(workdir: Path, catalog: Path, pendente_path: Path, args) -> List[Dict[str, Any]]:
+    import httpx
+
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "serve",
+        "--workdir", str(workdir), "--catalog", str(catalog),
+        "--port", str(args.port), "--stub-login-ms", str(args.stub_login_ms),
+    ]
+    proc = subprocess.Popen(cmd)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        async with httpx.AsyncClient(base_url=base, timeout=600) as client:
+            for _ in range(300):
+                if proc.poll() is not None:
+                    raise RuntimeError("uvicorn encerrou antes de ficar pronto")
+                try:
+                    await client.get("/metrics")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            return await run_suite(client, proc.pid, pendente_path, args)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def serve(args):
+    # processo do uvicorn no modo "uvicorn": mesmo ambiente + stub do Selenium
+    prepare_env(Path(args.workdir), Path(args.catalog))
+    import uvicorn
+    import main
+
+    install_selenium_stub(main, args.stub_login_ms)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def compare(atual: Dict[str, Any], anterior_path: Path, threshold: float):
+    anterior = json.loads(anterior_path.read_text(encoding="utf-8"))
+    base = {(r["mode"], r["size"], r["endpoint"]): r for r in anterior["results"]}
+    print(f"\nComparação com {anterior_path.name} ({anterior['meta']['git_sha']}):")
+    for r in atual["results"]:
+        old = base.get((r["mode"], r["size"], r["endpoint"]))
+        if old is None:
+            continue
+        partes = []
+        regressao = False
+        for q in ("p50_ms", "p99_ms"):
+            if not old.get(q):
+                continue
+            delta = (r[q] - old[q]) / old[q] * 100
+            regressao = regressao or delta > threshold
+            partes.append(f"{q[:3]} {old[q]:>9.2f} -> {r[q]:>9.2f} ms ({delta:+.0f}%)")
+        if not partes:
+            continue
+        marca = "  <-- regressão" if regressao else ""
+        print(f"  [{r['mode']:7} {r['size']:>8}] {r['endpoint']:40} " + "  ".join(partes) + marca)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark da API unificada")
+    sub = parser.add_subparsers(dest="cmd")
+
+    srv = sub.add_parser("serve", help=argparse.SUPPRESS)
+    srv.add_argument("--workdir", required=True)
+    srv.add_argument("--catalog", required=True)
+    srv.add_argument("--port", type=int, required=True)
+    srv.add_argument("--stub-login-ms", type=float, default=50)
+
+    parser.add_argument("--sizes", default="10k,100k", help="linhas das planilhas, ex.: 10k,100k,1M")
+    parser.add_argument("--tickets", type=int, default=10_000)
+    parser.add_argument("--mode", choices=["inproc", "uvicorn", "both"], default="inproc")
+    parser.add_argument("--requests", type=int, default=200, help="requisições por endpoint leve")
+    parser.add_argument("--upload-repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--stub-login-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", default=str(BACKEND_DIR / "bench_results" / "work"))
+    parser.add_argument("--out", default=None, help="JSON de saída (padrão: bench_results/bench-<sha>-<data>.json)")
+    parser.add_argument("--compare", default=None, help="JSON anterior para comparar p50/p99")
+    parser.add_argument("--threshold", type=float, default=20.0, help="%% de piora no p50 ou p99 marcada como regressão")
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        serve(args)
+        return
+
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    modes = ["inproc", "uvicorn"] if args.mode == "both" else [args.mode]
+    # caminhos resolvidos antes do chdir de prepare_env
+    out = Path(args.out).resolve() if args.out else (
+        BACKEND_DIR / "bench_results" / f"bench-{git_sha()}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    anterior = Path(args.compare).resolve() if args.compare else None
+    base_workdir = Path(args.workdir).resolve()
+    data_dir = base_workdir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    # o processo do bench roda sempre em inproc/; cada uvicorn ganha o seu diretório
+    inproc_dir = base_workdir / "inproc"
+    shutil.rmtree(inproc_dir, ignore_errors=True)
+    prepare_env(inproc_dir, data_dir / f"codigos_{sizes[0]}.xlsx")
+
+    results = []
+    for size in sizes:
+        catalog = data_dir / f"codigos_{size}.xlsx"
+        pendente = data_dir / f"pendente_{size}.xlsx"
+        if not catalog.exists():
+            print(f"Gerando {catalog.name} ...", flush=True)
+            write_workbook(catalog, catalog_frames(size, args.seed))
+        if not pendente.exists():
+            print(f"Gerando {pendente.name} ...", flush=True)
+            write_workbook(pendente, pendente_frames(size, args.seed))
+
+        for mode in modes:
+            print(f"== {mode} / {size} linhas / {args.tickets} chamados ==", flush=True)
+            if mode == "inproc":
+                write_tickets_snapshot(inproc_dir / "files" / "chamados", args.tickets, args.seed)
+                import main
+                # main é importado uma vez só: troca o catálogo e recarrega os chamados
+                main.MATERIAIS_CATALOG = main.MateriaisCatalog(catalog)
+                main.chamados_store = main.TicketStore(main.ChamadosJournal(
+                    main.CHAMADOS_DIR, main.CHAMADOS_COMMIT_MS, main.CHAMADOS_SNAPSHOT_EVERY,
+                ))
+                main.chamados_store.load()
+                rows = asyncio.run(bench_inproc(pendente, args))
+            else:
+                workdir = base_workdir / f"uvicorn_{size}"
+                shutil.rmtree(workdir, ignore_errors=True)
+                write_tickets_snapshot(workdir / "files" / "chamados", args.tickets, args.seed)
+                rows = asyncio.run(bench_uvicorn(workdir, catalog, pendente, args))
+            for r in rows:
+                r.update({"mode": mode, "size": size})
+                print(
+                    f"  {r['endpoint']:40} p50 {r['p50_ms']:>9.2f} ms  p99 {r['p99_ms']:>9.2f} ms  "
+                    f"{r['throughput_rps']:>8.1f} req/s  rss {r['peak_rss_mb']:>7.1f} MB  erros {r['errors']}",
+                    flush=True,
+                )
+            results.extend(rows)
+
+    report = {
+        "meta": {
+            "git_sha": git_sha(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "cmd"},
+        },
+        "results": results,
+    }
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\nResultados em {out}")
+    if anterior is not None:
+        compare(report, anterior, args.threshold)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -4,21 +4,63 @@
 # =========================================================
 
 import os
+import abc
 import uuid
 import time
 import json
 import tempfile
+import itertools
+import bisect
+import shutil
+import csv
+import asyncio
+import io
+import zlib
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import contextvars
+import functools
+from contextlib import contextmanager
 import logging
 import unicodedata
 import re
+import hashlib
+import sqlite3
+import hmac
+import heapq
+import math
+import base64
+import threading
 import uvicorn
+from email.utils import formatdate, parsedate_to_datetime
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
 
 # -------------------- Third-party --------------------
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # sem pyarrow os datasets do pendente ficam só no heap
+    pa = pq = None
+try:
+    import orjson
+except ImportError:  # sem orjson as listas usam o json da stdlib
+    orjson = None
+try:
+    import brotli
+except ImportError:  # sem brotli a compressão negociada é só gzip
+    brotli = None
 from fastapi import (
     FastAPI,
+    Request,
     UploadFile,
     File,
     Form,
@@ -36,6 +78,7 @@ from fastapi.responses import (
     FileResponse,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 # -------------------- Selenium --------------------
@@ -59,7 +102,7 @@ TMP_DIR = Path(tempfile.gettempdir()) / "pendente_api"
 TMP_DIR.mkdir(parents=True, exist_ok=True)
 
 FILTERS_FILE = TMP_DIR / "filtros_salvos.json"
-EXCEL_PATH = Path(os.path.dirname(__file__)) / "CODIGOS.xlsx"  # materiais
+EXCEL_PATH = Path(os.environ.get("MATERIAIS_PATH", Path(os.path.dirname(__file__)) / "CODIGOS.xlsx"))  # materiais
 
 # ---------------- App ----------------
 app = FastAPI(title="Technoblade Unified API (FastAPI)", version="1.0")
@@ -70,8 +113,429 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Version"],
 )
 
+# ---------------- Métricas ----------------
+# Middleware ASGI mede cada requisição (latência por rota, em andamento,
+# bytes de entrada/saída) e span("nome") cronometra etapas internas
+# (parse de Excel, filtro, exportação, login Selenium, varredura de chamados).
+# Tudo sai em formato Prometheus em GET /metrics. Com SLOW_REQUEST_MS > 0,
+# requisições acima do limite vão para o log com o tempo de cada etapa.
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)  # último = +Inf
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(METRICS_BUCKETS, value)] += 1
+        self.total += value
+        self.n += 1
+
+
+def prom_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: Dict[tuple, Histogram] = {}       # (method, route)
+        self.requests: Dict[tuple, int] = {}            # (method, route, status)
+        self.bytes_in: Dict[tuple, int] = {}            # (method, route)
+        self.bytes_out: Dict[tuple, int] = {}
+        self.stages: Dict[str, Histogram] = {}
+        self.in_flight = 0
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, size_in: int, size_out: int):
+        key = (method, route)
+        with self._lock:
+            hist = self.latency.get(key)
+            if hist is None:
+                hist = self.latency[key] = Histogram()
+            hist.observe(seconds)
+            rkey = (method, route, status)
+            self.requests[rkey] = self.requests.get(rkey, 0) + 1
+            self.bytes_in[key] = self.bytes_in.get(key, 0) + size_in
+            self.bytes_out[key] = self.bytes_out.get(key, 0) + size_out
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = Histogram()
+            hist.observe(seconds)
+
+    def render(self, gauges: List[tuple]) -> str:
+        # gauges: [(nome, ajuda, tipo, {labels}, valor)] vindos dos stores
+        out: List[str] = []
+
+        def header(name: str, help_text: str, kind: str):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def histogram(name: str, labels: Dict[str, Any], hist: Histogram):
+            acc = 0
+            for le, count in zip(METRICS_BUCKETS + ("+Inf",), hist.counts):
+                acc += count
+                out.append(f"{name}_bucket{prom_labels({**labels, 'le': le})} {acc}")
+            out.append(f"{name}_sum{prom_labels(labels)} {hist.total:.6f}")
+            out.append(f"{name}_count{prom_labels(labels)} {hist.n}")
+
+        with self._lock:
+            header("http_request_duration_seconds", "Latência das requisições por rota", "histogram")
+            for (method, route), hist in sorted(self.latency.items()):
+                histogram("http_request_duration_seconds", {"method": method, "route": route}, hist)
+
+            header("http_requests_total", "Requisições por rota e status", "counter")
+            for (method, route, status), n in sorted(self.requests.items()):
+                out.append(f"http_requests_total{prom_labels({'method': method, 'route': route, 'status': status})} {n}")
+
+            header("http_requests_in_flight", "Requisições em andamento", "gauge")
+            out.append(f"http_requests_in_flight {self.in_flight}")
+
+            for name, data, help_text in (
+                ("http_request_bytes_total", self.bytes_in, "Bytes recebidos no corpo"),
+                ("http_response_bytes_total", self.bytes_out, "Bytes enviados no corpo"),
+            ):
+                header(name, help_text, "counter")
+                for (method, route), n in sorted(data.items()):
+                    out.append(f"{name}{prom_labels({'method': method, 'route': route})} {n}")
+
+            header("stage_duration_seconds", "Tempo das etapas internas", "histogram")
+            for stage, hist in sorted(self.stages.items()):
+                histogram("stage_duration_seconds", {"stage": stage}, hist)
+
+        vistos = set()
+        for name, help_text, kind, labels, value in gauges:
+            if name not in vistos:
+                vistos.add(name)
+                header(name, help_text, kind)
+            out.append(f"{name}{prom_labels(labels)} {value}")
+        return "\n".join(out) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+# etapas da requisição corrente: [(nome, segundos)]; None fora de requisição
+_request_stages: contextvars.ContextVar = contextvars.ContextVar("request_stages", default=None)
+
+
+@contextmanager
+def span(stage: str):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - inicio
+        METRICS.observe_stage(stage, elapsed)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+
+def timed_stream(stage: str, stream: Iterator) -> Iterator:
+    # span para geradores: soma só o tempo gasto produzindo cada pedaço
+    total = 0.0
+    try:
+        while True:
+            inicio = time.perf_counter()
+            try:
+                item = next(stream)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - inicio
+            yield item
+    finally:
+        METRICS.observe_stage(stage, total)
+        stages = _request_stages.get()
+        if stages is not None:
+            stages.append((stage, total))
+
+
+class MetricsMiddleware:
+    # ASGI puro (não BaseHTTPMiddleware) para contar bytes de respostas em
+    # streaming sem bufferizar o corpo
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        status = 500
+        size_in = 0
+        size_out = 0
+        stages: List[tuple] = []
+        token = _request_stages.set(stages)
+
+        async def receive_wrapper():
+            nonlocal size_in
+            message = await receive()
+            if message["type"] == "http.request":
+                size_in += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, size_out
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size_out += len(message.get("body", b""))
+            await send(message)
+
+        with METRICS._lock:
+            METRICS.in_flight += 1
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            with METRICS._lock:
+                METRICS.in_flight -= 1
+            _request_stages.reset(token)
+            elapsed = time.perf_counter() - inicio
+            route = scope.get("route")
+            # template da rota (/chamados/{chamado_id}), não o path: cardinalidade fixa
+            route_path = getattr(route, "path", None) or "<sem rota>"
+            METRICS.observe_request(scope["method"], route_path, status, elapsed, size_in, size_out)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                etapas = ", ".join(f"{nome}={seg * 1000:.0f}ms" for nome, seg in stages) or "-"
+                logger.warning(
+                    "Requisição lenta: %s %s -> %d em %.0f ms (%s)",
+                    scope["method"], scope["path"], status, elapsed * 1000, etapas,
+                )
+
+
+app.add_middleware(MetricsMiddleware)
+
+# ---------------- Estado compartilhado ----------------
+# Tokens, chamados e status de jobs ficam atrás de um StateBackend:
+#  - "memory" (padrão): dicionários do próprio processo, como sempre foi.
+#  - "sqlite": arquivo STATE_DB em modo WAL, compartilhado pelos workers da
+#    mesma máquina (o WAL coordena leitores e escritor por um índice em
+#    memória compartilhada, então leitura não bloqueia escrita).
+#    Obrigatório com WEB_WORKERS > 1.
+# Interface: chave/valor com prazo de coleta (ttl) e logs append-only com
+# seq global por stream (usado pelo store de chamados). O ttl só diz quando
+# a chave pode ser coletada; quem lê confere a validade do valor.
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB = Path(os.environ.get("STATE_DB", os.path.join("files", "state.db")))
+STATE_SYNC_INTERVAL = float(os.environ.get("STATE_SYNC_INTERVAL", "0.5"))
+
+
+class StateBackend(abc.ABC):
+    shared = False  # True quando outros processos enxergam as mesmas chaves
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Any:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def append(self, stream: str, record: dict) -> int:
+        ...
+
+    @abc.abstractmethod
+    def read(self, stream: str, after: int) -> List[tuple]:
+        # [(seq, record)] com seq > after, em ordem crescente
+        ...
+
+    @abc.abstractmethod
+    def trim(self, stream: str, upto: int):
+        ...
+
+    @abc.abstractmethod
+    def metrics(self) -> Dict[str, Any]:
+        ...
+
+
+class MemoryStateBackend(StateBackend):
+    # Expirações num heap com remoção preguiçosa: cada escrita descarta as
+    # vencidas do topo, custo amortizado O(1) por chave.
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}  # key -> (value, expira_em)
+        self._heap: List[tuple] = []       # (expira_em, key)
+        self._logs: Dict[str, List[tuple]] = {}
+        self._seqs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expira_em, key = heapq.heappop(heap)
+            item = self._data.get(key)
+            if item is not None and item[1] == expira_em:
+                del self._data[key]
+
+    def get(self, key: str) -> Any:
+        item = self._data.get(key)
+        return None if item is None else item[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            expira_em = now + ttl if ttl is not None else None
+            self._data[key] = (value, expira_em)
+            if expira_em is not None:
+                heapq.heappush(self._heap, (expira_em, key))
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._sweep(time.time())
+            return self._data.pop(key, None) is not None
+
+    def append(self, stream: str, record: dict) -> int:
+        with self._lock:
+            seq = self._seqs.get(stream, 0) + 1
+            self._seqs[stream] = seq
+            self._logs.setdefault(stream, []).append((seq, record))
+            return seq
+
+    def read(self, stream: str, after: int) -> List[tuple]:
+        with self._lock:
+            log = self._logs.get(stream, [])
+            start = bisect.bisect_right([seq for seq, _ in log], after)
+            return log[start:]
+
+    def trim(self, stream: str, upto: int):
+        with self._lock:
+            self._logs[stream] = [item for item in self._logs.get(stream, []) if item[0] > upto]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep(time.time())
+            return {"backend": "memory", "keys": len(self._data), "heap": len(self._heap)}
+
+
+class SQLiteStateBackend(StateBackend):
+    # Uma conexão por thread; valores em JSON. A coleta das chaves vencidas
+    # usa o índice de expira_em e roda no máximo uma vez por segundo.
+    shared = True
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expira_em REAL);
+            CREATE INDEX IF NOT EXISTS kv_expira ON kv (expira_em) WHERE expira_em IS NOT NULL;
+            CREATE TABLE IF NOT EXISTS log (
+                stream TEXT NOT NULL, seq INTEGER NOT NULL, record TEXT NOT NULL,
+                PRIMARY KEY (stream, seq)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS streams (stream TEXT PRIMARY KEY, seq INTEGER NOT NULL);
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _sweep(self, conn: sqlite3.Connection, now: float):
+        if now - self._last_sweep < 1:
+            return
+        self._last_sweep = now
+        conn.execute("DELETE FROM kv WHERE expira_em IS NOT NULL AND expira_em <= ?", (now,))
+
+    def get(self, key: str) -> Any:
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._conn()
+        now = time.time()
+        self._sweep(conn, now)
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, value, expira_em) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), now + ttl if ttl is not None else None),
+        )
+
+    def delete(self, key: str) -> bool:
+        conn = self._conn()
+        self._sweep(conn, time.time())
+        return conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+
+    def append(self, stream: str, record: dict) -> int:
+        conn = self._conn()
+        # BEGIN IMMEDIATE pega o lock de escrita antes de ler o contador
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = conn.execute(
+                "INSERT INTO streams (stream, seq) VALUES (?, 1) "
+                "ON CONFLICT (stream) DO UPDATE SET seq = seq + 1 RETURNING seq",
+                (stream,),
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO log (stream, seq, record) VALUES (?, ?, ?)",
+                (stream, seq, json.dumps(record, ensure_ascii=False)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return seq
+
+    def read(self, stream: str, after: int) -> List[tuple]:
+        rows = self._conn().execute(
+            "SELECT seq, record FROM log WHERE stream = ? AND seq > ? ORDER BY seq", (stream, after)
+        ).fetchall()
+        return [(seq, json.loads(record)) for seq, record in rows]
+
+    def trim(self, stream: str, upto: int):
+        self._conn().execute("DELETE FROM log WHERE stream = ? AND seq <= ?", (stream, upto))
+
+    def metrics(self) -> Dict[str, Any]:
+        conn = self._conn()
+        self._sweep(conn, time.time())
+        return {
+            "backend": "sqlite",
+            "path": str(self.path),
+            "keys": conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0],
+            "log_rows": conn.execute("SELECT COUNT(*) FROM log").fetchone()[0],
+        }
+
+
+def make_state_backend(kind: str) -> StateBackend:
+    if kind == "memory":
+        return MemoryStateBackend()
+    if kind == "sqlite":
+        return SQLiteStateBackend(STATE_DB)
+    raise ValueError(f"STATE_BACKEND inválido: {kind}")
+
+
+STATE = make_state_backend(STATE_BACKEND)
+
 # ---------------- Auth / Roles ----------------
 
 allowed_credentials = {
@@ -83,7 +547,6 @@ allowed_credentials = {
     "NovaSP":{"password": "cmnsp2025", "role": "comum"}
 }
 
-active_tokens = {}
 TOKEN_EXPIRATION = 3600  # 1h
 
 ROLE_LEVEL = {
@@ -92,14 +555,103 @@ ROLE_LEVEL = {
     "ti": 3
 }
 
+# Dois modos de token, escolhidos por TOKEN_MODE:
+#  - "store" (padrão): uuid opaco guardado no StateBackend. As expirações
+#    ficam no heap (memória) ou no índice de expira_em (SQLite) e são
+#    coletadas a cada escrita, então tokens abandonados não se acumulam.
+#  - "signed": token autocontido "payload.assinatura" (HMAC-SHA256 com
+#    TOKEN_SECRET). Qualquer worker valida sem consultar estado; só o logout
+#    grava uma revogação no StateBackend, válida até o token expirar.
+TOKEN_MODE = os.environ.get("TOKEN_MODE", "store")
+TOKEN_SECRET = os.environ.get("TOKEN_SECRET", "").encode()
+
+
+def _b64e(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64d(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class TokenStore:
+    def __init__(self, ttl: float, mode: str = "store", secret: bytes = b"", backend: Optional[StateBackend] = None):
+        if mode not in ("store", "signed"):
+            raise ValueError(f"TOKEN_MODE inválido: {mode}")
+        if mode == "signed" and not secret:
+            # sem segredo compartilhado os tokens só valem neste processo
+            logger.warning("TOKEN_SECRET ausente; usando segredo aleatório por processo")
+            secret = os.urandom(32)
+        self.ttl = ttl
+        self.mode = mode
+        self.secret = secret
+        # modo store: "token:<t>" -> info; modo signed: "revoked:<t>" -> 1.
+        # As chaves vencem junto com o token (heap/índice de expiração do backend).
+        self.backend = backend if backend is not None else MemoryStateBackend()
+
+    def _sign(self, payload: str) -> str:
+        return _b64e(hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, username: str, role: str) -> str:
+        info = {"user": username, "role": role, "expira_em": time.time() + self.ttl}
+        if self.mode == "signed":
+            payload = _b64e(json.dumps(
+                {"u": username, "r": role, "e": info["expira_em"], "n": uuid.uuid4().hex[:8]},
+                separators=(",", ":"),
+            ).encode())
+            return f"{payload}.{self._sign(payload)}"
+
+        token = str(uuid.uuid4())
+        self.backend.set(f"token:{token}", info, ttl=self.ttl)
+        return token
+
+    def _decode(self, token: str) -> Optional[dict]:
+        payload, _, signature = token.partition(".")
+        try:
+            if not signature or not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64d(payload))
+            return {"user": claims["u"], "role": claims["r"], "expira_em": float(claims["e"])}
+        except (UnicodeError, ValueError, TypeError, KeyError):
+            # lixo no header (ex.: caracteres fora do ASCII): só um token inválido
+            return None
+
+    def lookup(self, token: str) -> Optional[dict]:
+        # None = inválido; expirado volta (para a mensagem certa) e já sai do
+        # backend aqui, sem esperar a próxima escrita
+        if self.mode == "signed":
+            info = self._decode(token)
+            if info is None:
+                return None
+            if time.time() > info["expira_em"]:
+                self.backend.delete(f"revoked:{token}")
+                return info
+            if self.backend.get(f"revoked:{token}") is not None:
+                return None
+            return info
+        info = self.backend.get(f"token:{token}")
+        if info is not None and time.time() > info["expira_em"]:
+            self.backend.delete(f"token:{token}")
+        return info
+
+    def revoke(self, token: str) -> bool:
+        if self.mode == "store":
+            return self.backend.delete(f"token:{token}")
+        info = self._decode(token)
+        if info is None or self.backend.get(f"revoked:{token}") is not None:
+            return False
+        self.backend.set(f"revoked:{token}", 1, ttl=max(0.0, info["expira_em"] - time.time()))
+        return True
+
+    def metrics(self) -> dict:
+        return {"mode": self.mode, **self.backend.metrics()}
+
+
+TOKEN_STORE = TokenStore(TOKEN_EXPIRATION, TOKEN_MODE, TOKEN_SECRET, STATE)
+
+
 def make_token(username: str, role: str) -> str:
-    token = str(uuid.uuid4())
-    active_tokens[token] = {
-        "user": username,
-        "role": role,
-        "expira_em": time.time() + TOKEN_EXPIRATION
-    }
-    return token
+    return TOKEN_STORE.issue(username, role)
 
 
 def verify_token_header(auth_header: Optional[str]) -> Dict[str, Any]:
@@ -107,13 +659,15 @@ def verify_token_header(auth_header: Optional[str]) -> Dict[str, Any]:
         raise HTTPException(status_code=401, detail="Token ausente")
 
     token = auth_header.split(" ", 1)[1]
-    info = active_tokens.get(token)
+    if not token.isascii():
+        # tokens emitidos aqui são sempre ASCII; o resto é header malformado
+        raise HTTPException(status_code=401, detail="Token malformado")
+    info = TOKEN_STORE.lookup(token)
 
     if not info:
         raise HTTPException(status_code=403, detail="Token inválido")
 
     if time.time() > info["expira_em"]:
-        active_tokens.pop(token, None)
         raise HTTPException(status_code=403, detail="Token expirado")
 
     return info
@@ -125,42 +679,381 @@ def require_role(info: Dict[str, Any], minimum_role: str):
         raise HTTPException(status_code=403, detail="Permissão insuficiente")
 
 # ---------------- Helpers de arquivos / excel ----------------
+def fold_text(value: Any) -> str:
+    # remove acentos (NFKD) e normaliza caixa — base de normalize_columns e das buscas
+    value = unicodedata.normalize("NFKD", str(value))
+    value = value.encode("ascii", "ignore").decode("ascii")
+    return value.lower().strip()
+
+def normalize_column_name(col: Any) -> str:
+    return re.sub(r"\s+", "_", fold_text(col))
+
 def save_uploaded_file(file: UploadFile) -> Path:
     file_id = str(uuid.uuid4())
     dest = TMP_DIR / f"{file_id}_{Path(file.filename).name}"
     with open(dest, "wb") as f:
-        f.write(file.file.read())
+        shutil.copyfileobj(file.file, f, length=1024 * 1024)
     logger.info("Upload salvo: %s", dest)
     return dest
 
-def read_workbook_sheets(path: Path) -> List[str]:
-    xl = pd.ExcelFile(path)
-    return xl.sheet_names
+def save_uploaded_file_hashed(file: UploadFile, chunk_size: int = 1024 * 1024) -> tuple:
+    # como save_uploaded_file, calculando o sha256 na mesma passada -> (path, sha256)
+    file_id = str(uuid.uuid4())
+    dest = TMP_DIR / f"{file_id}_{Path(file.filename).name}"
+    h = hashlib.sha256()
+    with open(dest, "wb") as f:
+        for chunk in iter(lambda: file.file.read(chunk_size), b""):
+            h.update(chunk)
+            f.write(chunk)
+    logger.info("Upload salvo: %s", dest)
+    return dest, h.hexdigest()
 
-def make_response_file(df: pd.DataFrame, filename: str = "saida.xlsx"):
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx")
-    df.to_excel(tmp.name, index=False)
-    tmp.close()
+def read_workbook_sheets(path: Path, digest: Optional[str] = None) -> List[str]:
+    # com o sha256 do arquivo, os nomes das abas vêm do cache de parse
+    def load():
+        if path.suffix.lower() == ".csv":
+            return []
+        return pd.ExcelFile(path).sheet_names
 
-    def iterfile():
-        try:
-            with open(tmp.name, "rb") as f:
-                yield from f
-        finally:
+    return PARSE_CACHE.sheets(digest, load) if digest else load()
+
+def sniff_csv_separator(path: Path) -> str:
+    with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+        amostra = f.read(64 * 1024)
+    try:
+        return csv.Sniffer().sniff(amostra, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+def iter_sheet_chunks(path: Path, chunk_rows: int = 50_000, on_header=None):
+    # Lê .xlsx/.csv em blocos de chunk_rows linhas sem carregar a planilha inteira.
+    # on_header(colunas) é chamado antes da primeira linha de dados: quem chama
+    # pode validar o cabeçalho e abortar sem ler o resto do arquivo.
+    suffix = path.suffix.lower()
+    if suffix == ".csv":
+        sep = sniff_csv_separator(path)
+        if on_header is not None:
+            on_header(list(pd.read_csv(path, nrows=0, sep=sep, encoding="utf-8-sig").columns))
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype=str, sep=sep, encoding="utf-8-sig")
+        return
+
+    if suffix not in (".xlsx", ".xlsm"):
+        # .xls e afins: openpyxl não lê, cai no read_excel completo
+        df = pd.read_excel(path)
+        if on_header is not None:
+            on_header(list(df.columns))
+        yield df
+        return
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) if c is not None else f"coluna_{i}" for i, c in enumerate(header)]
+        if on_header is not None:
+            on_header(columns)
+        while True:
+            block = list(itertools.islice(rows, chunk_rows))
+            if not block:
+                break
+            yield pd.DataFrame.from_records(block, columns=columns)
+    finally:
+        wb.close()
+
+# ---------------- Exportação (xlsx / csv / csv.gz) ----------------
+# Os writers recebem um iterável de DataFrames e devolvem um gerador de bytes:
+# a resposta começa a sair enquanto as linhas ainda estão sendo geradas e a
+# memória fica limitada ao bloco atual. O XLSX é montado direto no zip
+# (inlineStr, sem sharedStrings), sem passar pelo openpyxl.
+XLSX_MEDIA = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = {
+    "xlsx": (XLSX_MEDIA, ".xlsx"),
+    "csv": ("text/csv; charset=utf-8", ".csv"),
+    "csv.gz": ("application/gzip", ".csv.gz"),
+}
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "20000"))
+
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+_EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # estilo 1 = data/hora (numFmt 22 embutido no Excel)
+    "xl/styles.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="22" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+
+class _ByteSink(io.RawIOBase):
+    # destino não-seekable do zipfile: acumula e é drenado a cada bloco
+    def __init__(self):
+        self.buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.buf += b
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = bytes(self.buf)
+        self.buf.clear()
+        return out
+
+
+def _xml_text(value: Any) -> str:
+    return xml_escape(_XML_ILLEGAL.sub("", str(value)))
+
+
+def _xlsx_rows(chunk: pd.DataFrame) -> str:
+    kinds = []
+    for col in chunk.columns:
+        dtype = chunk[col].dtype
+        if pd.api.types.is_bool_dtype(dtype):
+            kinds.append("b")
+        elif pd.api.types.is_numeric_dtype(dtype):
+            kinds.append("n")
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            kinds.append("d")
+        else:
+            kinds.append("s")
+
+    parts = []
+    for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+        parts.append("<row>")
+        for kind, value in zip(kinds, row):
+            if value is None:
+                parts.append("<c/>")
+            elif kind == "n" or (kind == "s" and isinstance(value, (int, float)) and not isinstance(value, bool)):
+                parts.append(f"<c><v>{value}</v></c>")
+            elif kind == "b" or isinstance(value, bool):
+                parts.append(f'<c t="b"><v>{int(value)}</v></c>')
+            elif kind == "d" or isinstance(value, (pd.Timestamp, datetime)):
+                serial = (pd.Timestamp(value).tz_localize(None) - _EXCEL_EPOCH) / pd.Timedelta(days=1)
+                parts.append(f'<c s="1"><v>{serial}</v></c>')
+            else:
+                parts.append(f'<c t="inlineStr"><is><t xml:space="preserve">{_xml_text(value)}</t></is></c>')
+        parts.append("</row>")
+    return "".join(parts)
+
+
+def stream_xlsx(chunks) -> Iterator[bytes]:
+    sink = _ByteSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for name, content in _XLSX_STATIC.items():
+            zf.writestr(name, content)
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            header_written = False
+            for chunk in chunks:
+                if not header_written:
+                    header = "".join(
+                        f'<c t="inlineStr"><is><t>{_xml_text(c)}</t></is></c>' for c in chunk.columns
+                    )
+                    sheet.write(f"<row>{header}</row>".encode("utf-8"))
+                    header_written = True
+                sheet.write(_xlsx_rows(chunk).encode("utf-8"))
+                yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+def stream_csv(chunks) -> Iterator[bytes]:
+    # ; + BOM: é o que o Excel em pt-BR abre sem assistente de importação
+    first = True
+    for chunk in chunks:
+        text = chunk.to_csv(index=False, header=first, sep=";", lineterminator="\n")
+        yield (("\ufeff" if first else "") + text).encode("utf-8")
+        first = False
+
+
+def stream_csv_gz(chunks) -> Iterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> cabeçalho gzip
+    for data in stream_csv(chunks):
+        out = gz.compress(data)
+        if out:
+            yield out
+    yield gz.flush()
+
+
+EXPORT_WRITERS = {"xlsx": stream_xlsx, "csv": stream_csv, "csv.gz": stream_csv_gz}
+
+
+def iter_frame_chunks(df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+# .tmp de export interrompido (crash no meio da gravação) some no próximo start
+EXPORT_CACHE_TMP_GRACE = int(os.environ.get("EXPORT_CACHE_TMP_GRACE", str(60 * 60)))
+
+
+class ExportCache:
+    # exports prontos por (file_id, impressão digital do filtro, formato).
+    # Datasets não mudam depois do upload, então a chave nunca fica velha;
+    # o limite é só de espaço (LRU por bytes).
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._files: "OrderedDict[str, tuple]" = OrderedDict()  # chave -> (path, size)
+        self._lock = threading.Lock()
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self._scan()
+
+    def _scan(self):
+        # exports de antes do restart voltam ao índice (mais antigo primeiro);
+        # .tmp recente pode ser um export em andamento em outro worker
+        limite = time.time() - EXPORT_CACHE_TMP_GRACE
+        found = []
+        for p in self.directory.iterdir():
             try:
-                os.remove(tmp.name)
-            except Exception:
-                logger.exception("Falha ao remover arquivo temporário: %s", tmp.name)
+                st = p.stat()
+                if p.name.startswith("."):
+                    if st.st_mtime < limite:
+                        p.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            found.append((st.st_mtime, p, st.st_size))
+        for _, p, size in sorted(found, key=lambda item: item[0]):
+            self._files[p.name] = (p, size)
+            self.bytes_held += size
+        self._trim()
+
+    def _trim(self):
+        while self.bytes_held > self.max_bytes and len(self._files) > 1:
+            _, (old_path, old_size) = self._files.popitem(last=False)
+            old_path.unlink(missing_ok=True)
+            self.bytes_held -= old_size
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> Optional[Path]:
+        with self._lock:
+            item = self._files.get(key)
+            if item is None or not item[0].exists():
+                self.misses += 1
+                return None
+            self._files.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def _store(self, key: str, tmp: Path):
+        path = self.directory / key
+        os.replace(tmp, path)
+        size = path.stat().st_size
+        with self._lock:
+            old = self._files.pop(key, None)
+            if old:
+                self.bytes_held -= old[1]
+            self._files[key] = (path, size)
+            self.bytes_held += size
+            self._trim()
+
+    def tmp_path(self, key: str) -> Path:
+        return self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+
+    def publish(self, key: str, tmp: Path) -> Path:
+        # export gravado inteiro em tmp (no CPU_POOL): entra no cache por rename
+        self._store(key, tmp)
+        return self.directory / key
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._files),
+                "bytes_held": self.bytes_held,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+EXPORT_CACHE = ExportCache(
+    TMP_DIR / "exports",
+    int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+)
 
+
+def write_export(view: "DatasetView", formato: str, out: str) -> Optional[tuple]:
+    # roda no CPU_POOL (thread ou processo filho) e grava o export inteiro em
+    # out. Erro HTTP volta como (status, detail): HTTPException não passa no pickle.
+    try:
+        with span("export"), open(out, "wb") as f:
+            for data in EXPORT_WRITERS[formato](view.iter_chunks()):
+                f.write(data)
+    except HTTPException as e:
+        Path(out).unlink(missing_ok=True)
+        return e.status_code, e.detail
+    except BaseException:
+        Path(out).unlink(missing_ok=True)
+        raise
+    return None
+
+
+def make_response_file(df, filename: str = "saida.xlsx"):
+    # df pode ser um DataFrame ou um iterável de DataFrames (processamento em blocos)
+    chunks = iter_frame_chunks(df) if isinstance(df, pd.DataFrame) else df
     headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
-    return StreamingResponse(iterfile(), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers=headers)
+    return StreamingResponse(timed_stream("export", stream_xlsx(chunks)), media_type=XLSX_MEDIA, headers=headers)
 
 def cleanup_temp_files(older_than_seconds: int = 60*60*24):
     now_ts = time.time()
     removed = 0
     for p in TMP_DIR.iterdir():
         try:
-            if p.is_file():
+            if p.is_file() and p != FILTERS_FILE:
                 age = now_ts - p.stat().st_mtime
                 if age > older_than_seconds:
                     p.unlink(missing_ok=True)
@@ -170,6 +1063,26 @@ def cleanup_temp_files(older_than_seconds: int = 60*60*24):
     logger.info("cleanup_temp_files removed=%d", removed)
     return removed
 
+# limpeza periódica do TMP_DIR (antes a função existia mas nunca era chamada)
+TMP_CLEANUP_INTERVAL = int(os.environ.get("TMP_CLEANUP_INTERVAL", str(60 * 60)))
+TMP_MAX_AGE = int(os.environ.get("TMP_MAX_AGE", str(60 * 60 * 24)))
+
+
+def cleanup_loop():
+    while True:
+        try:
+            with span("cleanup_temp_files"):
+                cleanup_temp_files(TMP_MAX_AGE)
+        except Exception:
+            logger.exception("Falha na limpeza de temporários")
+        time.sleep(TMP_CLEANUP_INTERVAL)
+
+
+@app.on_event("startup")
+def start_cleanup():
+    if TMP_CLEANUP_INTERVAL > 0:
+        threading.Thread(target=cleanup_loop, name="tmp-cleanup", daemon=True).start()
+
 # ---------------- Routes - Auth ----------------
 @app.post("/login")
 def login(payload: Dict[str, str] = Body(...)):
@@ -197,8 +1110,7 @@ def login(payload: Dict[str, str] = Body(...)):
 @app.post("/logout")
 def logout(payload: Dict[str, str] = Body(...)):
     token = payload.get("token")
-    if token and token in active_tokens:
-        del active_tokens[token]
+    if token and TOKEN_STORE.revoke(token):
         return {"success": True, "message": "Logout realizado"}
     raise HTTPException(status_code=404, detail="Token não encontrado")
 
@@ -213,34 +1125,504 @@ def current_user(authorization: Optional[str] = Header(None)):
     }
 
 
+# ---------------- Serialização JSON ----------------
+# Listas grandes (catálogo, chamados) não passam pelo jsonable_encoder:
+#  - DataFrame vai direto para bytes pelo encoder do pandas (em C, por coluna);
+#  - dicts vão pelo orjson quando instalado (json da stdlib como reserva).
+# Com "Accept: application/x-ndjson" a resposta sai em streaming, um registro
+# por linha e em blocos, então o primeiro byte e o pico de memória não crescem
+# com o tamanho da lista. Compressão negociada pelo Accept-Encoding: br (com o
+# pacote brotli) ou gzip, só acima de JSON_COMPRESS_MIN bytes.
+JSON_COMPRESS_MIN = int(os.environ.get("JSON_COMPRESS_MIN", "1024"))
+NDJSON_CHUNK_ROWS = int(os.environ.get("NDJSON_CHUNK_ROWS", "5000"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def json_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def frame_ndjson_chunks(df: pd.DataFrame, chunk_rows: int = NDJSON_CHUNK_ROWS) -> Iterator[bytes]:
+    for start in range(0, len(df), chunk_rows):
+        bloco = df.iloc[start:start + chunk_rows]
+        yield bloco.to_json(orient="records", lines=True, force_ascii=False, date_format="iso").encode("utf-8")
+
+
+def records_ndjson_chunks(itens: List[Any], chunk_rows: int = 500) -> Iterator[bytes]:
+    for start in range(0, len(itens), chunk_rows):
+        yield b"".join(json_bytes(item) + b"\n" for item in itens[start:start + chunk_rows])
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def pick_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    aceitas: Dict[str, float] = {}
+    for parte in (accept_encoding or "").split(","):
+        nome, _, params = parte.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            chave, _, valor = param.strip().partition("=")
+            if chave == "q":
+                try:
+                    q = float(valor)
+                except ValueError:
+                    q = 0.0
+        if nome.strip():
+            aceitas[nome.strip().lower()] = q
+    for encoding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if aceitas.get(encoding, aceitas.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return gz.compress(body) + gz.flush()
+
+
+def compress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    # flush a cada bloco: o cliente já consegue processar o que chegou
+    if encoding == "br":
+        comp = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            out = comp.process(chunk) + comp.flush()
+            if out:
+                yield out
+        yield comp.finish()
+        return
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = gz.compress(chunk) + gz.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield gz.flush()
+
+
+def encoded_response(
+    body: bytes,
+    accept_encoding: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+    cache: Optional[Dict[str, bytes]] = None,
+) -> Response:
+    # cache: dicionário encoding -> corpo comprimido, para corpos fixos (catálogo)
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    encoding = pick_encoding(accept_encoding) if len(body) >= JSON_COMPRESS_MIN else None
+    if encoding:
+        compressed = cache.get(encoding) if cache is not None else None
+        if compressed is None:
+            with span("compress"):
+                compressed = compress_body(body, encoding)
+            if cache is not None:
+                cache[encoding] = compressed
+        body = compressed
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def ndjson_response(
+    chunks: Iterator[bytes],
+    accept_encoding: Optional[str],
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    chunks = timed_stream("serialize", chunks)
+    encoding = pick_encoding(accept_encoding)
+    if encoding:
+        chunks = compress_stream(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(chunks, media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+# ---------------- Cache do catálogo de materiais ----------------
+# O CODIGOS.xlsx é lido uma única vez e mantido em forma colunar; o corpo JSON,
+# o ETag e o Last-Modified ficam pré-calculados. Invalidação por mtime/tamanho
+# e, se o arquivo mudou de data mas não de conteúdo, pelo checksum.
+class CatalogSnapshot:
+    __slots__ = ("df", "body", "encoded", "index", "etag", "last_modified", "signature", "checksum")
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        body: bytes,
+        index: "MateriaisIndex",
+        signature: tuple,
+        checksum: str,
+        encoded: Optional[Dict[str, bytes]] = None,
+    ):
+        self.df = df
+        self.body = body
+        self.encoded = encoded if encoded is not None else {}  # encoding -> body comprimido
+        self.index = index
+        self.etag = f'"{checksum}"'
+        self.last_modified = formatdate(signature[0] / 1e9, usegmt=True)
+        self.signature = signature
+        self.checksum = checksum
+
+
+def file_checksum(path: Path, chunk_size: int = 1024 * 1024, algorithm: str = "sha1") -> str:
+    h = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compact_catalog(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = [str(c).strip() for c in df.columns]
+    for col in df.columns:
+        serie = df[col]
+        if serie.dtype == object or pd.api.types.is_string_dtype(serie):
+            # colunas repetitivas (ex.: CATEGORIA) viram category
+            if serie.nunique(dropna=True) <= max(1, len(serie) // 2):
+                df[col] = serie.astype("category")
+    return df
+
+
+def normalize_codes(serie: pd.Series) -> pd.Series:
+    # 30001122, 30001122.0 e " 30001122 " viram a mesma chave
+    out = serie.astype(str).str.strip().str.replace(r"\.0+$", "", regex=True)
+    return out.where(serie.notna(), None).astype(object)
+
+
+class MateriaisIndex:
+    # Índice montado junto com o catálogo. Todas as estruturas guardam posições
+    # de linha ordenadas (np.int64), então filtros viram interseções e a
+    # paginação por cursor é um searchsorted.
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        folded_cols = {fold_text(c): c for c in df.columns}
+        self.columns = folded_cols
+        self.code_col = next((c for k, c in folded_cols.items() if "codigo" in k), None)
+        self.desc_col = next((c for k, c in folded_cols.items() if "descricao" in k), None)
+
+        codes = self._folded(df, self.code_col)
+        descs = self._folded(df, self.desc_col)
+
+        # tabela de junção para /processar_materiais (uma linha por código)
+        self.join_frame = (
+            df.assign(_codigo=normalize_codes(df[self.code_col]))
+            .drop_duplicates("_codigo")
+            .drop(columns=[self.code_col])
+            if self.code_col else None
+        )
+
+        # busca por substring: um único array com "codigo descricao" já dobrado
+        self.haystack = (codes + "\x00" + descs).to_numpy(dtype=object)
+
+        # busca por prefixo: chaves ordenadas (código e cada palavra da descrição)
+        keys, rows = [codes.to_numpy(dtype=object)], [np.arange(self.n, dtype=np.int64)]
+        words = descs.str.split()
+        exploded = words.explode().dropna()
+        keys.append(exploded.to_numpy(dtype=object))
+        rows.append(exploded.index.to_numpy(dtype=np.int64))
+        keys = np.concatenate(keys).astype(str)
+        rows = np.concatenate(rows)
+        order = np.argsort(keys, kind="stable")
+        self.prefix_keys = keys[order]
+        self.prefix_rows = rows[order]
+
+        # filtros de igualdade: valor dobrado -> posições, por coluna
+        self.postings: Dict[str, Dict[str, np.ndarray]] = {}
+        for folded, col in folded_cols.items():
+            values = self._folded(df, col)
+            groups = pd.Series(np.arange(self.n, dtype=np.int64)).groupby(values.to_numpy()).indices
+            self.postings[folded] = {k: np.asarray(v, dtype=np.int64) for k, v in groups.items()}
+
+    def _folded(self, df: pd.DataFrame, col: Optional[str]) -> pd.Series:
+        if col is None:
+            return pd.Series([""] * self.n, dtype=object)
+        serie = df[col]
+        return serie.astype(str).map(fold_text).where(serie.notna(), "").astype(object)
+
+    def prefix(self, termo: str) -> np.ndarray:
+        # as chaves são palavras soltas: cada palavra da busca casa por prefixo
+        # e a linha precisa ter todas ("reparo tubo" -> reparo* e tubo*)
+        rows: Optional[np.ndarray] = None
+        for palavra in termo.split():
+            lo = np.searchsorted(self.prefix_keys, palavra, side="left")
+            hi = np.searchsorted(self.prefix_keys, palavra + "\uffff", side="left")
+            hit = np.unique(self.prefix_rows[lo:hi])
+            rows = hit if rows is None else np.intersect1d(rows, hit, assume_unique=True)
+            if not len(rows):
+                break
+        return rows if rows is not None else np.empty(0, dtype=np.int64)
+
+    def substring(self, termo: str, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        rows = np.arange(self.n, dtype=np.int64) if candidates is None else candidates
+        if not len(rows):
+            return rows
+        hay = self.haystack[rows]
+        mask = np.fromiter((termo in h for h in hay), dtype=bool, count=len(hay))
+        return rows[mask]
+
+    def equals(self, coluna: str, valor: str) -> np.ndarray:
+        postings = self.postings.get(fold_text(coluna))
+        if postings is None:
+            raise HTTPException(status_code=400, detail=f"Coluna inválida para filtro: {coluna}")
+        return postings.get(fold_text(valor), np.empty(0, dtype=np.int64))
+
+    def search(self, q: str, modo: str, filtros: List[tuple]) -> np.ndarray:
+        rows: Optional[np.ndarray] = None
+        # filtros de igualdade primeiro: costumam ser os mais seletivos
+        for coluna, valor in filtros:
+            hit = self.equals(coluna, valor)
+            rows = hit if rows is None else np.intersect1d(rows, hit, assume_unique=True)
+
+        termo = fold_text(q)
+        if termo:
+            if modo == "prefixo":
+                hit = self.prefix(termo)
+                rows = hit if rows is None else np.intersect1d(rows, hit, assume_unique=True)
+            else:
+                rows = self.substring(termo, rows)
+
+        if rows is None:
+            rows = np.arange(self.n, dtype=np.int64)
+        return rows
+
+
+class MateriaisCatalog:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+
+    def _signature(self) -> tuple:
+        st = self.path.stat()
+        return (st.st_mtime_ns, st.st_size)
+
+    def _parse(self, path: Path) -> tuple:
+        with span("excel_parse"):
+            df = compact_catalog(pd.read_excel(path))
+        body = df.to_json(orient="records", force_ascii=False, date_format="iso").encode("utf-8")
+        index = MateriaisIndex(df)
+        logger.info("Catálogo de materiais carregado: %d linhas", len(df))
+        return df, body, index
+
+    def _load(self, signature: tuple, checksum: str) -> CatalogSnapshot:
+        df, body, index = self._parse(self.path)
+        return CatalogSnapshot(df, body, index, signature, checksum)
+
+    def publish(self, src: Path) -> CatalogSnapshot:
+        # planilha nova só entra no lugar da atual depois de lida e validada;
+        # se falhar, a atual continua servindo /materiais
+        try:
+            df, body, index = self._parse(src)
+        except Exception as e:
+            logger.warning("Planilha de materiais rejeitada: %s", e)
+            raise HTTPException(status_code=400, detail="Planilha de materiais ilegível")
+        if df.empty or index.code_col is None:
+            raise HTTPException(status_code=400, detail="Planilha de materiais sem linhas ou sem coluna de código")
+        with self._lock:
+            os.replace(src, self.path)
+            snap = CatalogSnapshot(df, body, index, self._signature(), file_checksum(self.path))
+            self._snapshot = snap
+            return snap
+
+    def get(self) -> CatalogSnapshot:
+        if not self.path.exists():
+            raise HTTPException(status_code=404, detail="Arquivo de materiais não encontrado")
+
+        snap = self._snapshot
+        signature = self._signature()
+        if snap is not None and snap.signature == signature:
+            return snap
+
+        with self._lock:
+            snap = self._snapshot
+            signature = self._signature()
+            if snap is not None and snap.signature == signature:
+                return snap
+            checksum = file_checksum(self.path)
+            if snap is not None and snap.checksum == checksum:
+                # só mudou o mtime: reaproveita o parse anterior
+                snap = CatalogSnapshot(snap.df, snap.body, snap.index, signature, checksum, snap.encoded)
+            else:
+                snap = self._load(signature, checksum)
+            self._snapshot = snap
+            return snap
+
+
+MATERIAIS_CATALOG = MateriaisCatalog(EXCEL_PATH)
+
+
+def not_modified(snap: CatalogSnapshot, if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    if if_none_match:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return snap.etag in tags or "*" in tags
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(snap.signature[0] / 1e9) <= int(since)
+    return False
+
+
 # ---------------- Routes - Materiais ----------------
 @app.get("/materiais")
-def listar_materiais():
+def listar_materiais(
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     try:
-        if not EXCEL_PATH.exists():
-            raise HTTPException(status_code=404, detail="Arquivo de materiais não encontrado")
-        df = pd.read_excel(EXCEL_PATH)
-        df.columns = [c.strip() for c in df.columns]
-        return df.to_dict(orient="records")
+        snap = MATERIAIS_CATALOG.get()
+        headers = {
+            "ETag": snap.etag,
+            "Last-Modified": snap.last_modified,
+            "Cache-Control": "no-cache",
+        }
+        if not_modified(snap, if_none_match, if_modified_since):
+            return Response(status_code=304, headers=headers)
+        if wants_ndjson(accept):
+            return ndjson_response(frame_ndjson_chunks(snap.df), accept_encoding, headers)
+        # corpo pronto no snapshot; a versão comprimida fica guardada junto
+        return encoded_response(snap.body, accept_encoding, headers, cache=snap.encoded)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Erro listar_materiais: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/materiais/search")
+def buscar_materiais(
+    q: str = Query(""),
+    modo: str = Query("contem", pattern="^(contem|prefixo)$"),
+    filtro: List[str] = Query([]),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+):
+    snap = MATERIAIS_CATALOG.get()
+
+    filtros = []
+    for f in filtro:
+        coluna, sep, valor = f.partition(":")
+        if not sep:
+            raise HTTPException(status_code=400, detail=f"Filtro inválido (use coluna:valor): {f}")
+        filtros.append((coluna, valor))
+
+    rows = snap.index.search(q, modo, filtros)
+
+    start = 0
+    if cursor:
+        try:
+            start = int(np.searchsorted(rows, int(cursor), side="right"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+
+    page = rows[start:start + limit]
+    next_cursor = str(int(page[-1])) if start + limit < len(rows) else None
+
+    items = snap.df.iloc[page].to_json(orient="records", force_ascii=False, date_format="iso")
+    body = (
+        '{"items":' + items
+        + ',"total":' + str(len(rows))
+        + ',"next_cursor":' + json.dumps(next_cursor) + "}"
+    )
+    return Response(content=body.encode("utf-8"), media_type="application/json")
+
+MATERIAIS_EXTENSOES = (".xlsx", ".xls")
+
 @app.post("/upload_materiais")
 def upload_materiais(file: UploadFile = File(...), authorization: Optional[str] = Header(None)):
     info = verify_token_header(authorization)
     if info["role"] != "admin":
         raise HTTPException(status_code=403, detail="Acesso negado")
-    if not file.filename.lower().endswith((".xlsx", ".xls")):
+    if not file.filename.lower().endswith(MATERIAIS_EXTENSOES):
         raise HTTPException(status_code=400, detail="Arquivo inválido")
+    tmp_path = EXCEL_PATH.with_name(f".{EXCEL_PATH.name}.{uuid.uuid4().hex}.tmp")
     try:
-        dest = EXCEL_PATH
-        with open(dest, "wb") as f:
-            f.write(file.file.read())
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(file.file, f, length=1024 * 1024)
+        return publish_materiais(tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def publish_materiais(path: Path) -> Dict[str, str]:
+    # troca atômica: leitores nunca veem um arquivo pela metade. O arquivo
+    # vai antes para o lado do EXCEL_PATH (o rename precisa do mesmo disco)
+    # e é validado lá, antes de substituir o atual.
+    tmp_path = EXCEL_PATH.with_name(f".{EXCEL_PATH.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.replace(path, tmp_path)
+        except OSError:
+            shutil.copyfile(path, tmp_path)
+        MATERIAIS_CATALOG.publish(tmp_path)
         return {"message": "Planilha atualizada com sucesso ✅"}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Erro upload_materiais: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+PROCESSAR_CHUNK_ROWS = int(os.environ.get("PROCESSAR_CHUNK_ROWS", "50000"))
+
+def enrich_chunks(chunks, index: "MateriaisIndex"):
+    # merge vetorizado de cada bloco com o catálogo; nada de loop por linha
+    catalogo = index.join_frame
+    code_col = None
+    for chunk in chunks:
+        if code_col is None:
+            folded = {normalize_column_name(c): c for c in chunk.columns}
+            code_col = next((c for k, c in folded.items() if "codigo" in k), chunk.columns[0])
+        chunk = chunk.assign(_codigo=normalize_codes(chunk[code_col]))
+        merged = chunk.merge(catalogo, on="_codigo", how="left", indicator=True, sort=False)
+        merged["Encontrado no catálogo"] = np.where(merged["_merge"] == "both", "Sim", "Não")
+        yield merged.drop(columns=["_codigo", "_merge"])
+
+PROCESSAR_EXTENSOES = (".xlsx", ".csv")
+
+@app.post("/processar_materiais")
+def processar_materiais(file: UploadFile = File(...), authorization: Optional[str] = Header(None)):
+    verify_token_header(authorization)
+    if not file.filename.lower().endswith(PROCESSAR_EXTENSOES):
+        raise HTTPException(status_code=400, detail="Arquivo inválido")
+
+    return processar_materiais_path(save_uploaded_file(file))
+
+
+def processar_materiais_path(path: Path):
+    # o arquivo em `path` passa a ser desta função (removido no fim do stream)
+    try:
+        snap = MATERIAIS_CATALOG.get()
+    except HTTPException:
+        path.unlink(missing_ok=True)
+        raise
+    if snap.index.join_frame is None:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail="Catálogo sem coluna de código")
+
+    chunks = enrich_chunks(iter_sheet_chunks(path, PROCESSAR_CHUNK_ROWS), snap.index)
+    try:
+        # o primeiro bloco é lido já aqui: arquivo ilegível ainda vira 400
+        first = next(chunks, None)
+    except Exception as e:
+        path.unlink(missing_ok=True)
+        logger.exception("Erro processar_materiais: %s", e)
+        raise HTTPException(status_code=400, detail="Erro ao processar planilha")
+
+    def stream():
+        # o resto é lido enquanto a resposta sai; o upload some no fim
+        try:
+            if first is not None:
+                yield first
+            yield from chunks
+        finally:
+            path.unlink(missing_ok=True)
+
+    return make_response_file(stream(), filename="materiais_processados.xlsx")
 
 # ---------------- Routes - Pendente (novo) ----------------
 
@@ -251,70 +1633,991 @@ BASE_DIR = "files"
 os.makedirs(BASE_DIR, exist_ok=True)
 
 
-FILES_ORIGINAL: Dict[str, pd.DataFrame] = {}
-FILES_FILTERED: Dict[str, pd.DataFrame] = {}
-FILTERS = []
+# ---------------- Presets de filtro (pendente) ----------------
+# Seleções nomeadas de contrato/atc/família/descrição, salvas em FILTERS_FILE
+# (lista JSON, gravada com rename atômico; a limpeza do TMP_DIR não a toca).
+# Cada preset tem uma versão que sobe a cada gravação; as máscaras compiladas
+# ficam no DatasetEntry (até PRESET_MASKS_MAX por dataset) e morrem com ele,
+# então dataset novo ou preset alterado sempre recompila. Com vários workers,
+# cada um relê o arquivo quando o mtime muda.
+PRESET_MASKS_MAX = int(os.environ.get("PRESET_MASKS_MAX", "16"))
+
+
+class FilterPresets:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[int] = None
+        self.items: Dict[str, Dict[str, Any]] = {}
+
+    def _reload(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self.items = None, {}
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            presets = json.loads(self.path.read_text(encoding="utf-8"))
+        except ValueError:
+            logger.exception("Presets de filtro ilegíveis em %s", self.path)
+            presets = []
+        self.items = {p["nome"]: p for p in presets}
+        self._mtime = mtime
+
+    def _save(self):
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(list(self.items.values()), ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._reload()
+            return sorted(self.items.values(), key=lambda p: p["nome"].lower())
+
+    def get(self, nome: str) -> Dict[str, Any]:
+        with self._lock:
+            self._reload()
+            preset = self.items.get(nome)
+        if preset is None:
+            raise HTTPException(status_code=404, detail="Preset não encontrado")
+        return preset
+
+    def save(self, nome: str, filtros: Dict[str, List[str]]) -> Dict[str, Any]:
+        filtros = {k: [str(v) for v in filtros[k]] for k in PENDENTE_DIMENSOES if filtros.get(k)}
+        with self._lock:
+            self._reload()
+            anterior = self.items.get(nome)
+            preset = {
+                "nome": nome,
+                "filtros": filtros,
+                "versao": (anterior["versao"] + 1) if anterior else 1,
+                "atualizado_em": datetime.now().isoformat(timespec="seconds"),
+            }
+            self.items[nome] = preset
+            self._save()
+            return preset
+
+    def delete(self, nome: str):
+        with self._lock:
+            self._reload()
+            if self.items.pop(nome, None) is None:
+                raise HTTPException(status_code=404, detail="Preset não encontrado")
+            self._save()
+
+
+FILTERS = FilterPresets(FILTERS_FILE)
+
+# ---------------- Store de datasets (pendente) ----------------
+# Cada upload vira uma entrada com contabilidade de memória
+# (memory_usage(deep=True)). O store respeita um orçamento global de bytes e
+# um TTL de inatividade; a ordem do OrderedDict é a ordem de uso (LRU).
+# Com pyarrow, a planilha é convertida uma vez para Parquet em
+# PENDENTE_SPILL_DIR e só as chaves de filtro ficam no heap; o restante é lido
+# com memory_map na exportação. Outro worker (ou o mesmo após restart)
+# reidrata a entrada a partir do arquivo.
+PENDENTE_SPILL_DIR = Path(BASE_DIR) / "pendente"
+PENDENTE_SPILL_DIR.mkdir(parents=True, exist_ok=True)
+PENDENTE_MAX_BYTES = int(os.environ.get("PENDENTE_MAX_BYTES", str(512 * 1024 * 1024)))
+PENDENTE_TTL = int(os.environ.get("PENDENTE_TTL", str(2 * 60 * 60)))  # 2h sem uso
+
+
+# chave do filtro -> coluna normalizada da planilha
+PENDENTE_DIMENSOES = {
+    "contratos": "contrato",
+    "atcs": "atc",
+    "familias": "familia",
+    "descricoes": "descricao_tss",
+}
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def atc_prefix(serie: pd.Series) -> pd.Series:
+    return serie.astype(str).str.split("-").str[0].str.strip()
+
+
+def build_filter_keys(df: pd.DataFrame) -> Dict[str, pd.Categorical]:
+    # Calculado uma vez no upload: cada dimensão vira códigos inteiros
+    # (NaN -> -1), então filtrar é só np.isin sobre inteiros.
+    keys = {}
+    for chave, col in PENDENTE_DIMENSOES.items():
+        serie = df[col]
+        valores = atc_prefix(serie) if chave == "atcs" else serie.astype(str)
+        keys[chave] = pd.Categorical(valores.where(serie.notna()))
+    return keys
+
+
+def categorical_bytes(cat: pd.Categorical) -> int:
+    return int(cat.codes.nbytes + cat.categories.memory_usage(deep=True))
+
+
+def spill_path(file_id: str, suffix: str = ".parquet") -> Path:
+    return PENDENTE_SPILL_DIR / f"{file_id}{suffix}"
+
+
+def valid_file_id(file_id: Optional[str]) -> bool:
+    # file_id vira nome de arquivo: só aceitamos UUIDs
+    try:
+        return str(uuid.UUID(str(file_id))) == file_id
+    except ValueError:
+        return False
+
+
+def arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    # colunas do Excel com tipos misturados (ex.: atc com números e textos)
+    # não têm tipo Arrow; viram texto preservando os vazios
+    mixed = [
+        c for c in df.columns
+        if df[c].dtype == object and pd.api.types.infer_dtype(df[c], skipna=True).startswith("mixed")
+    ]
+    if not mixed:
+        return df
+    return df.assign(**{c: df[c].astype(str).where(df[c].notna()) for c in mixed})
+
+
+def write_spill(df: pd.DataFrame, path: Path):
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        pq.write_table(pa.Table.from_pandas(arrow_safe(df), preserve_index=False), tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+class DatasetEntry:
+    __slots__ = (
+        "original", "path", "keys", "labels", "n_rows", "filtros",
+        "dim_masks", "mask", "preset_masks", "nbytes", "last_access",
+    )
+
+    def __init__(
+        self,
+        keys: Dict[str, pd.Categorical],
+        n_rows: int,
+        original: Optional[pd.DataFrame] = None,
+        path: Optional[Path] = None,
+    ):
+        self.original = original  # None quando o dataset está em Parquet
+        self.path = path
+        self.keys = keys
+        # categorias já vêm ordenadas do pd.Categorical
+        self.labels = {chave: cat.categories.astype(str).tolist() for chave, cat in keys.items()}
+        self.n_rows = n_rows
+        self.filtros: Dict[str, List[str]] = {}
+        self.dim_masks: Dict[str, np.ndarray] = {}  # máscara de cada dimensão filtrada
+        self.mask: Optional[np.ndarray] = None  # None = sem filtro
+        # presets já compilados neste dataset: (nome, versão) -> (filtros, dim_masks, mask)
+        self.preset_masks: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.nbytes = sum(categorical_bytes(c) for c in keys.values())
+        if original is not None:
+            self.nbytes += frame_bytes(original)
+        self.last_access = time.time()
+
+    def options(self, chave: str) -> List[str]:
+        return self.labels[chave]
+
+    def dimension_mask(self, chave: str, selecionados: List[str]) -> np.ndarray:
+        cat = self.keys[chave]
+        codes = cat.categories.get_indexer([str(v) for v in selecionados])
+        return np.isin(cat.codes, codes[codes >= 0])
+
+    def compute_mask(self, filtros: Dict[str, List[str]]) -> Optional[np.ndarray]:
+        mask = None
+        for chave in self.keys:
+            if filtros.get(chave):
+                hit = self.dimension_mask(chave, filtros[chave])
+                mask = hit if mask is None else (mask & hit)
+        return mask
+
+    @staticmethod
+    def _masks_bytes(dim_masks: Dict[str, np.ndarray], mask: Optional[np.ndarray]) -> int:
+        total = sum(m.nbytes for m in dim_masks.values())
+        if mask is not None and len(dim_masks) > 1:
+            total += mask.nbytes
+        return total
+
+    def _held_mask_bytes(self) -> int:
+        total = self._masks_bytes(self.dim_masks, self.mask)
+        for _, dims, mask in self.preset_masks.values():
+            total += self._masks_bytes(dims, mask)
+        return total
+
+    def set_filters(self, filtros: Dict[str, List[str]]) -> int:
+        # Incremental: só recalcula a máscara das dimensões cuja seleção mudou.
+        # Devolve a variação de bytes para a contabilidade do store.
+        before = self._held_mask_bytes()
+        novos = {k: list(filtros[k]) for k in PENDENTE_DIMENSOES if filtros.get(k)}
+        for chave in list(self.dim_masks):
+            if chave not in novos:
+                del self.dim_masks[chave]
+        for chave, selecionados in novos.items():
+            if chave not in self.dim_masks or self.filtros.get(chave) != selecionados:
+                self.dim_masks[chave] = self.dimension_mask(chave, selecionados)
+        self.filtros = novos
+
+        self.mask = self.combine(self.dim_masks)
+        return self._held_mask_bytes() - before
+
+    @staticmethod
+    def combine(dim_masks: Dict[str, np.ndarray]) -> Optional[np.ndarray]:
+        masks = list(dim_masks.values())
+        if not masks:
+            return None
+        if len(masks) == 1:
+            return masks[0]
+        return np.logical_and.reduce(masks)
+
+    def apply_preset(self, chave: tuple, filtros: Dict[str, List[str]]) -> int:
+        # A primeira aplicação compila as máscaras do preset neste dataset; as
+        # seguintes só trocam as referências (nenhum isin, nenhum and).
+        # chave = (nome, versão): preset alterado não reaproveita a compilação.
+        before = self._held_mask_bytes()
+        compiled = self.preset_masks.get(chave)
+        if compiled is None:
+            for antiga in [k for k in self.preset_masks if k[0] == chave[0]]:
+                del self.preset_masks[antiga]  # versão anterior do mesmo preset
+            novos = {k: list(filtros[k]) for k in PENDENTE_DIMENSOES if filtros.get(k)}
+            dims = {k: self.dimension_mask(k, v) for k, v in novos.items()}
+            compiled = self.preset_masks[chave] = (novos, dims, self.combine(dims))
+            while len(self.preset_masks) > PRESET_MASKS_MAX:
+                self.preset_masks.popitem(last=False)
+        else:
+            self.preset_masks.move_to_end(chave)
+        novos, dims, mask = compiled
+        # set_filters troca arrays em vez de alterar: dá para compartilhar
+        self.filtros = dict(novos)
+        self.dim_masks = dict(dims)
+        self.mask = mask
+        return self._held_mask_bytes() - before
+
+    def facets(self) -> Dict[str, Dict[str, int]]:
+        # Contagem cruzada: cada dimensão é contada sob os filtros das OUTRAS,
+        # então mostra quantas linhas restariam ao marcar cada opção.
+        # Um bincount sobre os códigos inteiros por dimensão.
+        out = {}
+        for chave, cat in self.keys.items():
+            others = [m for d, m in self.dim_masks.items() if d != chave]
+            codes = cat.codes
+            if others:
+                sel = others[0] if len(others) == 1 else np.logical_and.reduce(others)
+                codes = codes[sel]
+            counts = np.bincount(codes.astype(np.int64) + 1, minlength=len(cat.categories) + 1)[1:]
+            out[chave] = dict(zip(self.labels[chave], counts.tolist()))
+        return out
+
+    def count(self) -> int:
+        return self.n_rows if self.mask is None else int(self.mask.sum())
+
+    def fingerprint(self) -> Dict[str, List[str]]:
+        # filtros normalizados: a mesma seleção em outra ordem gera o mesmo export
+        return {k: sorted(str(v) for v in vals) for k, vals in self.filtros.items()}
+
+    def view(self) -> "DatasetView":
+        # retrato da visão atual: um /pendente/filter no meio da exportação
+        # não muda o que já começou a ser escrito (nem a chave do cache)
+        return DatasetView(
+            self.original,
+            self.path,
+            self.n_rows,
+            None if self.mask is None else self.mask.copy(),
+            self.fingerprint(),
+            self.keys["atcs"] if self.mask is not None and self.filtros.get("atcs") else None,
+        )
+
+
+class DatasetView:
+    __slots__ = ("original", "path", "n_rows", "mask", "filtros", "atcs")
+
+    def __init__(
+        self,
+        original: Optional[pd.DataFrame],
+        path: Optional[Path],
+        n_rows: int,
+        mask: Optional[np.ndarray],
+        filtros: Dict[str, List[str]],
+        atcs: Optional[pd.Categorical],
+    ):
+        self.original = original
+        self.path = path
+        self.n_rows = n_rows
+        self.mask = mask
+        self.filtros = filtros  # já normalizados (fingerprint): base da chave do export
+        self.atcs = atcs  # prefixos de atc a exportar no lugar da coluna original
+
+    def count(self) -> int:
+        return self.n_rows if self.mask is None else int(self.mask.sum())
+
+    def _trim_atc(self, df: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+        # mesmo comportamento do filtro antigo: atc exportado só com o prefixo
+        if self.atcs is not None:
+            df = df.assign(atc=np.asarray(self.atcs)[rows])
+        return df
+
+    def iter_chunks(self, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        # em blocos: no Parquet lê um record batch por vez
+        if self.original is None:
+            try:
+                parquet = pq.ParquetFile(self.path, memory_map=True)
+            except FileNotFoundError:
+                raise HTTPException(
+                    status_code=410,
+                    detail="Arquivo expirado ou removido; envie a planilha novamente",
+                )
+            start = 0
+            for batch in parquet.iter_batches(batch_size=chunk_rows):
+                rows = np.arange(start, start + batch.num_rows)
+                start += batch.num_rows
+                if self.mask is not None:
+                    keep = self.mask[rows]
+                    rows = rows[keep]
+                    batch = batch.filter(pa.array(keep))
+                if batch.num_rows:
+                    yield self._trim_atc(batch.to_pandas(), rows)
+            return
+
+        rows_all = np.arange(self.n_rows) if self.mask is None else np.flatnonzero(self.mask)
+        for start in range(0, len(rows_all), chunk_rows):
+            rows = rows_all[start:start + chunk_rows]
+            yield self._trim_atc(self.original.iloc[rows], rows)
+
+class DatasetStore:
+    # shared=True (vários workers): o .filtros.json é a fonte da verdade e cada
+    # get confere o mtime dele, para não servir a visão antiga de um dataset
+    # que outro worker filtrou.
+    def __init__(self, max_bytes: int, ttl: int, tombstones: int = 10_000, shared: bool = False):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill = pq is not None
+        self.shared = shared
+        self._filtros_mtime: Dict[str, int] = {}
+        self._entries: "OrderedDict[str, DatasetEntry]" = OrderedDict()
+        self._evicted: "OrderedDict[str, str]" = OrderedDict()  # file_id -> motivo
+        self._tombstones = tombstones
+        self._lock = threading.RLock()
+        self._last_disk_sweep = 0.0
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.rehydrated = 0
+        self.evictions = {"lru": 0, "ttl": 0}
+
+    def _remove_spill(self, file_id: str):
+        self._filtros_mtime.pop(file_id, None)
+        spill_path(file_id).unlink(missing_ok=True)
+        spill_path(file_id, ".filtros.json").unlink(missing_ok=True)
+
+    def _spill_in_use(self, file_id: str) -> bool:
+        limite = time.time() - self.ttl
+        for p in (spill_path(file_id), spill_path(file_id, ".filtros.json")):
+            try:
+                if p.stat().st_mtime > limite:
+                    return True
+            except FileNotFoundError:
+                pass
+        return False
+
+    def _evict(self, file_id: str, reason: str):
+        entry = self._entries.pop(file_id)
+        self.bytes_held -= entry.nbytes
+        self.evictions[reason] += 1
+        self._filtros_mtime.pop(file_id, None)
+        # LRU só libera o heap (o Parquet continua valendo); TTL expira o
+        # dataset, a não ser que outro worker o tenha usado dentro do TTL
+        # (get renova o mtime do Parquet): aí também só sai do heap
+        if entry.path is None or (reason == "ttl" and not self._spill_in_use(file_id)):
+            self._remove_spill(file_id)
+            self._evicted[file_id] = reason
+            while len(self._evicted) > self._tombstones:
+                self._evicted.popitem(last=False)
+        logger.info("Dataset %s removido (%s, %d bytes)", file_id, reason, entry.nbytes)
+
+    def _sweep(self, now: float):
+        # o mais antigo está sempre na frente: para no primeiro ainda válido
+        while self._entries:
+            file_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_access <= self.ttl:
+                break
+            self._evict(file_id, "ttl")
+
+        # arquivos órfãos (de outro worker ou de antes de um restart)
+        if self.spill and now - self._last_disk_sweep > max(60, self.ttl // 4):
+            self._last_disk_sweep = now
+            for p in PENDENTE_SPILL_DIR.iterdir():
+                try:
+                    if now - p.stat().st_mtime > self.ttl:
+                        p.unlink(missing_ok=True)
+                except FileNotFoundError:
+                    pass
+
+    def _enforce_budget(self, keep: Optional[str] = None):
+        while self.bytes_held > self.max_bytes and len(self._entries) > 1:
+            file_id = next(iter(self._entries))
+            if file_id == keep:
+                break
+            self._evict(file_id, "lru")
+
+    def _insert(self, file_id: str, entry: DatasetEntry):
+        self._entries[file_id] = entry
+        self.bytes_held += entry.nbytes
+        self._enforce_budget(keep=file_id)
+
+    def _rehydrate(self, file_id: str) -> Optional[DatasetEntry]:
+        path = spill_path(file_id)
+        if not self.spill or not path.exists():
+            return None
+        try:
+            keys_df = pq.read_table(path, columns=list(PENDENTE_DIMENSOES.values()), memory_map=True).to_pandas()
+        except FileNotFoundError:
+            return None
+        entry = DatasetEntry(build_filter_keys(keys_df), len(keys_df), path=path)
+        self._insert(file_id, entry)
+        self._reload_filters(file_id, entry)
+        self.rehydrated += 1
+        return entry
+
+    def _reload_filters(self, file_id: str, entry: DatasetEntry):
+        try:
+            mtime = spill_path(file_id, ".filtros.json").stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if self._filtros_mtime.get(file_id) == mtime:
+            return
+        filtros = json.loads(spill_path(file_id, ".filtros.json").read_text(encoding="utf-8"))
+        delta = entry.set_filters(filtros)
+        entry.nbytes += delta
+        self.bytes_held += delta
+        self._filtros_mtime[file_id] = mtime
+
+    def put(self, df: pd.DataFrame) -> str:
+        file_id = str(uuid.uuid4())
+        keys = build_filter_keys(df)
+        if self.spill:
+            write_spill(df, spill_path(file_id))
+            return self.adopt(file_id, keys, len(df))
+        entry = DatasetEntry(keys, len(df), original=df)
+        with self._lock:
+            self._sweep(time.time())
+            self._insert(file_id, entry)
+        return file_id
+
+    def adopt(self, file_id: str, keys: Dict[str, pd.Categorical], n_rows: int) -> str:
+        # dataset cujo Parquet já foi gravado em spill_path(file_id)
+        entry = DatasetEntry(keys, n_rows, path=spill_path(file_id))
+        with self._lock:
+            self._sweep(time.time())
+            self._insert(file_id, entry)
+        return file_id
+
+    def get(self, file_id: Optional[str]) -> DatasetEntry:
+        if not valid_file_id(file_id):
+            raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            entry = self._entries.get(file_id)
+            if entry is None:
+                self.misses += 1
+                entry = self._rehydrate(file_id)
+            else:
+                self.hits += 1
+                if self.shared and entry.path is not None:
+                    self._reload_filters(file_id, entry)
+            if entry is None:
+                if file_id in self._evicted:
+                    raise HTTPException(
+                        status_code=410,
+                        detail="Arquivo expirado ou removido da memória; envie a planilha novamente",
+                    )
+                raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+            entry.last_access = now
+            self._entries.move_to_end(file_id)
+            if entry.path is not None:
+                try:
+                    os.utime(entry.path)  # mantém o arquivo vivo para a varredura de órfãos
+                except FileNotFoundError:
+                    pass
+            return entry
+
+    def _save_filters(self, file_id: str, entry: DatasetEntry):
+        if entry.path is None:
+            return
+        # os filtros acompanham o Parquet para outro worker exportar a mesma visão
+        # rename atômico: outro worker nunca lê o arquivo pela metade
+        filtros_path = spill_path(file_id, ".filtros.json")
+        tmp = filtros_path.with_name(f"{filtros_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(entry.filtros), encoding="utf-8")
+        os.replace(tmp, filtros_path)
+        self._filtros_mtime[file_id] = filtros_path.stat().st_mtime_ns
+
+    def view(self, file_id: str) -> DatasetView:
+        # sob o lock do store: nunca pega um apply_filters pela metade
+        with self._lock:
+            return self.get(file_id).view()
+
+    def apply_filters(self, file_id: str, filtros: Dict[str, List[str]]) -> DatasetEntry:
+        with self._lock, span("filter"):
+            entry = self.get(file_id)
+            delta = entry.set_filters(filtros)
+            entry.nbytes += delta
+            self.bytes_held += delta
+            self._save_filters(file_id, entry)
+            self._enforce_budget(keep=file_id)
+            return entry
+
+    def apply_preset(self, file_id: str, preset: Dict[str, Any]) -> DatasetEntry:
+        with self._lock, span("filter_preset"):
+            entry = self.get(file_id)
+            delta = entry.apply_preset((preset["nome"], preset["versao"]), preset["filtros"])
+            entry.nbytes += delta
+            self.bytes_held += delta
+            self._save_filters(file_id, entry)
+            self._enforce_budget(keep=file_id)
+            return entry
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep(time.time())
+            return {
+                "entries": len(self._entries),
+                "bytes_held": self.bytes_held,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "spill": self.spill,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rehydrated": self.rehydrated,
+                "evictions": dict(self.evictions),
+            }
+
+
+PENDENTE_STORE = DatasetStore(PENDENTE_MAX_BYTES, PENDENTE_TTL, shared=STATE.shared)
+
+
+# ---------------- Cache de parse (pendente) ----------------
+# A mesma planilha é enviada várias vezes. O upload é hasheado (sha256)
+# enquanto é gravado e o hash aponta para o Parquet já normalizado e o resumo
+# (opções e facetas sem filtro) da primeira vez: um reenvio não passa pelo
+# read_excel, só ganha um file_id novo com hard link para o Parquet.
+# Em disco sob BASE_DIR, com teto de bytes e LRU pelo mtime (cada acerto
+# renova). Depende do spill em Parquet (pyarrow); sem ele fica desligado.
+# Mude PARSE_CACHE_VERSION quando read_pendente/normalize_columns mudarem.
+PARSE_CACHE_DIR = Path(BASE_DIR) / "parse_cache"
+PARSE_CACHE_MAX_BYTES = int(os.environ.get("PARSE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+PARSE_CACHE_VERSION = 1
+# .tmp mais novo que isso pode ser o store() em andamento de outro worker
+PARSE_CACHE_TMP_GRACE = int(os.environ.get("PARSE_CACHE_TMP_GRACE", str(60 * 60)))
+
+
+def link_or_copy(src: Path, dst: Path):
+    # hard link quando dá (mesmo disco), cópia quando não
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ParseCache:
+    # Por hash: <sha256>.parquet (dados) + <sha256>.json (versão, resumo,
+    # planilhas). Com vários workers cada um tem seu índice LRU, reconstruído
+    # do disco; arquivo removido por outro worker vira só um miss.
+    def __init__(self, directory: Path, max_bytes: int, enabled: bool):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self._lock = threading.Lock()
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()  # sha256 -> bytes; ordem = uso
+        self.bytes_held = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._scan()
+
+    def _paths(self, digest: str) -> tuple:
+        return self.directory / f"{digest}.parquet", self.directory / f"{digest}.json"
+
+    def _scan(self):
+        # mais antigo primeiro, para a ordem do LRU sobreviver a um restart
+        found: Dict[str, tuple] = {}
+        limite = time.time() - PARSE_CACHE_TMP_GRACE
+        for p in self.directory.iterdir():
+            try:
+                st = p.stat()
+                if p.name.startswith("."):
+                    # .tmp de uma gravação interrompida; os recentes podem ser
+                    # de outro worker (ou filho do pool) gravando agora
+                    if st.st_mtime < limite:
+                        p.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            digest = p.name.split(".", 1)[0]
+            size, mtime = found.get(digest, (0, 0.0))
+            found[digest] = (size + st.st_size, max(mtime, st.st_mtime))
+        for digest, (size, _) in sorted(found.items(), key=lambda item: item[1][1]):
+            self._sizes[digest] = size
+            self.bytes_held += size
+
+    def _meta(self, digest: str) -> Dict[str, Any]:
+        try:
+            meta = json.loads(self._paths(digest)[1].read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {"versao": PARSE_CACHE_VERSION}
+        return meta if meta.get("versao") == PARSE_CACHE_VERSION else {"versao": PARSE_CACHE_VERSION}
+
+    def _write_meta(self, digest: str, meta: Dict[str, Any]):
+        path = self._paths(digest)[1]
+        tmp = self.directory / f".{digest}.{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _account(self, digest: str):
+        size = 0
+        for p in self._paths(digest):
+            try:
+                size += p.stat().st_size
+            except FileNotFoundError:
+                pass
+        self.bytes_held += size - self._sizes.pop(digest, 0)
+        self._sizes[digest] = size
+        while self.bytes_held > self.max_bytes and len(self._sizes) > 1:
+            antigo, n = self._sizes.popitem(last=False)
+            for p in self._paths(antigo):
+                p.unlink(missing_ok=True)
+            self.bytes_held -= n
+            self.evictions += 1
+
+    def _touch(self, digest: str):
+        for p in self._paths(digest):
+            try:
+                os.utime(p)
+            except FileNotFoundError:
+                pass
+        if digest in self._sizes:
+            self._sizes.move_to_end(digest)
+
+    def restore(self, digest: str) -> Optional[Dict[str, Any]]:
+        # acerto: dataset novo (file_id próprio, filtros próprios) sobre o Parquet do cache
+        if not self.enabled:
+            return None
+        parquet, _ = self._paths(digest)
+        with self._lock:
+            meta = self._meta(digest)
+            file_id = str(uuid.uuid4())
+            try:
+                if "resumo" not in meta:
+                    raise FileNotFoundError(parquet)
+                link_or_copy(parquet, spill_path(file_id))
+            except FileNotFoundError:
+                self.misses += 1
+                return None
+            self._touch(digest)
+            self.hits += 1
+        return {**meta["resumo"], "file_id": file_id}
+
+    def store(self, digest: str, file_id: str, resumo: Dict[str, Any]):
+        if not self.enabled:
+            return
+        parquet, _ = self._paths(digest)
+        try:
+            with self._lock:
+                tmp = self.directory / f".{digest}.{uuid.uuid4().hex}.tmp"
+                try:
+                    link_or_copy(spill_path(file_id), tmp)
+                    os.replace(tmp, parquet)
+                finally:
+                    tmp.unlink(missing_ok=True)
+                meta = self._meta(digest)
+                meta["resumo"] = {k: v for k, v in resumo.items() if k != "file_id"}
+                self._write_meta(digest, meta)
+                self._account(digest)
+        except OSError:
+            # cache é só atalho: falha aqui não derruba o upload
+            logger.exception("Falha ao gravar cache de parse %s", digest)
+
+    def sheets(self, digest: str, loader) -> List[str]:
+        if not self.enabled:
+            return loader()
+        with self._lock:
+            planilhas = self._meta(digest).get("planilhas")
+            if planilhas is not None:
+                self._touch(digest)
+                self.hits += 1
+                return planilhas
+            self.misses += 1
+        planilhas = loader()
+        with self._lock:
+            meta = self._meta(digest)
+            meta["planilhas"] = planilhas
+            self._write_meta(digest, meta)
+            self._account(digest)
+        return planilhas
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._sizes),
+                "bytes_held": self.bytes_held,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+PARSE_CACHE = ParseCache(PARSE_CACHE_DIR, PARSE_CACHE_MAX_BYTES, enabled=PENDENTE_STORE.spill)
 
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
-    def norm(col):
-        col = unicodedata.normalize("NFKD", col)
-        col = col.encode("ascii", "ignore").decode("ascii")
-        col = col.lower().strip()
-        col = re.sub(r"\s+", "_", col)
-        return col
-
-    df.columns = [norm(c) for c in df.columns]
+    df.columns = [normalize_column_name(c) for c in df.columns]
     return df
 
 
 # ===============================
 # UPLOAD
 # ===============================
-@app.post("/pendente/upload")
-async def pendente_upload(file: UploadFile = File(...)):
-    try:
-        df = pd.read_excel(file.file)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Erro ao ler planilha")
+PENDENTE_REQUIRED = ["contrato", "atc", "descricao_tss", "familia"]
+PENDENTE_CHUNK_ROWS = int(os.environ.get("PENDENTE_CHUNK_ROWS", "50000"))
+
+# ---------------- Offload de CPU ----------------
+# Nada pesado roda no event loop. Dois pools com fila limitada:
+#  - CPU_POOL: parse das planilhas e exportações. Threads por padrão; com
+#    OFFLOAD_PROCESSES=1 os dois vão para processos (spawn), que gravam o
+#    Parquet / o arquivo do export direto e devolvem só o resultado — o
+#    DataFrame não volta por pickle.
+#  - LIGHT_POOL (threads): filtros, facetas, gravação do upload e consultas.
+# Cada pool aceita workers + queue_max tarefas; acima disso responde 429 com
+# Retry-After em vez de enfileirar sem limite.
+OFFLOAD_WORKERS = int(os.environ.get("OFFLOAD_WORKERS", os.environ.get("INGEST_WORKERS", "2")))
+OFFLOAD_QUEUE_MAX = int(os.environ.get("OFFLOAD_QUEUE_MAX", "4"))
+OFFLOAD_PROCESSES = os.environ.get("OFFLOAD_PROCESSES", "0") == "1"
+OFFLOAD_LIGHT_WORKERS = int(os.environ.get("OFFLOAD_LIGHT_WORKERS", "4"))
+OFFLOAD_LIGHT_QUEUE_MAX = int(os.environ.get("OFFLOAD_LIGHT_QUEUE_MAX", "32"))
+
+
+class OffloadPool:
+    def __init__(self, name: str, workers: int, queue_max: int, processes: bool = False):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_max
+        self.processes = processes
+        self._executor = None  # criado no primeiro uso (processos filhos reimportam o módulo)
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def acquire(self):
+        with self._lock:
+            if self.inflight >= self.capacity:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=429,
+                    detail="Servidor ocupado processando outras planilhas; tente novamente em instantes",
+                    headers={"Retry-After": "2"},
+                )
+            self.inflight += 1
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args):
+        self.acquire()
+        if not self.processes:
+            # leva o contexto (etapas da requisição para span) para a thread
+            fn = functools.partial(contextvars.copy_context().run, fn)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor(), fn, *args)
+        finally:
+            self.release()
 
-    df = normalize_columns(df)
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "mode": "process" if self.processes else "thread",
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "inflight": self.inflight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+CPU_POOL = OffloadPool("cpu", OFFLOAD_WORKERS, OFFLOAD_QUEUE_MAX, processes=OFFLOAD_PROCESSES)
+LIGHT_POOL = OffloadPool("light", OFFLOAD_LIGHT_WORKERS, OFFLOAD_LIGHT_QUEUE_MAX)
+
+
+@app.on_event("shutdown")
+def stop_offload_pools():
+    CPU_POOL.shutdown()
+    LIGHT_POOL.shutdown()
 
-    required = ["contrato", "atc", "descricao_tss", "familia"]
-    for col in required:
-        if col not in df.columns:
+def check_pendente_header(columns: List[str]):
+    normalizadas = {normalize_column_name(c) for c in columns}
+    for col in PENDENTE_REQUIRED:
+        if col not in normalizadas:
             raise HTTPException(
                 status_code=400,
                 detail=f"Coluna obrigatória não encontrada: {col}"
             )
 
-    file_id = str(uuid.uuid4())
+def iter_pendente_chunks(path: Path) -> Iterator[pd.DataFrame]:
+    # blocos já normalizados; erro de leitura vira 400 como antes
+    chunks = iter_sheet_chunks(path, PENDENTE_CHUNK_ROWS, on_header=check_pendente_header)
+    vazio = True
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Erro ao ler planilha pendente: %s", path.name)
+            raise HTTPException(status_code=400, detail="Erro ao ler planilha")
+        vazio = False
+        yield normalize_columns(chunk.infer_objects())
+    if vazio:
+        raise HTTPException(status_code=400, detail="Erro ao ler planilha")
+
+def read_pendente(path: Path) -> pd.DataFrame:
+    # planilha inteira no heap: só para o modo sem pyarrow (o DataFrame é o
+    # próprio dataset) e para a reserva de stream_pendente_spill
+    with span("excel_parse"):
+        chunks = list(iter_pendente_chunks(path))
+    df = chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
+    del chunks
+    return df
 
-    FILES_ORIGINAL[file_id] = df
-    FILES_FILTERED[file_id] = df.copy()
+def stream_pendente_spill(path: Path, out: Path) -> tuple:
+    # Lê bloco a bloco e grava cada um como row group do Parquet: no heap
+    # ficam só o bloco atual e as chaves de filtro já codificadas (categorias
+    # unidas no fim). O schema é o do primeiro bloco (colunas vazias viram
+    # texto); se um bloco posterior não couber nele (ex.: coluna numérica que
+    # ganha texto na linha 80 mil), cai na leitura inteira. -> (keys, n_rows)
+    tmp = out.with_name(f".{out.name}.{uuid.uuid4().hex}.tmp")
+    writer = None
+    partes: Dict[str, List[pd.Categorical]] = {chave: [] for chave in PENDENTE_DIMENSOES}
+    n_rows = 0
+    try:
+        with span("excel_parse"):
+            for chunk in iter_pendente_chunks(path):
+                table = pa.Table.from_pandas(arrow_safe(chunk), preserve_index=False)
+                if writer is None:
+                    schema = pa.schema(
+                        [f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema],
+                        metadata=table.schema.metadata,
+                    )
+                    writer = pq.ParquetWriter(tmp, schema)
+                writer.write_table(table.cast(schema))
+                for chave, cat in build_filter_keys(chunk).items():
+                    partes[chave].append(cat)
+                n_rows += len(chunk)
+        writer.close()
+        writer = None
+        os.replace(tmp, out)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        logger.warning("Tipos mudam entre blocos em %s; lendo a planilha inteira", path.name)
+        df = read_pendente(path)
+        write_spill(df, out)
+        return build_filter_keys(df), len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+        tmp.unlink(missing_ok=True)
+
+    keys = {
+        chave: pd.api.types.union_categoricals(cats, sort_categories=True) if len(cats) > 1 else cats[0]
+        for chave, cats in partes.items()
+    }
+    return keys, n_rows
+
+def ingest_pendente(path: Path) -> str:
+    if not PENDENTE_STORE.spill:
+        return PENDENTE_STORE.put(read_pendente(path))
+    file_id = str(uuid.uuid4())
+    keys, n_rows = stream_pendente_spill(path, spill_path(file_id))
+    return PENDENTE_STORE.adopt(file_id, keys, n_rows)
 
+def spill_pendente(path: str, file_id: str) -> Optional[tuple]:
+    # roda num processo do CPU_POOL; HTTPException não atravessa o pickle,
+    # então o erro volta como (status, detail)
+    try:
+        stream_pendente_spill(Path(path), spill_path(file_id))
+    except HTTPException as e:
+        return e.status_code, e.detail
+    return None
+
+def pendente_summary(file_id: str) -> Dict[str, Any]:
+    entry = PENDENTE_STORE.get(file_id)
+    with span("facets"):
+        facets = entry.facets()
     return {
         "file_id": file_id,
-        "contratos": sorted(
-            df["contrato"].dropna().astype(str).unique().tolist()
-        ),
-        "atcs": sorted(
-            df["atc"]
-            .dropna()
-            .astype(str)
-            .str.split("-")
-            .str[0]
-            .str.strip()
-            .unique()
-            .tolist()
-        ),
-        "familias": sorted(
-            df["familia"].dropna().astype(str).unique().tolist()
-        ),
-        "descricoes": sorted(
-            df["descricao_tss"].dropna().astype(str).unique().tolist()
-        ),
+        "contratos": entry.options("contratos"),
+        "atcs": entry.options("atcs"),
+        "familias": entry.options("familias"),
+        "descricoes": entry.options("descricoes"),
+        "facetas": facets,
     }
 
+@app.post("/pendente/upload")
+async def pendente_upload(file: UploadFile = File(...)):
+    with span("upload_save"):
+        path, digest = await LIGHT_POOL.run(save_uploaded_file_hashed, file)
+    return await pendente_ingest_path(path, digest)
+
+
+async def pendente_ingest_path(path: Path, digest: Optional[str] = None) -> Dict[str, Any]:
+    # parse + resumo; o arquivo em `path` é removido no fim. digest = sha256
+    # do arquivo (calculado aqui se não vier) para o cache de parse.
+    try:
+        if PARSE_CACHE.enabled:
+            if digest is None:
+                with span("upload_hash"):
+                    digest = await LIGHT_POOL.run(file_checksum, path, 1024 * 1024, "sha256")
+            resumo = await LIGHT_POOL.run(PARSE_CACHE.restore, digest)
+            if resumo is not None:
+                return resumo
+
+        if CPU_POOL.processes and PENDENTE_STORE.spill:
+            file_id = str(uuid.uuid4())
+            erro = await CPU_POOL.run(spill_pendente, str(path), file_id)
+            if erro is not None:
+                raise HTTPException(status_code=erro[0], detail=erro[1])
+        else:
+            file_id = await CPU_POOL.run(ingest_pendente, path)
+    finally:
+        path.unlink(missing_ok=True)
+
+    # no modo processo o get reidrata o Parquet recém-gravado (só as chaves)
+    resumo = await LIGHT_POOL.run(pendente_summary, file_id)
+    if digest and PARSE_CACHE.enabled:
+        await LIGHT_POOL.run(PARSE_CACHE.store, digest, file_id, resumo)
+    return resumo
+
 
 # ===============================
 # FILTRAR
@@ -324,118 +2627,747 @@ async def pendente_filter(payload: dict):
     file_id = payload.get("file_id")
     filtros = payload.get("filtros", {})
 
-    if file_id not in FILES_ORIGINAL:
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    def run():
+        entry = PENDENTE_STORE.apply_filters(file_id, filtros)
+        with span("facets"):
+            facetas = entry.facets()
+        return {"linhas_resultantes": entry.count(), "facetas": facetas}
 
-    df = FILES_ORIGINAL[file_id].copy()
+    return await LIGHT_POOL.run(run)
 
-    if filtros.get("contratos"):
-        df = df[df["contrato"].astype(str).isin(filtros["contratos"])]
 
-    if filtros.get("atcs"):
-        df["atc"] = (
-            df["atc"]
-            .astype(str)
-            .str.split("-")
-            .str[0]
-            .str.strip()
-        )
-        df = df[df["atc"].isin(filtros["atcs"])]
+# ===============================
+# PRESETS DE FILTRO
+# ===============================
+class PresetBody(BaseModel):
+    nome: str
+    filtros: Dict[str, List[str]]
 
-    if filtros.get("familias"):
-        df = df[df["familia"].astype(str).isin(filtros["familias"])]
 
-    if filtros.get("descricoes"):
-        df = df[df["descricao_tss"].astype(str).isin(filtros["descricoes"])]
+@app.get("/pendente/presets")
+def listar_presets():
+    return FILTERS.list()
 
-    FILES_FILTERED[file_id] = df
 
-    return {"linhas_resultantes": len(df)}
+@app.post("/pendente/presets")
+def salvar_preset(body: PresetBody):
+    nome = body.nome.strip()
+    if not nome:
+        raise HTTPException(status_code=400, detail="Nome do preset obrigatório")
+    return FILTERS.save(nome, body.filtros)
+
+
+@app.delete("/pendente/presets/{nome}")
+def excluir_preset(nome: str):
+    FILTERS.delete(nome)
+    return {"success": True}
+
+
+@app.post("/pendente/presets/{nome}/apply")
+async def aplicar_preset(nome: str, payload: dict):
+    preset = FILTERS.get(nome)
+    file_id = payload.get("file_id")
+
+    def run():
+        entry = PENDENTE_STORE.apply_preset(file_id, preset)
+        with span("facets"):
+            facetas = entry.facets()
+        return {"linhas_resultantes": entry.count(), "facetas": facetas, "filtros": entry.filtros}
+
+    return await LIGHT_POOL.run(run)
 
 
 # ===============================
 # FORMATAR / DOWNLOAD
 # ===============================
 @app.post("/pendente/format")
-async def pendente_format(payload: dict):
+async def pendente_format(
+    payload: dict,
+    formato: str = Query("xlsx", pattern="^(xlsx|csv|csv\\.gz)$"),
+):
     file_id = payload.get("file_id")
 
-    if file_id not in FILES_FILTERED:
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    def lookup():
+        view = PENDENTE_STORE.view(file_id)
+
+        if view.count() == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Nenhum registro encontrado com os filtros aplicados"
+            )
 
-    df = FILES_FILTERED[file_id]
+        # chave e dados saem do mesmo retrato
+        cache_key = ExportCache.key(file_id, view.filtros, formato)
+        return view, cache_key, EXPORT_CACHE.lookup(cache_key)
 
-    if df.empty:
-        raise HTTPException(
-            status_code=400,
-            detail="Nenhum registro encontrado com os filtros aplicados"
-        )
+    view, cache_key, cached = await LIGHT_POOL.run(lookup)
+    media_type, ext = EXPORT_FORMATS[formato]
+    if cached is not None:
+        return FileResponse(cached, filename=f"pendente{ext}", media_type=media_type)
 
-    output_path = os.path.join(BASE_DIR, f"{file_id}.xlsx")
-    df.to_excel(output_path, index=False)
+    # a exportação roda inteira no CPU_POOL (limite de vagas, 429, processos
+    # com OFFLOAD_PROCESSES); a resposta só serve o arquivo pronto
+    tmp = EXPORT_CACHE.tmp_path(cache_key)
+    erro = await CPU_POOL.run(write_export, view, formato, str(tmp))
+    if erro is not None:
+        raise HTTPException(status_code=erro[0], detail=erro[1])
+    path = await run_in_threadpool(EXPORT_CACHE.publish, cache_key, tmp)
+    return FileResponse(path, filename=f"pendente{ext}", media_type=media_type)
 
-    return FileResponse(
-        output_path,
-        filename="pendente.xlsx",
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
-    
 
-# ---------------- Routes - Rastreador ----------------
-@app.post("/rastreador/abrir-site")
-def rastreador_abrir_site(authorization: Optional[str] = Header(None)):
+@app.get("/pendente/metrics")
+def pendente_metrics():
+    return {
+        **PENDENTE_STORE.metrics(),
+        "exports": EXPORT_CACHE.metrics(),
+        "parse_cache": PARSE_CACHE.metrics(),
+        "offload": {"cpu": CPU_POOL.metrics(), "light": LIGHT_POOL.metrics()},
+    }
+
+
+# ---------------- Uploads em partes (retomáveis) ----------------
+# Para planilhas grandes ou conexões instáveis:
+#   POST   /uploads                  {destino, filename, tamanho, sha256?} -> {upload_id, offset: 0}
+#   PUT    /uploads/{id}?offset=N    corpo = bytes da parte (application/octet-stream)
+#   GET    /uploads/{id}             -> {offset, tamanho}: de onde retomar após queda
+#   POST   /uploads/{id}/complete    confere tamanho + sha256, publica e processa
+#   DELETE /uploads/{id}
+# O corpo de cada parte vai direto para o .part em blocos (nada de ler tudo
+# em memória). O offset é o tamanho do .part em disco, então uma parte
+# interrompida no meio continua valendo até onde chegou, inclusive depois de
+# restart ou em outro worker. No complete o .part é publicado por rename
+# atômico e entregue ao mesmo processamento do endpoint de destino.
+# Toda rota exige login e a sessão só atende quem a abriu.
+UPLOADS_DIR = TMP_DIR / "uploads"
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(1024 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX = int(os.environ.get("UPLOAD_CHUNK_MAX", str(16 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", str(24 * 60 * 60)))
+
+UPLOAD_DESTINOS = {
+    # destino -> (extensões aceitas, papel exigido; None = qualquer usuário logado)
+    "pendente": (None, None),
+    "materiais": (MATERIAIS_EXTENSOES, "admin"),
+    "processar_materiais": (PROCESSAR_EXTENSOES, "comum"),
+}
+
+
+class UploadBody(BaseModel):
+    destino: str
+    filename: str
+    tamanho: int
+    sha256: Optional[str] = None
+
+
+class UploadSessions:
+    def __init__(self, directory: Path, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.directory / f"{upload_id}.json"
+
+    def part_path(self, upload_id: str) -> Path:
+        return self.directory / f"{upload_id}.part"
+
+    def _sweep(self):
+        # sessões abandonadas (sem parte nova há mais de ttl)
+        now = time.time()
+        for meta in self.directory.glob("*.json"):
+            part = meta.with_suffix(".part")
+            try:
+                ultimo = max(meta.stat().st_mtime, part.stat().st_mtime if part.exists() else 0)
+            except FileNotFoundError:
+                continue
+            if now - ultimo > self.ttl:
+                part.unlink(missing_ok=True)
+                meta.unlink(missing_ok=True)
+                self._locks.pop(meta.stem, None)
+        # sessão encerrada em outro worker (ou varrida lá): o lock daqui também sai
+        for upload_id, lock in list(self._locks.items()):
+            if not lock.locked() and not self._meta_path(upload_id).exists():
+                self._locks.pop(upload_id, None)
+
+    def create(self, body: UploadBody, user: str) -> Dict[str, Any]:
+        self._sweep()
+        upload_id = str(uuid.uuid4())
+        sessao = {
+            "upload_id": upload_id,
+            "destino": body.destino,
+            "filename": Path(body.filename).name,
+            "tamanho": body.tamanho,
+            "sha256": body.sha256.lower() if body.sha256 else None,
+            "user": user,
+            "criado_em": time.time(),
+        }
+        self.part_path(upload_id).touch()
+        self._meta_path(upload_id).write_text(json.dumps(sessao), encoding="utf-8")
+        return sessao
+
+    def get(self, upload_id: str) -> Dict[str, Any]:
+        if not valid_file_id(upload_id):
+            raise HTTPException(status_code=404, detail="Upload não encontrado")
+        try:
+            return json.loads(self._meta_path(upload_id).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload não encontrado")
+
+    def offset(self, upload_id: str) -> int:
+        try:
+            return self.part_path(upload_id).stat().st_size
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload não encontrado")
+
+    def lock(self, upload_id: str) -> asyncio.Lock:
+        # uma parte por vez por sessão (neste worker; o offset protege o resto)
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def discard(self, upload_id: str):
+        self.part_path(upload_id).unlink(missing_ok=True)
+        self._meta_path(upload_id).unlink(missing_ok=True)
+        self._locks.pop(upload_id, None)
+
+
+UPLOAD_SESSIONS = UploadSessions(UPLOADS_DIR, UPLOAD_SESSION_TTL)
+
+
+def check_upload_access(destino: str, authorization: Optional[str]) -> str:
+    extensoes, papel = UPLOAD_DESTINOS[destino]
     info = verify_token_header(authorization)
+    if papel == "admin" and info["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    return info["user"]
 
-    # admin OU ti
-    if info["role"] not in ["admin", "ti"]:
+
+def owned_upload(upload_id: str, authorization: Optional[str]) -> Dict[str, Any]:
+    # só o dono (quem abriu a sessão) consulta, envia, conclui ou cancela
+    user = verify_token_header(authorization)["user"]
+    sessao = UPLOAD_SESSIONS.get(upload_id)
+    if sessao.get("user") != user:
         raise HTTPException(status_code=403, detail="Acesso negado")
+    return sessao
+
+
+def upload_status(sessao: Dict[str, Any], offset: int) -> Dict[str, Any]:
+    return {
+        "upload_id": sessao["upload_id"],
+        "destino": sessao["destino"],
+        "offset": offset,
+        "tamanho": sessao["tamanho"],
+        "chunk_max": UPLOAD_CHUNK_MAX,
+    }
 
-    navegador = None
 
+@app.post("/uploads")
+def criar_upload(body: UploadBody, authorization: Optional[str] = Header(None)):
+    if body.destino not in UPLOAD_DESTINOS:
+        raise HTTPException(status_code=400, detail="Destino inválido")
+    extensoes, _ = UPLOAD_DESTINOS[body.destino]
+    if extensoes and not body.filename.lower().endswith(extensoes):
+        raise HTTPException(status_code=400, detail="Arquivo inválido")
+    if body.tamanho <= 0 or body.tamanho > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Tamanho de arquivo não suportado")
+
+    user = check_upload_access(body.destino, authorization)
+    sessao = UPLOAD_SESSIONS.create(body, user)
+    return upload_status(sessao, 0)
+
+
+@app.get("/uploads/{upload_id}")
+def status_upload(upload_id: str, authorization: Optional[str] = Header(None)):
+    sessao = owned_upload(upload_id, authorization)
+    return upload_status(sessao, UPLOAD_SESSIONS.offset(upload_id))
+
+
+@app.put("/uploads/{upload_id}")
+async def enviar_parte(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    authorization: Optional[str] = Header(None),
+):
+    sessao = await run_in_threadpool(owned_upload, upload_id, authorization)
+    loop = asyncio.get_running_loop()
+
+    async with UPLOAD_SESSIONS.lock(upload_id):
+        atual = UPLOAD_SESSIONS.offset(upload_id)
+        if offset != atual:
+            # cliente fora de sincronia (ex.: parte perdida): diz de onde seguir
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "Offset não confere", **upload_status(sessao, atual)},
+            )
+
+        limite = min(UPLOAD_CHUNK_MAX, sessao["tamanho"] - atual)
+        recebido = 0
+        with open(UPLOAD_SESSIONS.part_path(upload_id), "ab") as f:
+            async for piece in request.stream():
+                if not piece:
+                    continue
+                recebido += len(piece)
+                if recebido > limite:
+                    # desfaz a parte inteira: o offset volta a ser o de antes
+                    f.truncate(atual)
+                    raise HTTPException(status_code=413, detail="Parte maior que o permitido")
+                # se a conexão cair aqui, o que já foi gravado vale para o resume
+                await loop.run_in_executor(None, f.write, piece)
+
+    return upload_status(sessao, atual + recebido)
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def concluir_upload(upload_id: str, authorization: Optional[str] = Header(None)):
+    # o papel do destino já foi conferido na abertura, para este mesmo usuário
+    sessao = await run_in_threadpool(owned_upload, upload_id, authorization)
+
+    async with UPLOAD_SESSIONS.lock(upload_id):
+        part = UPLOAD_SESSIONS.part_path(upload_id)
+        offset = UPLOAD_SESSIONS.offset(upload_id)
+        if offset != sessao["tamanho"]:
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "Upload incompleto", **upload_status(sessao, offset)},
+            )
+        if sessao["sha256"]:
+            with span("upload_checksum"):
+                digest = await LIGHT_POOL.run(file_checksum, part, 1024 * 1024, "sha256")
+            if digest != sessao["sha256"]:
+                UPLOAD_SESSIONS.discard(upload_id)
+                raise HTTPException(status_code=422, detail="Checksum não confere; envie o arquivo novamente")
+
+        # publica: rename atômico para o nome final (mesmo diretório)
+        final = UPLOADS_DIR / f"{upload_id}_{sessao['filename']}"
+        os.replace(part, final)
+        UPLOAD_SESSIONS.discard(upload_id)
+
+    destino = sessao["destino"]
+    if destino == "pendente":
+        return await pendente_ingest_path(final, sessao["sha256"])
     try:
-        options = webdriver.ChromeOptions()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920,1080")
+        if destino == "materiais":
+            return await LIGHT_POOL.run(publish_materiais, final)
+        return await LIGHT_POOL.run(processar_materiais_path, final)
+    except BaseException:
+        final.unlink(missing_ok=True)
+        raise
+
+
+@app.delete("/uploads/{upload_id}")
+def cancelar_upload(upload_id: str, authorization: Optional[str] = Header(None)):
+    owned_upload(upload_id, authorization)
+    UPLOAD_SESSIONS.discard(upload_id)
+    return {"success": True}
 
-        navegador = webdriver.Chrome(options=options)
-        navegador.get("https://web.hapolo.com.br/")
 
-        wait = WebDriverWait(navegador, 30)
+# ---------------- Pool de navegadores (Selenium) ----------------
+# Uma sessão Chrome por site, mantida aberta e já autenticada. A chamada ao
+# endpoint reaproveita a sessão quente (health check + checagem de login) e só
+# abre um navegador novo quando não há um válido. Limite global de
+# SELENIUM_POOL_MAX navegadores; sessões ociosas há mais de SELENIUM_IDLE_TTL
+# são encerradas pelo reaper.
+SELENIUM_POOL_MAX = int(os.environ.get("SELENIUM_POOL_MAX", "4"))
+SELENIUM_IDLE_TTL = int(os.environ.get("SELENIUM_IDLE_TTL", str(60 * 60)))
+SELENIUM_LOGIN_TIMEOUT = int(os.environ.get("SELENIUM_LOGIN_TIMEOUT", "30"))
+SELENIUM_WARM = [s for s in os.environ.get("SELENIUM_WARM", "").split(",") if s]  # ex.: rastreador,camera
 
-        campo_user = wait.until(
-            EC.visibility_of_element_located((By.ID, "id_user"))
-        )
 
-        actions = ActionChains(navegador)
-        actions.move_to_element(campo_user).click().perform()
-        time.sleep(0.3)
+def chrome_options() -> "webdriver.ChromeOptions":
+    options = webdriver.ChromeOptions()
+    # NÃO usar headless: o navegador fica aberto para uso no servidor
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--window-size=1920,1080")
+    return options
 
-        for letra in "psbltda":
-            campo_user.send_keys(letra)
-            time.sleep(0.05)
 
-        campo_pass = navegador.find_element(By.ID, "id_password")
-        actions.move_to_element(campo_pass).click().perform()
-        time.sleep(0.3)
+def login_rastreador(navegador, wait: WebDriverWait):
+    navegador.get("https://web.hapolo.com.br/")
 
-        for letra in "010203":
-            campo_pass.send_keys(letra)
-            time.sleep(0.05)
+    campo_user = wait.until(EC.element_to_be_clickable((By.ID, "id_user")))
+    ActionChains(navegador).move_to_element(campo_user).click().perform()
+    campo_user.send_keys("psbltda")
 
-        campo_pass.send_keys(Keys.RETURN)
+    campo_pass = wait.until(EC.element_to_be_clickable((By.ID, "id_password")))
+    ActionChains(navegador).move_to_element(campo_pass).click().perform()
+    campo_pass.send_keys("010203")
+    campo_pass.send_keys(Keys.RETURN)
 
-        wait.until(lambda d: "hapolo" in d.current_url.lower())
+    # login efetivo = formulário saiu da página
+    wait.until(EC.staleness_of(campo_pass))
+    wait.until(lambda d: "hapolo" in d.current_url.lower())
+
+
+def login_camera(navegador, wait: WebDriverWait):
+    navegador.get("http://roaletelemetria.ddns.net:8070/login")
+
+    campo_user = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="login"]')))
+    ActionChains(navegador).move_to_element(campo_user).click().perform()
+    campo_user.send_keys("globalsm")
+
+    campo_pass = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="password"]')))
+    ActionChains(navegador).move_to_element(campo_pass).click().perform()
+    campo_pass.send_keys("glob@l1qaz")
+    campo_pass.send_keys(Keys.RETURN)
+
+    # aguarda sair da tela de login (antes: time.sleep(5))
+    wait.until(lambda d: "/login" not in d.current_url.lower())
+
+
+def logado_rastreador(navegador) -> bool:
+    return "hapolo" in navegador.current_url.lower() and not navegador.find_elements(By.ID, "id_user")
+
+
+def logado_camera(navegador) -> bool:
+    return "/login" not in navegador.current_url.lower()
+
+
+SELENIUM_SITES = {
+    "rastreador": {"login": login_rastreador, "logado": logado_rastreador},
+    "camera": {"login": login_camera, "logado": logado_camera},
+}
+
+
+class BrowserSession:
+    __slots__ = ("site", "driver", "created_at", "last_used")
+
+    def __init__(self, site: str, driver):
+        self.site = site
+        self.driver = driver
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def healthy(self) -> bool:
+        try:
+            self.driver.window_handles  # falha se o Chrome morreu ou a janela foi fechada
+            return SELENIUM_SITES[self.site]["logado"](self.driver)
+        except WebDriverException:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            logger.exception("Falha ao encerrar navegador (%s)", self.site)
+
+
+class BrowserPool:
+    def __init__(self, max_size: int, idle_ttl: int, driver_factory=None):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.driver_factory = driver_factory or (lambda: webdriver.Chrome(options=chrome_options()))
+        self._sessions: Dict[str, BrowserSession] = {}
+        self._lock = threading.Lock()
+        self._site_locks = {site: threading.Lock() for site in SELENIUM_SITES}
+        self.reused = 0
+        self.created = 0
+        self.reaped = 0
+
+    def _drop(self, site: str) -> Optional[BrowserSession]:
+        with self._lock:
+            return self._sessions.pop(site, None)
+
+    def _make_room(self):
+        # no limite: encerra a sessão usada há mais tempo
+        with self._lock:
+            if len(self._sessions) < self.max_size:
+                return None
+            site = min(self._sessions, key=lambda s: self._sessions[s].last_used)
+            return self._sessions.pop(site)
+
+    def _login(self, site: str) -> BrowserSession:
+        victim = self._make_room()
+        if victim is not None:
+            logger.info("Pool Selenium cheio: encerrando sessão %s", victim.site)
+            victim.quit()
+
+        with span("selenium_start"):
+            driver = self.driver_factory()
+        try:
+            with span("selenium_login"):
+                SELENIUM_SITES[site]["login"](driver, WebDriverWait(driver, SELENIUM_LOGIN_TIMEOUT))
+        except Exception:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+            raise
+        session = BrowserSession(site, driver)
+        with self._lock:
+            self._sessions[site] = session
+            self.created += 1
+        return session
+
+    def open(self, site: str, progress=None) -> Dict[str, Any]:
+        # devolve a sessão autenticada do site, criando/relogando se preciso
+        progress = progress or (lambda pct, msg: None)
+        with self._site_locks[site]:
+            with self._lock:
+                session = self._sessions.get(site)
+            if session is not None:
+                progress(10, "Verificando sessão existente")
+                if session.healthy():
+                    session.last_used = time.time()
+                    try:
+                        session.driver.switch_to.window(session.driver.window_handles[0])
+                    except WebDriverException:
+                        pass
+                    with self._lock:
+                        self.reused += 1
+                    return {"reutilizado": True}
+                logger.info("Sessão %s inválida, recriando", site)
+                self._drop(site)
+                session.quit()
+
+            progress(30, "Abrindo navegador e autenticando")
+            self._login(site)
+            return {"reutilizado": False}
+
+    def reap(self) -> int:
+        now = time.time()
+        with self._lock:
+            idle = [s for s, sess in self._sessions.items() if now - sess.last_used > self.idle_ttl]
+            victims = [self._sessions.pop(s) for s in idle]
+            self.reaped += len(victims)
+        for sess in victims:
+            logger.info("Encerrando navegador ocioso (%s)", sess.site)
+            sess.quit()
+        return len(victims)
+
+    def warm(self, sites: List[str]):
+        for site in sites:
+            if site not in SELENIUM_SITES:
+                logger.warning("SELENIUM_WARM: site desconhecido %s", site)
+                continue
+            try:
+                self.open(site)
+            except Exception:
+                logger.exception("Falha ao pré-autenticar %s", site)
 
+    def close_all(self):
+        with self._lock:
+            victims = list(self._sessions.values())
+            self._sessions.clear()
+        for sess in victims:
+            sess.quit()
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": {s: round(time.time() - sess.last_used) for s, sess in self._sessions.items()},
+                "max_size": self.max_size,
+                "created": self.created,
+                "reused": self.reused,
+                "reaped": self.reaped,
+            }
+
+
+BROWSER_POOL = BrowserPool(SELENIUM_POOL_MAX, SELENIUM_IDLE_TTL)
+
+
+def _browser_reaper():
+    while True:
+        time.sleep(60)
+        try:
+            BROWSER_POOL.reap()
+        except Exception:
+            logger.exception("Erro no reaper do pool Selenium")
+
+
+@app.on_event("startup")
+def start_browser_pool():
+    threading.Thread(target=_browser_reaper, name="selenium-reaper", daemon=True).start()
+    if SELENIUM_WARM:
+        threading.Thread(target=BROWSER_POOL.warm, args=(SELENIUM_WARM,), name="selenium-warm", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def stop_browser_pool():
+    BROWSER_POOL.close_all()
+
+
+# ---------------- Fila de jobs (automação) ----------------
+# As automações longas não rodam mais dentro da requisição: o endpoint
+# enfileira o job num pool próprio (JOB_WORKERS threads) e responde 202 com o
+# job_id. Status/progresso via GET /jobs/{id} ou push pelo WebSocket
+# /ws/jobs/{id}. Limites: JOB_QUEUE_MAX jobs pendentes no total e
+# JOB_MAX_PER_USER jobs ativos por usuário (429 quando estoura).
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "20"))
+JOB_MAX_PER_USER = int(os.environ.get("JOB_MAX_PER_USER", "1"))
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", str(60 * 60)))
+
+JOB_ATIVO = ("queued", "running")
+
+
+class Job:
+    __slots__ = (
+        "id", "tipo", "user", "status", "progresso", "mensagem",
+        "resultado", "erro", "criado_em", "atualizado_em", "version", "listeners",
+    )
+
+    def __init__(self, tipo: str, user: str):
+        self.id = str(uuid.uuid4())
+        self.tipo = tipo
+        self.user = user
+        self.status = "queued"
+        self.progresso = 0
+        self.mensagem = "Na fila"
+        self.resultado: Optional[Dict[str, Any]] = None
+        self.erro: Optional[str] = None
+        self.criado_em = time.time()
+        self.atualizado_em = self.criado_em
+        self.version = 0
+        self.listeners: List[tuple] = []  # (loop, asyncio.Queue) dos WebSockets
+
+    def snapshot(self) -> Dict[str, Any]:
         return {
-            "status": "success",
-            "mensagem": "Login realizado. Navegador mantido aberto no servidor."
+            "job_id": self.id,
+            "tipo": self.tipo,
+            "status": self.status,
+            "progresso": self.progresso,
+            "mensagem": self.mensagem,
+            "resultado": self.resultado,
+            "erro": self.erro,
+            "version": self.version,
         }
 
-    except Exception as e:
-        logger.exception("Erro rastreador")
-        raise HTTPException(status_code=500, detail=str(e))
+
+# Com StateBackend compartilhado cada mudança de status também é publicada em
+# "job:<id>", para que GET /jobs e o WebSocket funcionem em qualquer worker.
+class JobManager:
+    def __init__(self, workers: int, queue_max: int, max_per_user: int, retention: int, state: Optional[StateBackend] = None):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.queue_max = queue_max
+        self.max_per_user = max_per_user
+        self.retention = retention
+        self.state = state if state is not None and state.shared else None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _purge(self, now: float):
+        # jobs terminados saem depois de JOB_RETENTION (ordem de criação)
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.status in JOB_ATIVO or now - job.atualizado_em <= self.retention:
+                break
+            self._jobs.popitem(last=False)
+
+    def _update(self, job: Job, **fields):
+        with self._lock:
+            for k, v in fields.items():
+                setattr(job, k, v)
+            job.atualizado_em = time.time()
+            job.version += 1
+            snap = job.snapshot()
+            listeners = list(job.listeners)
+        self._publish(job, snap)
+        for loop, queue in listeners:
+            loop.call_soon_threadsafe(queue.put_nowait, snap)
+
+    def _publish(self, job: Job, snap: Dict[str, Any]):
+        if self.state is not None:
+            self.state.set(f"job:{job.id}", {**snap, "user": job.user}, ttl=self.retention)
+
+    def _run(self, job: Job, fn):
+        self._update(job, status="running", mensagem="Em execução")
+
+        def progress(pct: int, mensagem: str):
+            self._update(job, progresso=pct, mensagem=mensagem)
+
+        try:
+            resultado = fn(progress)
+            self._update(job, status="success", progresso=100, mensagem="Concluído", resultado=resultado)
+        except Exception as e:
+            logger.exception("Job %s (%s) falhou", job.id, job.tipo)
+            self._update(job, status="error", mensagem="Falha na execução", erro=str(e))
+
+    def submit(self, tipo: str, user: str, fn) -> Job:
+        with self._lock:
+            now = time.time()
+            self._purge(now)
+            ativos = [j for j in self._jobs.values() if j.status in JOB_ATIVO]
+
+            # mesmo usuário pedindo a mesma automação: devolve o job em andamento
+            for j in ativos:
+                if j.user == user and j.tipo == tipo:
+                    return j
+
+            if sum(1 for j in ativos if j.user == user) >= self.max_per_user:
+                raise HTTPException(status_code=429, detail="Já existe uma automação em andamento para este usuário")
+            if sum(1 for j in ativos if j.status == "queued") >= self.queue_max:
+                raise HTTPException(status_code=429, detail="Fila de automação cheia, tente novamente em instantes")
+
+            job = Job(tipo, user)
+            self._jobs[job.id] = job
+
+        self._publish(job, job.snapshot())
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def local(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str, info: Dict[str, Any]) -> Dict[str, Any]:
+        # snapshot do job, rodando neste worker ou em outro
+        job = self.local(job_id)
+        if job is not None:
+            user, snap = job.user, job.snapshot()
+        else:
+            snap = self.state.get(f"job:{job_id}") if self.state is not None else None
+            if snap is None:
+                raise HTTPException(status_code=404, detail="Job não encontrado")
+            user = snap.pop("user")
+        if user != info["user"] and info["role"] != "ti":
+            raise HTTPException(status_code=403, detail="Acesso negado")
+        return snap
+
+    def subscribe(self, job: Job, loop, queue) -> Dict[str, Any]:
+        with self._lock:
+            job.listeners.append((loop, queue))
+            return job.snapshot()
+
+    def unsubscribe(self, job: Job, loop, queue):
+        with self._lock:
+            if (loop, queue) in job.listeners:
+                job.listeners.remove((loop, queue))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+JOB_MANAGER = JobManager(JOB_WORKERS, JOB_QUEUE_MAX, JOB_MAX_PER_USER, JOB_RETENTION, STATE)
+
+
+@app.on_event("shutdown")
+def stop_job_manager():
+    JOB_MANAGER.shutdown()
+
+
+def enqueue_browser_job(tipo: str, site: str, info: Dict[str, Any], mensagem: str) -> JSONResponse:
+    def run(progress):
+        result = BROWSER_POOL.open(site, progress=progress)
+        return {"status": "success", "mensagem": mensagem, **result}
+
+    job = JOB_MANAGER.submit(tipo, info["user"], run)
+    return JSONResponse(status_code=202, content=job.snapshot())
+
+
+# ---------------- Routes - Rastreador ----------------
+@app.post("/rastreador/abrir-site")
+def rastreador_abrir_site(authorization: Optional[str] = Header(None)):
+    info = verify_token_header(authorization)
+
+    # admin OU ti
+    if info["role"] not in ["admin", "ti"]:
+        raise HTTPException(status_code=403, detail="Acesso negado")
+
+    return enqueue_browser_job(
+        "rastreador", "rastreador", info,
+        "Login realizado. Navegador mantido aberto no servidor.",
+    )
 
 
 
@@ -447,70 +3379,732 @@ def camera_abrir(authorization: Optional[str] = Header(None)):
     if info["role"] not in ["admin", "ti"]:
         raise HTTPException(status_code=403, detail="Acesso negado")
 
-    navegador = None
+    return enqueue_browser_job(
+        "camera", "camera", info,
+        "Login realizado com sucesso. Navegador mantido aberto.",
+    )
+
+
+# ---------------- Routes - Jobs ----------------
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, authorization: Optional[str] = Header(None)):
+    info = verify_token_header(authorization)
+    return JOB_MANAGER.status(job_id, info)
+
+
+def query_token_info(token: Optional[str]) -> Dict[str, Any]:
+    # navegador não manda header em WebSocket/EventSource: token vai na query string
+    return verify_token_header(f"Bearer {token}" if token else None)
 
+
+async def token_revalidado(token: Optional[str]) -> bool:
+    # conexões longas reconferem o token: expirado ou revogado (logout) corta o stream
     try:
-        options = webdriver.ChromeOptions()
-        # NÃO usar headless
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--window-size=1920,1080")
+        await run_in_threadpool(query_token_info, token)
+        return True
+    except HTTPException:
+        return False
 
-        navegador = webdriver.Chrome(options=options)
-        navegador.get("http://roaletelemetria.ddns.net:8070/login")
 
-        wait = WebDriverWait(navegador, 30)
+# sem mudança de status, de quanto em quanto tempo o WebSocket reconfere o token
+WS_TOKEN_RECHECK = float(os.environ.get("WS_TOKEN_RECHECK", "25"))
 
-        campo_user = wait.until(
-            EC.visibility_of_element_located((By.XPATH, '//*[@id="login"]'))
-        )
 
-        actions = ActionChains(navegador)
-        actions.move_to_element(campo_user).click().perform()
-        time.sleep(0.3)
+@app.websocket("/ws/jobs/{job_id}")
+async def job_status_ws(websocket: WebSocket, job_id: str, token: Optional[str] = Query(None)):
+    try:
+        # token e status podem ler o StateBackend (SQLite): fora do event loop
+        info = await run_in_threadpool(query_token_info, token)
+        snap = await run_in_threadpool(JOB_MANAGER.status, job_id, info)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    job = JOB_MANAGER.local(job_id)
+    if job is None:
+        # job de outro worker: acompanha pelo StateBackend
+        try:
+            while True:
+                await websocket.send_json(snap)
+                if snap["status"] not in JOB_ATIVO:
+                    break
+                version = snap["version"]
+                while snap["version"] == version:
+                    await asyncio.sleep(STATE_SYNC_INTERVAL)
+                    if not await token_revalidado(token):
+                        await websocket.close(code=4401, reason="Token expirado ou revogado")
+                        return
+                    snap = await run_in_threadpool(JOB_MANAGER.status, job_id, info)
+            await websocket.close()
+        except WebSocketDisconnect:
+            pass
+        except Exception:
+            logger.exception("Falha acompanhando o job %s pelo StateBackend", job_id)
+            await websocket.close(code=1011)
+        return
 
-        for letra in "globalsm":
-            campo_user.send_keys(letra)
-            time.sleep(0.05)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    snap = JOB_MANAGER.subscribe(job, loop, queue)
+    try:
+        while True:
+            await websocket.send_json(snap)
+            if snap["status"] not in JOB_ATIVO:
+                break
+            while True:
+                try:
+                    snap = await asyncio.wait_for(queue.get(), timeout=WS_TOKEN_RECHECK)
+                    break
+                except asyncio.TimeoutError:
+                    if not await token_revalidado(token):
+                        await websocket.close(code=4401, reason="Token expirado ou revogado")
+                        return
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        JOB_MANAGER.unsubscribe(job, loop, queue)
+
+
+@app.get("/selenium/metrics")
+def selenium_metrics():
+    return BROWSER_POOL.metrics()
 
-        campo_pass = wait.until(
-            EC.visibility_of_element_located((By.XPATH, '//*[@id="password"]'))
-        )
 
-        actions.move_to_element(campo_pass).click().perform()
-        time.sleep(0.3)
+# =====================================================================
+# ======================= CHAMADOS ====================================
+# =====================================================================
 
-        for letra in "glob@l1qaz":
-            campo_pass.send_keys(letra)
-            time.sleep(0.05)
+# =====================================================================
+# ======================= NOTIFICAÇÕES (PUSH) ==========================
+# =====================================================================
 
-        campo_pass.send_keys(Keys.RETURN)
+# Cada destinatário (papel admin/ti ou usuário comum) tem um número de versão
+# que sobe quando o seu conjunto de não lidos muda. Clientes recebem a
+# mudança por SSE (/notifications/stream) ou por long-poll
+# (/notifications/count?since=<versão>), sem varrer nada.
+class NotificationHub:
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._waiters: Dict[str, set] = {}  # quem -> {(loop, asyncio.Queue)}
+        self._lock = threading.Lock()
 
-        # Aguarda login efetivo
-        time.sleep(5)
+    def version(self, quem: str) -> int:
+        return self._versions.get(quem, 0)
 
-        return {
-            "status": "success",
-            "mensagem": "Login realizado com sucesso. Navegador mantido aberto."
-        }
+    def bump(self, quem: str, version: Optional[int] = None):
+        # o store passa o seq do evento: a versão é a mesma em todos os workers
+        with self._lock:
+            atual = self._versions.get(quem, 0)
+            v = atual + 1 if version is None else max(atual, version)
+            self._versions[quem] = v
+            waiters = list(self._waiters.get(quem, ()))
+        for loop, queue in waiters:
+            loop.call_soon_threadsafe(queue.put_nowait, v)
 
-    except Exception as e:
-        logger.exception("Erro câmera: %s", e)
-        raise HTTPException(status_code=500, detail=str(e))
+    def subscribe(self, quem: str, loop, queue):
+        with self._lock:
+            self._waiters.setdefault(quem, set()).add((loop, queue))
 
-    # ❌ NÃO FECHAR O NAVEGADOR
+    def unsubscribe(self, quem: str, loop, queue):
+        with self._lock:
+            waiters = self._waiters.get(quem)
+            if waiters is not None:
+                waiters.discard((loop, queue))
+                if not waiters:
+                    del self._waiters[quem]
 
 
-# =====================================================================
-# ======================= CHAMADOS (MEMÓRIA) ===========================
-# =====================================================================
+notification_hub = NotificationHub()
+
+
+def notification_key(info: Dict[str, Any]) -> str:
+    # admin/ti recebem pelo papel; usuário comum pelo nome
+    return info["role"] if info["role"] in ["admin", "ti"] else info["user"]
+
 
 # =====================================================================
-# ======================= STORE EM MEMÓRIA =============================
+# ======================= STORE + JOURNAL ==============================
 # =====================================================================
 
-chamados_store: Dict[str, dict] = {}
+class ChamadosJournal:
+    # Journal append-only (JSONL) + snapshot periódico.
+    # - Cada mutação vira uma linha com seq crescente, serializada na hora
+    #   (sob o lock do store) e enfileirada; a requisição não espera disco.
+    # - Uma thread grava em lote e faz um único fsync por lote (group commit),
+    #   no máximo a cada CHAMADOS_COMMIT_MS.
+    # - A cada CHAMADOS_SNAPSHOT_EVERY eventos grava snapshot.json (seq + todos
+    #   os chamados) via rename atômico e zera o journal. No replay, eventos com
+    #   seq <= seq do snapshot são ignorados, então a ordem snapshot/truncate
+    #   é segura mesmo com crash no meio.
+    def __init__(self, directory: Path, commit_ms: int, snapshot_every: int):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.journal_path = directory / "journal.jsonl"
+        self.snapshot_path = directory / "snapshot.json"
+        self.commit_interval = commit_ms / 1000
+        self.snapshot_every = snapshot_every
+        self._queue: List[str] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._since_snapshot = 0
+        self._closed = False
+        self.snapshot_source = None  # callable -> (seq, lista de chamados)
+        self.retry_interval = 1.0  # espera após falha de gravação
+
+    def append(self, line: str):
+        with self._cond:
+            self._queue.append(line)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._writer, name="chamados-journal", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _writer(self):
+        f = open(self.journal_path, "a", encoding="utf-8")
+        gravado = os.fstat(f.fileno()).st_size  # até onde o journal está íntegro
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._closed:
+                        self._cond.wait()
+                    if not self._queue and self._closed:
+                        return
+                # junta o que chegar na janela de commit num único fsync
+                time.sleep(self.commit_interval)
+                with self._cond:
+                    batch, self._queue = self._queue, []
+                try:
+                    f.write("".join(batch))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    gravado = os.fstat(f.fileno()).st_size
+                except Exception:
+                    # disco cheio, erro de I/O...: o lote volta para a frente da
+                    # fila e o pedaço escrito pela metade é cortado, senão o
+                    # replay aplicaria eventos em dobro
+                    logger.exception("Falha ao gravar %d evento(s) no journal; tentando de novo", len(batch))
+                    with self._cond:
+                        self._queue[:0] = batch
+                    f = self._reopen(f, gravado)
+                    time.sleep(max(self.commit_interval, self.retry_interval))
+                    continue
+                self._since_snapshot += len(batch)
+                if self._since_snapshot >= self.snapshot_every and self.snapshot_source is not None:
+                    f.close()
+                    try:
+                        self.write_snapshot()
+                    except Exception:
+                        # o journal continua valendo; tenta de novo no próximo lote
+                        logger.exception("Falha ao gravar snapshot de chamados")
+                    f = open(self.journal_path, "a", encoding="utf-8")
+                    gravado = os.fstat(f.fileno()).st_size
+        finally:
+            f.close()
+
+    def _reopen(self, f, gravado: int):
+        try:
+            f.close()
+        except Exception:
+            pass
+        try:
+            os.truncate(self.journal_path, gravado)
+        except OSError:
+            logger.exception("Não foi possível cortar o journal em %d bytes", gravado)
+        return open(self.journal_path, "a", encoding="utf-8")
+
+    def write_snapshot(self):
+        seq, chamados = self.snapshot_source()
+        tmp = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"seq": seq, "chamados": chamados}, ensure_ascii=False))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # tudo até seq está no snapshot: o journal pode recomeçar vazio
+        with open(self.journal_path, "w", encoding="utf-8"):
+            pass
+        self._since_snapshot = 0
+        logger.info("Snapshot de chamados gravado (seq=%d, %d chamados)", seq, len(chamados))
+
+    def replay(self):
+        # devolve (seq do snapshot, chamados do snapshot, eventos do journal)
+        seq, chamados = 0, []
+        if self.snapshot_path.exists():
+            data = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+            seq, chamados = data["seq"], data["chamados"]
+        eventos = []
+        if self.journal_path.exists():
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        evento = json.loads(line)
+                    except json.JSONDecodeError:
+                        # última linha pela metade (crash no meio do write)
+                        logger.warning("Linha inválida no journal de chamados ignorada")
+                        continue
+                    if evento["seq"] > seq:
+                        eventos.append(evento)
+        return seq, chamados, eventos
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# Índice invertido para a busca de chamados: token -> {chamado: peso}.
+# Tokens com o mesmo fold_text das buscas de materiais (NFKD, sem acento,
+# minúsculo). Peso por campo: título conta mais que categoria, que conta mais
+# que descrição e mensagens. Alimentado pelo _apply_event do TicketStore, então
+# abertura, resposta, replay do journal e eventos de outros workers entram
+# pelo mesmo caminho. O replay em si não indexa (o startup continua rápido):
+# o índice anda atrás de _order e alcança os chamados pendentes em lotes
+# numa thread após o load, ou na própria busca. Consulta: todos os termos precisam aparecer (E), o
+# último vale como prefixo (busca enquanto digita), ranking BM25 simplificado.
+CHAMADOS_SEARCH_PESOS = {"titulo": 3.0, "categoria": 2.0, "descricao": 1.0, "texto": 1.0}
+# palavras de 2+ caracteres, ou um dígito sozinho
+SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]{2,}|[0-9]")
+
+
+def search_tokens(value: Any) -> List[str]:
+    return SEARCH_TOKEN_RE.findall(fold_text(value))
+
+
+class TicketSearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}
+        # vocabulário ordenado só para expandir prefixos com bisect; termos novos
+        # esperam em _novos e entram na próxima busca (replay não ordena nada)
+        self._vocab: List[str] = []
+        self._novos: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def add_text(self, cid: str, texto: Any, peso: float):
+        postings = self._postings
+        for token in search_tokens(texto):
+            docs = postings.get(token)
+            if docs is None:
+                docs = postings[token] = {}
+                self._novos.append(token)
+            docs[cid] = docs.get(cid, 0.0) + peso
+
+    def _sorted_vocab(self) -> List[str]:
+        if self._novos:
+            if len(self._novos) > 64:
+                self._vocab = sorted(self._postings)
+            else:
+                for token in self._novos:
+                    bisect.insort(self._vocab, token)
+            self._novos = []
+        return self._vocab
+
+    def add_ticket(self, chamado: dict):
+        cid = chamado["id"]
+        for campo in ("titulo", "categoria", "descricao"):
+            self.add_text(cid, chamado.get(campo) or "", CHAMADOS_SEARCH_PESOS[campo])
+        for mensagem in chamado["mensagens"]:
+            self.add_text(cid, mensagem.get("texto") or "", CHAMADOS_SEARCH_PESOS["texto"])
+
+    def _expand(self, termo: str, prefixo: bool) -> List[str]:
+        if not prefixo:
+            return [termo] if termo in self._postings else []
+        vocab = self._sorted_vocab()
+        start = bisect.bisect_left(vocab, termo)
+        end = bisect.bisect_left(vocab, termo + "\x7f")
+        return vocab[start:end]
+
+    def search(self, q: str, total_docs: int) -> Dict[str, float]:
+        termos = search_tokens(q)
+        scores: Optional[Dict[str, float]] = None
+        for i, termo in enumerate(termos):
+            parcial: Dict[str, float] = {}
+            for token in self._expand(termo, prefixo=i == len(termos) - 1):
+                docs = self._postings[token]
+                idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for cid, peso in docs.items():
+                    # tf saturado: repetir a palavra ajuda, mas cada vez menos
+                    parcial[cid] = parcial.get(cid, 0.0) + idf * peso * 2.2 / (peso + 1.2)
+            if scores is None:
+                scores = parcial
+            else:
+                scores = {cid: s + parcial[cid] for cid, s in scores.items() if cid in parcial}
+            if not scores:
+                return {}
+        return scores or {}
+
+
+# Além do dict principal, o store mantém índices secundários (por autor, por
+# status, busca textual) e os conjuntos de não lidos por papel e por usuário. Toda mudança
+# passa por _apply (o mesmo caminho usado no replay do journal), então índices
+# e disco não divergem; as consultas custam o tamanho do resultado.
+#
+# Com um StateBackend compartilhado (vários workers) o journal local dá lugar
+# ao log "chamados" do backend, que define o seq global: cada worker aplica
+# os eventos novos do log antes de ler ou escrever (e numa thread a cada
+# STATE_SYNC_INTERVAL, para acordar SSE/long-poll). O snapshot vira a chave
+# "chamados:snapshot" e o log é podado mantendo uma margem de
+# snapshot_every eventos para workers atrasados.
+class TicketStore:
+    def __init__(
+        self,
+        journal: Optional[ChamadosJournal] = None,
+        shared: Optional[StateBackend] = None,
+        snapshot_every: int = 5000,
+    ):
+        self.journal = journal
+        self.shared = shared
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._reset()
+        if journal is not None:
+            journal.snapshot_source = self._snapshot
+
+    def _reset(self):
+        self._tickets: Dict[str, dict] = {}
+        self._order: List[str] = []  # ordem de abertura (cursor = posição)
+        self._by_author: Dict[str, List[str]] = {}
+        self._changes: "OrderedDict[str, int]" = OrderedDict()  # id -> seq da última mudança
+        self._msg_seqs: Dict[str, List[int]] = {}  # seq de cada mensagem, paralelo a "mensagens"
+        self._by_status: Dict[str, Dict[str, None]] = {}
+        self._unread_by_role: Dict[str, set] = {}
+        self._unread_by_user: Dict[str, set] = {}
+        self._search = TicketSearchIndex()
+        self._search_pos = 0  # chamados de _order já indexados
+        self._search_ids: set = set()
+        self._seq = 0
+
+    def _unread_index(self, quem: str) -> Dict[str, set]:
+        return self._unread_by_role if quem in ROLE_LEVEL else self._unread_by_user
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    # ---------- aplicação de eventos ----------
+    def _touch(self, cid: str, seq: int):
+        self._changes[cid] = seq
+        self._changes.move_to_end(cid)
+
+    def _apply(self, evento: dict, seq: int) -> bool:
+        # devolve False quando o evento não muda nada (não vai para o journal)
+        changed = self._apply_event(evento, seq)
+        if changed:
+            self._touch(evento["chamado"]["id"] if evento["op"] == "add" else evento["id"], seq)
+        return changed
+
+    def _apply_event(self, evento: dict, seq: int) -> bool:
+        op = evento["op"]
+        if op == "add":
+            chamado = evento["chamado"]
+            cid = chamado["id"]
+            self._tickets[cid] = chamado
+            self._order.append(cid)
+            self._by_author.setdefault(chamado["autor"], []).append(cid)
+            self._msg_seqs[cid] = [seq] * len(chamado["mensagens"])
+            self._by_status.setdefault(chamado["status"], {})[cid] = None
+            for quem in chamado["nao_lido_por"]:
+                self._unread_index(quem).setdefault(quem, set()).add(cid)
+                notification_hub.bump(quem, seq)
+            return True
+
+        chamado = self._tickets[evento["id"]]
+        cid = chamado["id"]
+        if op == "status":
+            if chamado["status"] == evento["status"]:
+                return False
+            self._by_status.get(chamado["status"], {}).pop(cid, None)
+            chamado["status"] = evento["status"]
+            self._by_status.setdefault(evento["status"], {})[cid] = None
+        elif op == "msg":
+            chamado["mensagens"].append(evento["mensagem"])
+            self._msg_seqs[cid].append(seq)
+            if cid in self._search_ids:
+                # chamado ainda não indexado entra inteiro (com esta mensagem) depois
+                self._search.add_text(cid, evento["mensagem"].get("texto") or "", CHAMADOS_SEARCH_PESOS["texto"])
+        elif op == "unread":
+            quem = evento["quem"]
+            unread = self._unread_index(quem).setdefault(quem, set())
+            if quem in chamado["nao_lido_por"] and cid in unread:
+                return False
+            if quem not in chamado["nao_lido_por"]:
+                chamado["nao_lido_por"].append(quem)
+            unread.add(cid)
+            notification_hub.bump(quem, seq)
+        elif op == "read":
+            quem = evento["quem"]
+            unread = self._unread_index(quem).get(quem)
+            if quem not in chamado["nao_lido_por"] and (unread is None or cid not in unread):
+                return False
+            if quem in chamado["nao_lido_por"]:
+                chamado["nao_lido_por"].remove(quem)
+            if unread is not None:
+                unread.discard(cid)
+            notification_hub.bump(quem, seq)
+        return True
+
+    def _is_noop(self, evento: dict) -> bool:
+        # mesma regra de "nada mudou" do _apply_event, sem aplicar
+        op = evento["op"]
+        if op in ("add", "msg"):
+            return False
+        chamado = self._tickets[evento["id"]]
+        if op == "status":
+            return chamado["status"] == evento["status"]
+        quem = evento["quem"]
+        unread = evento["id"] in self._unread_index(quem).get(quem, ())
+        if op == "unread":
+            return quem in chamado["nao_lido_por"] and unread
+        return quem not in chamado["nao_lido_por"] and not unread
+
+    def _catch_up(self):
+        eventos = self.shared.read("chamados", self._seq)
+        if eventos and eventos[0][0] != self._seq + 1:
+            # o log foi podado além do que este worker viu: recarrega do snapshot
+            logger.warning("Worker atrasado no log de chamados (seq %d); recarregando", self._seq)
+            self._reset()
+            self._load_shared()
+            return
+        for seq, evento in eventos:
+            try:
+                self._apply(evento, seq)
+            except KeyError:
+                logger.warning("Evento %s para chamado inexistente ignorado", seq)
+            self._seq = seq
+
+    def sync(self):
+        if self.shared is not None:
+            with self._lock:
+                self._catch_up()
+
+    def _commit_shared(self, evento: dict):
+        self._catch_up()
+        if self._is_noop(evento):
+            return
+        seq = self.shared.append("chamados", evento)
+        self._catch_up()  # aplica o nosso e o que outro worker gravou antes
+        if seq % self.snapshot_every == 0:
+            self._schedule_shared_snapshot()
+
+    def _schedule_shared_snapshot(self):
+        # como no journal: cópia + JSON de todos os chamados não rodam na
+        # requisição (nem segurando o lock do store durante o set)
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        self._snapshot_thread = threading.Thread(
+            target=self._write_shared_snapshot, name="chamados-snapshot", daemon=True
+        )
+        self._snapshot_thread.start()
+
+    def _write_shared_snapshot(self):
+        try:
+            snap_seq, chamados = self._snapshot()
+            self.shared.set("chamados:snapshot", {"seq": snap_seq, "chamados": chamados})
+            self.shared.trim("chamados", snap_seq - self.snapshot_every)
+        except Exception:
+            logger.exception("Falha ao gravar snapshot de chamados")
+
+    def _commit(self, evento: dict):
+        with self._lock:
+            if self.shared is not None:
+                self._commit_shared(evento)
+                return
+            if not self._apply(evento, self._seq + 1):
+                return
+            self._seq += 1
+            if self.journal is not None:
+                # serializa já: o dict do chamado continua mudando depois
+                self.journal.append(json.dumps({"seq": self._seq, **evento}, ensure_ascii=False) + "\n")
+
+    def _snapshot(self):
+        with self._lock:
+            # cópia rasa suficiente: json.dumps roda fora do lock, mas as listas
+            # de mensagens/nao_lido_por são copiadas aqui
+            chamados = [
+                {**c, "mensagens": list(c["mensagens"]), "nao_lido_por": list(c["nao_lido_por"])}
+                for c in self._tickets.values()
+            ]
+            return self._seq, chamados
+
+    def _load_shared(self):
+        snap = self.shared.get("chamados:snapshot") or {"seq": 0, "chamados": []}
+        for chamado in snap["chamados"]:
+            self._apply({"op": "add", "chamado": chamado}, snap["seq"])
+        self._seq = snap["seq"]
+        self._catch_up()
+
+    def load(self):
+        if self.shared is not None:
+            with self._lock:
+                self._load_shared()
+            logger.info("Chamados carregados do estado compartilhado: %d (seq=%d)", len(self._tickets), self._seq)
+            return
+        if self.journal is None:
+            return
+        inicio = time.perf_counter()
+        seq, chamados, eventos = self.journal.replay()
+        with self._lock:
+            for chamado in chamados:
+                self._apply({"op": "add", "chamado": chamado}, seq)
+            self._seq = seq
+            for evento in eventos:
+                try:
+                    self._apply(evento, evento["seq"])
+                except KeyError:
+                    logger.warning("Evento %s para chamado inexistente ignorado", evento.get("seq"))
+                self._seq = evento["seq"]
+        logger.info(
+            "Chamados carregados: %d (snapshot seq=%d + %d eventos) em %.0f ms",
+            len(self._tickets), seq, len(eventos), (time.perf_counter() - inicio) * 1000,
+        )
+
+    # ---------- mutações ----------
+    def add(self, chamado: dict) -> dict:
+        self._commit({"op": "add", "chamado": chamado})
+        return chamado
+
+    def set_status(self, chamado: dict, status: str):
+        self._commit({"op": "status", "id": chamado["id"], "status": status})
+
+    def mark_unread(self, chamado: dict, quem: str):
+        self._commit({"op": "unread", "id": chamado["id"], "quem": quem})
+
+    def mark_read(self, chamado: dict, quem: str):
+        self._commit({"op": "read", "id": chamado["id"], "quem": quem})
+
+    def add_message(self, chamado: dict, mensagem: dict):
+        self._commit({"op": "msg", "id": chamado["id"], "mensagem": mensagem})
+
+    # ---------- consultas ----------
+    def get(self, chamado_id: str) -> Optional[dict]:
+        self.sync()
+        return self._tickets.get(chamado_id)
+
+    def all(self) -> List[dict]:
+        with self._lock, span("chamados_scan"):
+            self.sync()
+            return list(self._tickets.values())
+
+    def by_author(self, autor: str) -> List[dict]:
+        with self._lock, span("chamados_scan"):
+            self.sync()
+            return [self._tickets[cid] for cid in self._by_author.get(autor, [])]
+
+    @property
+    def version(self) -> int:
+        return self._seq
+
+    def page(self, autor: Optional[str], start: int, limit: int) -> tuple:
+        # página na ordem de abertura; custo O(limit)
+        with self._lock, span("chamados_scan"):
+            self.sync()
+            ids = self._order if autor is None else self._by_author.get(autor, [])
+            chunk = ids[start:start + limit]
+            next_start = start + limit if start + limit < len(ids) else None
+            return [self._tickets[cid] for cid in chunk], next_start
+
+    def changed_since(self, since: int, autor: Optional[str], limit: int) -> tuple:
+        # chamados alterados depois de `since`, do mais antigo ao mais novo.
+        # Anda de trás para frente em _changes e para no primeiro seq <= since.
+        with self._lock, span("chamados_scan"):
+            self.sync()
+            hits = []
+            for cid in reversed(self._changes):
+                seq = self._changes[cid]
+                if seq <= since:
+                    break
+                if autor is None or self._tickets[cid]["autor"] == autor:
+                    hits.append((seq, cid))
+            hits.reverse()
+            truncated = len(hits) > limit
+            hits = hits[:limit]
+            version = hits[-1][0] if truncated else self._seq
+            return [self._tickets[cid] for _, cid in hits], version
+
+    def messages_since(self, chamado: dict, since: int) -> List[dict]:
+        with self._lock:
+            seqs = self._msg_seqs.get(chamado["id"], [])
+            return chamado["mensagens"][bisect.bisect_right(seqs, since):]
+
+    def _index_pending(self, limit: Optional[int] = None) -> bool:
+        # indexa chamados de _order ainda fora do índice; True = em dia
+        with self._lock:
+            fim = len(self._order) if limit is None else min(len(self._order), self._search_pos + limit)
+            for cid in self._order[self._search_pos:fim]:
+                self._search.add_ticket(self._tickets[cid])
+                self._search_ids.add(cid)
+            self._search_pos = fim
+            return fim == len(self._order)
+
+    def warm_search(self, batch: int = 2000):
+        # lotes curtos: o lock do store fica livre entre um e outro
+        while not self._index_pending(batch):
+            time.sleep(0)
+
+    def search(self, q: str, autor: Optional[str], limit: int) -> tuple:
+        # (lista de (chamado, score) do mais relevante ao menos, total de acertos);
+        # empate vai para o chamado mexido mais recentemente
+        with self._lock, span("chamados_search"):
+            self.sync()
+            self._index_pending()
+            scores = self._search.search(q, len(self._tickets))
+            if autor is not None:
+                scores = {cid: s for cid, s in scores.items() if self._tickets[cid]["autor"] == autor}
+            ranked = heapq.nsmallest(
+                limit, scores.items(), key=lambda item: (-item[1], -self._changes.get(item[0], 0))
+            )
+            return [(self._tickets[cid], score) for cid, score in ranked], len(scores)
+
+    def by_status(self, status: str) -> List[dict]:
+        with self._lock, span("chamados_scan"):
+            self.sync()
+            return [self._tickets[cid] for cid in self._by_status.get(status, {})]
+
+    def unread_count(self, quem: str) -> int:
+        self.sync()
+        return len(self._unread_index(quem).get(quem, ()))
+
+
+CHAMADOS_DIR = Path(os.environ.get("CHAMADOS_DIR", os.path.join(BASE_DIR, "chamados")))
+CHAMADOS_COMMIT_MS = int(os.environ.get("CHAMADOS_COMMIT_MS", "20"))
+CHAMADOS_SNAPSHOT_EVERY = int(os.environ.get("CHAMADOS_SNAPSHOT_EVERY", "5000"))
+
+if STATE.shared:
+    chamados_store = TicketStore(shared=STATE, snapshot_every=CHAMADOS_SNAPSHOT_EVERY)
+else:
+    chamados_store = TicketStore(ChamadosJournal(CHAMADOS_DIR, CHAMADOS_COMMIT_MS, CHAMADOS_SNAPSHOT_EVERY))
+chamados_store.load()
+
+
+def chamados_sync_loop():
+    # traz eventos de outros workers mesmo sem requisição chegando aqui
+    while True:
+        time.sleep(STATE_SYNC_INTERVAL)
+        try:
+            chamados_store.sync()
+        except Exception:
+            logger.exception("Falha ao sincronizar chamados")
+
+
+@app.on_event("startup")
+def start_chamados_sync():
+    if chamados_store.shared is not None:
+        threading.Thread(target=chamados_sync_loop, name="chamados-sync", daemon=True).start()
+    # índice de busca sai do replay: monta em segundo plano
+    threading.Thread(target=chamados_store.warm_search, name="chamados-search", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def close_chamados_journal():
+    # drena a fila e faz o último fsync
+    if chamados_store.journal is not None:
+        chamados_store.journal.close()
+
 
 # =====================================================================
 # ======================= MODELS ======================================
@@ -541,7 +4135,7 @@ def abrir_chamado(
     if info["role"] in nao_lido_por:
         nao_lido_por.remove(info["role"])
 
-    chamados_store[chamado_id] = {
+    chamado = chamados_store.add({
         "id": chamado_id,
         "titulo": titulo,
         "categoria": categoria,
@@ -552,35 +4146,121 @@ def abrir_chamado(
         "mensagens": [],
         "criado_em": time.strftime("%Y-%m-%d %H:%M:%S"),
         "nao_lido_por": nao_lido_por,
-    }
+    })
 
-    return chamados_store[chamado_id]
+    return chamado
 
 # =====================================================================
 # ======================= MEUS CHAMADOS ================================
 # =====================================================================
 
+# Sem parâmetros, /chamados e /meus-chamados devolvem a lista completa como
+# antes. Com limit/cursor/since a resposta vira um envelope
+# {"items", "next_cursor", "version"}: cursor pagina na ordem de abertura e
+# since=<version> traz só o que mudou depois dessa versão.
+# view=summary tira as mensagens.
+def chamado_summary(chamado: dict) -> dict:
+    resumo = {k: v for k, v in chamado.items() if k != "mensagens"}
+    resumo["total_mensagens"] = len(chamado["mensagens"])
+    resumo["ultima_mensagem_em"] = chamado["mensagens"][-1]["data"] if chamado["mensagens"] else None
+    return resumo
+
+
+def chamados_listing(autor: Optional[str], view: str, limit: Optional[int], cursor: Optional[str], since: Optional[int]):
+    project = chamado_summary if view == "summary" else (lambda c: c)
+
+    if limit is None and cursor is None and since is None:
+        itens = chamados_store.all() if autor is None else chamados_store.by_author(autor)
+        return [project(c) for c in itens]
+
+    limit = limit or 100
+    if since is not None:
+        itens, version = chamados_store.changed_since(since, autor, limit)
+        next_cursor = None
+    else:
+        try:
+            start = int(cursor) if cursor else 0
+        except ValueError:
+            raise HTTPException(400, "Cursor inválido")
+        version = chamados_store.version
+        itens, next_start = chamados_store.page(autor, start, limit)
+        next_cursor = str(next_start) if next_start is not None else None
+
+    return {"items": [project(c) for c in itens], "next_cursor": next_cursor, "version": version}
+
+
+def chamados_response(resultado, accept: Optional[str], accept_encoding: Optional[str]) -> Response:
+    # NDJSON: um chamado por linha; no modo paginado cursor e versão vão nos headers
+    if wants_ndjson(accept):
+        headers = {}
+        itens = resultado
+        if isinstance(resultado, dict):
+            itens = resultado["items"]
+            headers["X-Version"] = str(resultado["version"])
+            if resultado["next_cursor"] is not None:
+                headers["X-Next-Cursor"] = resultado["next_cursor"]
+        return ndjson_response(records_ndjson_chunks(itens), accept_encoding, headers)
+    with span("serialize"):
+        body = json_bytes(resultado)
+    return encoded_response(body, accept_encoding)
+
+
 @app.get("/meus-chamados")
-def meus_chamados(authorization: Optional[str] = Header(None)):
+def meus_chamados(
+    authorization: Optional[str] = Header(None),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     info = verify_token_header(authorization)
 
-    return [
-        c for c in chamados_store.values()
-        if c["autor"] == info["user"]
-    ]
+    resultado = chamados_listing(info["user"], view, limit, cursor, since)
+    return chamados_response(resultado, accept, accept_encoding)
 
 # =====================================================================
 # ======================= LISTAR TODOS =================================
 # =====================================================================
 
 @app.get("/chamados")
-def listar_chamados(authorization: Optional[str] = Header(None)):
+def listar_chamados(
+    authorization: Optional[str] = Header(None),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    since: Optional[int] = Query(None, ge=0),
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     info = verify_token_header(authorization)
 
     if info["role"] not in ["admin", "ti"]:
         raise HTTPException(403, "Acesso negado")
 
-    return list(chamados_store.values())
+    resultado = chamados_listing(None, view, limit, cursor, since)
+    return chamados_response(resultado, accept, accept_encoding)
+
+# =====================================================================
+# ======================= BUSCA ========================================
+# =====================================================================
+
+# Declarada antes de /chamados/{chamado_id} para "search" não virar um id.
+# Admin e TI buscam em todos; os demais só nos próprios chamados.
+@app.get("/chamados/search")
+def buscar_chamados(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
+    authorization: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
+    info = verify_token_header(authorization)
+    autor = None if info["role"] in ["admin", "ti"] else info["user"]
+
+    resultados, total = chamados_store.search(q, autor, limit)
+    itens = [{**chamado_summary(c), "score": round(score, 4)} for c, score in resultados]
+    return encoded_response(json_bytes({"items": itens, "total": total}), accept_encoding)
 
 # =====================================================================
 # ======================= DETALHE DO CHAMADO ===========================
@@ -589,7 +4269,8 @@ def listar_chamados(authorization: Optional[str] = Header(None)):
 @app.get("/chamados/{chamado_id}")
 def detalhe_chamado(
     chamado_id: str,
-    authorization: Optional[str] = Header(None)
+    authorization: Optional[str] = Header(None),
+    since: Optional[int] = Query(None, ge=0),
 ):
     info = verify_token_header(authorization)
 
@@ -597,15 +4278,19 @@ def detalhe_chamado(
     if not chamado:
         raise HTTPException(404, "Chamado não encontrado")
 
-    # Autor pode ver o próprio
-    if chamado["autor"] == info["user"]:
-        return chamado
-
-    # Admin e TI podem ver todos
-    if info["role"] not in ["admin", "ti"]:
+    # Autor pode ver o próprio; admin e TI podem ver todos
+    if chamado["autor"] != info["user"] and info["role"] not in ["admin", "ti"]:
         raise HTTPException(403, "Acesso negado")
 
-    return chamado
+    if since is None:
+        return chamado
+
+    # delta do thread: cabeçalho do chamado + só as mensagens novas
+    return {
+        "chamado": chamado_summary(chamado),
+        "mensagens": chamados_store.messages_since(chamado, since),
+        "version": chamados_store.version,
+    }
 
 # =====================================================================
 # ======================= RESPONDER CHAMADO ============================
@@ -638,28 +4323,23 @@ def responder_chamado(
         "data": time.strftime("%Y-%m-%d %H:%M:%S"),
     }
 
-    chamado["mensagens"].append(mensagem)
+    chamados_store.add_message(chamado, mensagem)
 
     # ================= NOTIFICAÇÕES =================
 
     # Remove quem respondeu
-    if info["role"] in chamado["nao_lido_por"]:
-        chamado["nao_lido_por"].remove(info["role"])
-
-    if info["user"] in chamado["nao_lido_por"]:
-        chamado["nao_lido_por"].remove(info["user"])
+    chamados_store.mark_read(chamado, info["role"])
+    chamados_store.mark_read(chamado, info["user"])
 
     # Se TI respondeu → notifica autor
     if info["role"] == "ti":
-        chamado["status"] = "Em andamento"
-        if chamado["autor"] not in chamado["nao_lido_por"]:
-            chamado["nao_lido_por"].append(chamado["autor"])
+        chamados_store.set_status(chamado, "Em andamento")
+        chamados_store.mark_unread(chamado, chamado["autor"])
 
     # Se autor respondeu → notifica TI
     if info["role"] == "comum":
-        chamado["status"] = "Respondido"
-        if "ti" not in chamado["nao_lido_por"]:
-            chamado["nao_lido_por"].append("ti")
+        chamados_store.set_status(chamado, "Respondido")
+        chamados_store.mark_unread(chamado, "ti")
 
     return mensagem
 
@@ -678,11 +4358,8 @@ def marcar_como_lido(
     if not chamado:
         raise HTTPException(404, "Chamado não encontrado")
 
-    if info["role"] in chamado["nao_lido_por"]:
-        chamado["nao_lido_por"].remove(info["role"])
-
-    if info["user"] in chamado["nao_lido_por"]:
-        chamado["nao_lido_por"].remove(info["user"])
+    chamados_store.mark_read(chamado, info["role"])
+    chamados_store.mark_read(chamado, info["user"])
 
     return {"success": True}
 
@@ -690,24 +4367,133 @@ def marcar_como_lido(
 # ======================= CONTADOR DE NOTIFICAÇÕES =====================
 # =====================================================================
 
+NOTIFICATIONS_MAX_WAIT = 55  # s; abaixo do timeout típico de proxy
+
+
+def notification_payload(quem: str) -> Dict[str, int]:
+    return {"count": chamados_store.unread_count(quem), "version": notification_hub.version(quem)}
+
+
 @app.get("/notifications/count")
-def notifications_count(authorization: Optional[str] = Header(None)):
-    info = verify_token_header(authorization)
+async def notifications_count(
+    authorization: Optional[str] = Header(None),
+    since: Optional[int] = Query(None),
+    wait: int = Query(25, ge=0, le=NOTIFICATIONS_MAX_WAIT),
+):
+    # token e contagem podem tocar o SQLite/lock do store: fora do event loop
+    info = await run_in_threadpool(verify_token_header, authorization)
+    quem = notification_key(info)
+
+    # long-poll: com ?since=<versão>, segura a resposta até a versão mudar
+    if since is not None and since == notification_hub.version(quem) and wait > 0:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        notification_hub.subscribe(quem, loop, queue)
+        try:
+            if since == notification_hub.version(quem):
+                await asyncio.wait_for(queue.get(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            notification_hub.unsubscribe(quem, loop, queue)
 
-    count = 0
+    return await run_in_threadpool(notification_payload, quem)
 
-    for c in chamados_store.values():
-        if info["role"] in ["admin", "ti"]:
-            if info["role"] in c.get("nao_lido_por", []):
-                count += 1
-        else:
-            if info["user"] in c.get("nao_lido_por", []):
-                count += 1
 
-    return {"count": count}
+@app.get("/notifications/stream")
+async def notifications_stream(token: Optional[str] = Query(None)):
+    info = await run_in_threadpool(query_token_info, token)
+    quem = notification_key(info)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    notification_hub.subscribe(quem, loop, queue)
+
+    async def events():
+        try:
+            last = None
+            while True:
+                payload = await run_in_threadpool(notification_payload, quem)
+                if payload["version"] != last:
+                    last = payload["version"]
+                    yield f"event: count\ndata: {json.dumps(payload)}\n\n"
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=25)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"  # mantém a conexão viva em proxies
+                if not await token_revalidado(token):
+                    # o EventSource reconecta e recebe o 403 do token vencido
+                    yield "event: expired\ndata: {}\n\n"
+                    return
+        finally:
+            notification_hub.unsubscribe(quem, loop, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ---------------- Métricas (Prometheus) ----------------
+def metric_gauges() -> List[tuple]:
+    pend = PENDENTE_STORE.metrics()
+    exports = EXPORT_CACHE.metrics()
+    parse = PARSE_CACHE.metrics()
+    selenium = BROWSER_POOL.metrics()
+    gauges = [
+        ("pendente_datasets", "Datasets pendente em memória", "gauge", {}, pend["entries"]),
+        ("pendente_bytes_held", "Bytes de datasets pendente em memória", "gauge", {}, pend["bytes_held"]),
+        ("pendente_cache_total", "Acessos ao store de datasets", "counter", {"result": "hit"}, pend["hits"]),
+        ("pendente_cache_total", "Acessos ao store de datasets", "counter", {"result": "miss"}, pend["misses"]),
+        ("export_cache_bytes", "Bytes no cache de exportações", "gauge", {}, exports["bytes_held"]),
+        ("parse_cache_bytes", "Bytes no cache de parse", "gauge", {}, parse["bytes_held"]),
+        ("parse_cache_total", "Consultas ao cache de parse", "counter", {"result": "hit"}, parse["hits"]),
+        ("parse_cache_total", "Consultas ao cache de parse", "counter", {"result": "miss"}, parse["misses"]),
+        ("selenium_sessions", "Navegadores abertos no pool", "gauge", {}, len(selenium["sessions"])),
+        ("chamados_total", "Chamados no store", "gauge", {}, len(chamados_store)),
+    ]
+    for reason, n in pend["evictions"].items():
+        gauges.append(("pendente_evictions_total", "Datasets removidos da memória", "counter", {"reason": reason}, n))
+    for nome, pool in (("cpu", CPU_POOL), ("light", LIGHT_POOL)):
+        m = pool.metrics()
+        gauges.append(("offload_inflight", "Tarefas em execução ou na fila", "gauge", {"pool": nome}, m["inflight"]))
+        gauges.append(("offload_rejected_total", "Tarefas recusadas com 429", "counter", {"pool": nome}, m["rejected"]))
+    return gauges
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(
+        METRICS.render(metric_gauges()),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 
 # ---------------- Run ----------------
+# WEB_WORKERS (ou --workers N) sobe N processos uvicorn. Com mais de um
+# worker o estado precisa ser compartilhado: STATE_BACKEND=memory vira sqlite
+# (o ambiente é herdado pelos workers, que reimportam este módulo).
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+
 if __name__ == "__main__":
-    logger.info("Iniciando FastAPI em http://0.0.0.0:5055")
-    uvicorn.run("main:app", host="0.0.0.0", port=5055, log_level="info")
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Technoblade Unified API")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    args = parser.parse_args()
+
+    if args.workers > 1 and pq is None:
+        # sem pyarrow os datasets do pendente ficam no heap de um worker só e
+        # as requisições seguintes caem em outro (404)
+        parser.error("--workers > 1 exige pyarrow (pip install pyarrow)")
+
+    if args.workers > 1 and TOKEN_MODE == "signed" and not TOKEN_SECRET:
+        # cada worker sortearia o próprio segredo e recusaria os tokens dos outros
+        parser.error("--workers > 1 com TOKEN_MODE=signed exige TOKEN_SECRET")
+
+    if args.workers > 1 and STATE_BACKEND == "memory":
+        logger.info("STATE_BACKEND=memory não é compartilhado entre workers; usando sqlite (%s)", STATE_DB)
+        os.environ["STATE_BACKEND"] = "sqlite"
+
+    logger.info("Iniciando FastAPI em http://0.0.0.0:5055 (%d worker(s))", args.workers)
+    uvicorn.run("main:app", host="0.0.0.0", port=5055, log_level="info", workers=args.workers)
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# main.py cria diretórios relativos (files/) e lê o ambiente na importação:
+# tudo vai para um diretório temporário antes do import
+WORKDIR = Path(tempfile.mkdtemp(prefix="technoblade-tests-"))
+os.environ.setdefault("MATERIAIS_PATH", str(WORKDIR / "CODIGOS.xlsx"))
+os.environ.setdefault("CHAMADOS_DIR", str(WORKDIR / "files" / "chamados"))
+os.environ.setdefault("STATE_DB", str(WORKDIR / "files" / "state.db"))
+os.chdir(WORKDIR)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # sem "with": os loops de startup (limpeza, sync) não sobem nos testes
+    return TestClient(main.app)
+
+
+def login(client, username: str, password: str) -> dict:
+    res = client.post("/login", json={"username": username, "password": password})
+    assert res.status_code == 200
+    return {"Authorization": f"Bearer {res.json()['token']}"}
+
+
+@pytest.fixture
+def admin_headers(client):
+    return login(client, "renan", "renan2025")
+
+
+@pytest.fixture
+def comum_headers(client):
+    return login(client, "NovaSP", "cmnsp2025")
+
+
+@pytest.fixture
+def ti_headers(client):
+    return login(client, "jaya", "697843")
+
+
+def pendente_frame(n: int = 50) -> pd.DataFrame:
+    return pd.DataFrame({
+        "contrato": [f"C{i % 2}" for i in range(n)],
+        "atc": [f"A{i % 5}-x" for i in range(n)],
+        "descricao_tss": [f"d{i % 3}" for i in range(n)],
+        "familia": ["f"] * n,
+        "linha": range(n),
+    })
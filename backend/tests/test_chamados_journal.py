@@ -0,0 +1,118 @@
+import json
+
+import main
+
+
+def chamado(cid, autor="NovaSP"):
+    return {
+        "id": cid, "titulo": f"Chamado {cid}", "categoria": "Geral", "descricao": "", "status": "Aberto",
+        "autor": autor, "autor_role": "comum", "mensagens": [], "criado_em": "", "nao_lido_por": ["ti"],
+    }
+
+
+def popular(store):
+    a, b = store.add(chamado("a")), store.add(chamado("b", autor="outro"))
+    store.add_message(a, {"autor": "jaya", "role": "ti", "texto": "verificando", "data": ""})
+    store.mark_unread(a, "NovaSP")
+    store.mark_read(a, "ti")
+    store.set_status(a, "Em andamento")
+    store.set_status(b, "Fechado")
+    store.add_message(a, {"autor": "NovaSP", "role": "comum", "texto": "obrigado", "data": ""})
+    return a, b
+
+
+def recarregar(tmp_path):
+    store = main.TicketStore(main.ChamadosJournal(tmp_path, 1, 5000))
+    store.load()
+    return store
+
+
+def test_replay_reproduz_o_estado(tmp_path):
+    journal = main.ChamadosJournal(tmp_path, 1, 5000)
+    store = main.TicketStore(journal)
+    popular(store)
+    journal.close()
+
+    replay = recarregar(tmp_path)
+    assert replay.version == store.version == 8
+    assert json.dumps(replay.all()) == json.dumps(store.all())
+    a = replay.get("a")
+    assert a["status"] == "Em andamento"
+    assert [m["texto"] for m in a["mensagens"]] == ["verificando", "obrigado"]
+    assert a["nao_lido_por"] == ["NovaSP"]
+    assert [c["id"] for c in replay.by_author("NovaSP")] == ["a"]
+
+
+def test_replay_snapshot_mais_journal(tmp_path):
+    # snapshot a cada 3 eventos: parte do estado vem do snapshot, o resto do journal
+    journal = main.ChamadosJournal(tmp_path, 1, 3)
+    store = main.TicketStore(journal)
+    popular(store)
+    journal.close()
+
+    assert (tmp_path / "snapshot.json").exists()
+    snap_seq = json.loads((tmp_path / "snapshot.json").read_text(encoding="utf-8"))["seq"]
+    assert 0 < snap_seq <= store.version
+
+    replay = recarregar(tmp_path)
+    assert replay.version == store.version
+    assert json.dumps(replay.all()) == json.dumps(store.all())
+
+
+def test_replay_ignora_linha_cortada_e_eventos_ja_no_snapshot(tmp_path):
+    journal = main.ChamadosJournal(tmp_path, 1, 5000)
+    store = main.TicketStore(journal)
+    a, _ = popular(store)
+    journal.close()
+
+    linhas = (tmp_path / "journal.jsonl").read_text(encoding="utf-8").splitlines(keepends=True)
+    # evento repetido com seq antigo (crash entre snapshot e truncate) + escrita pela metade
+    repetido = json.dumps({"seq": 2, "op": "status", "id": "a", "status": "Cancelado"}) + "\n"
+    (tmp_path / "snapshot.json").write_text(
+        json.dumps({"seq": 2, "chamados": [chamado("a"), chamado("b", autor="outro")]}), encoding="utf-8"
+    )
+    (tmp_path / "journal.jsonl").write_text("".join(linhas[2:]) + repetido + '{"seq": 9, "op": "sta', encoding="utf-8")
+
+    replay = recarregar(tmp_path)
+    assert replay.version == 8
+    assert json.dumps(replay.all()) == json.dumps(store.all())
+
+
+def test_falha_de_gravacao_reenfileira_o_lote(tmp_path, monkeypatch, caplog):
+    journal = main.ChamadosJournal(tmp_path, 1, 5000)
+    journal.retry_interval = 0.01
+    store = main.TicketStore(journal)
+
+    fsync = main.os.fsync
+    falhas = []
+
+    def fsync_instavel(fd):
+        if not falhas:
+            falhas.append(fd)
+            raise OSError(28, "No space left on device")
+        fsync(fd)
+
+    monkeypatch.setattr(main.os, "fsync", fsync_instavel)
+    popular(store)
+    journal.close()
+
+    assert falhas and "Falha ao gravar" in caplog.text
+    # o lote que falhou foi cortado do arquivo e regravado uma vez só
+    seqs = [json.loads(l)["seq"] for l in (tmp_path / "journal.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert seqs == list(range(1, 9))
+    assert json.dumps(recarregar(tmp_path).all()) == json.dumps(store.all())
+
+
+def test_writer_morto_e_recriado(tmp_path):
+    journal = main.ChamadosJournal(tmp_path, 1, 5000)
+    store = main.TicketStore(journal)
+    morto = main.threading.Thread(target=lambda: None)
+    morto.start()
+    morto.join()
+    journal._thread = morto
+
+    store.add(chamado("a"))
+    journal.close()
+
+    assert journal._thread is not morto
+    assert recarregar(tmp_path).get("a") is not None
@@ -0,0 +1,53 @@
+import main
+
+
+def abrir(client, headers, titulo, descricao="", categoria="Geral"):
+    res = client.post(
+        "/chamados", headers=headers,
+        json={"titulo": titulo, "categoria": categoria, "descricao": descricao},
+    )
+    assert res.status_code == 200
+    return res.json()
+
+
+def buscar(client, headers, q):
+    res = client.get("/chamados/search", params={"q": q}, headers=headers)
+    assert res.status_code == 200
+    return [item["titulo"] for item in res.json()["items"]]
+
+
+def test_search_respects_roles(client, comum_headers, admin_headers, ti_headers):
+    proprio = abrir(client, comum_headers, "Impressora térmica travada")
+    abrir(client, admin_headers, "Impressão de etiquetas", descricao="fila da impressora parada")
+    client.post(f"/chamados/{proprio['id']}/mensagens", headers=ti_headers, json={"texto": "Troquei o cabeçote"})
+
+    # comum só enxerga os próprios; admin e ti enxergam todos
+    assert buscar(client, comum_headers, "impressora") == ["Impressora térmica travada"]
+    assert set(buscar(client, admin_headers, "impressora")) == {"Impressora térmica travada", "Impressão de etiquetas"}
+    assert buscar(client, ti_headers, "CABECOTE") == ["Impressora térmica travada"]
+    assert buscar(client, comum_headers, "etiquetas") == []
+    assert client.get("/chamados/search", params={"q": "x"}).status_code == 401
+
+
+def test_search_is_accent_insensitive_with_prefix_on_last_term(client, admin_headers):
+    abrir(client, admin_headers, "Senha expirada no sistema", descricao="usuário não consegue acessar")
+    assert buscar(client, admin_headers, "usuario senh") == ["Senha expirada no sistema"]
+    assert buscar(client, admin_headers, "senh usuario") == []  # só o último termo é prefixo
+
+
+def test_index_rebuilds_after_journal_replay(tmp_path, client, comum_headers):
+    journal = main.ChamadosJournal(tmp_path, 1, 5000)
+    store = main.TicketStore(journal)
+    chamado = {
+        "id": "c1", "titulo": "Monitor piscando", "categoria": "Hardware", "descricao": "", "status": "Aberto",
+        "autor": "NovaSP", "autor_role": "comum", "mensagens": [], "criado_em": "", "nao_lido_por": ["ti"],
+    }
+    store.add(chamado)
+    store.add_message(chamado, {"autor": "jaya", "role": "ti", "texto": "cabo HDMI trocado", "data": ""})
+    journal.close()
+
+    replay = main.TicketStore(main.ChamadosJournal(tmp_path, 1, 5000))
+    replay.load()
+    resultados, total = replay.search("hdmi", "NovaSP", 10)
+    assert total == 1 and resultados[0][0]["titulo"] == "Monitor piscando"
+    assert replay.search("hdmi", "outro", 10) == ([], 0)
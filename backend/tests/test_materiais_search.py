@@ -0,0 +1,53 @@
+import io
+
+import pandas as pd
+
+import main
+
+
+def catalogo() -> main.MateriaisIndex:
+    return main.MateriaisIndex(pd.DataFrame({
+        "Código": ["100", "101", "200", "201"],
+        "Descrição": ["Reparo de tubo PVC", "Tubo de reparo", "Reparo em válvula", "Tubulação nova"],
+        "Unidade": ["UN", "UN", "UN", "M"],
+    }))
+
+
+def test_prefixo_varias_palavras():
+    index = catalogo()
+    assert index.search("reparo tubo", "prefixo", []).tolist() == [0, 1]
+    assert index.search("rep tub", "prefixo", []).tolist() == [0, 1]
+    assert index.search("tub", "prefixo", []).tolist() == [0, 1, 3]
+    assert index.search("reparo cano", "prefixo", []).tolist() == []
+
+
+def test_prefixo_com_filtro_e_codigo():
+    index = catalogo()
+    assert index.search("reparo", "prefixo", [("unidade", "un")]).tolist() == [0, 1, 2]
+    assert index.search("20 valv", "prefixo", []).tolist() == [2]
+
+
+def enviar_catalogo(client, headers, conteudo: bytes):
+    return client.post(
+        "/upload_materiais", files={"file": ("CODIGOS.xlsx", conteudo)}, headers=headers
+    )
+
+
+def xlsx(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def test_upload_invalido_nao_substitui_o_catalogo(client, admin_headers):
+    bom = xlsx(pd.DataFrame({"Código": ["100", "101"], "Descrição": ["Tubo", "Cano"]}))
+    assert enviar_catalogo(client, admin_headers, bom).status_code == 200
+    assert len(client.get("/materiais").json()) == 2
+
+    assert enviar_catalogo(client, admin_headers, b"isto nao e uma planilha").status_code == 400
+    sem_codigo = xlsx(pd.DataFrame({"Nome": ["Tubo"]}))
+    assert enviar_catalogo(client, admin_headers, sem_codigo).status_code == 400
+
+    assert main.EXCEL_PATH.read_bytes() == bom
+    assert len(client.get("/materiais").json()) == 2
+    assert not list(main.EXCEL_PATH.parent.glob(".*.tmp"))
@@ -0,0 +1,73 @@
+import io
+import os
+import time
+
+import pandas as pd
+
+import main
+from conftest import pendente_frame
+
+
+def test_view_is_a_snapshot_of_the_filters():
+    file_id = main.PENDENTE_STORE.put(pendente_frame())
+    main.PENDENTE_STORE.apply_filters(file_id, {"contratos": ["C0"], "atcs": ["A1"]})
+    view = main.PENDENTE_STORE.view(file_id)
+    chunks = view.iter_chunks(chunk_rows=2)
+    primeiro = next(chunks)
+
+    # filtro muda com a exportação em andamento
+    main.PENDENTE_STORE.apply_filters(file_id, {"contratos": ["C1"]})
+    df = pd.concat([primeiro, *chunks])
+
+    assert set(df["contrato"]) == {"C0"}
+    assert set(df["atc"]) == {"A1"}
+    assert len(df) == view.count() == 5
+    assert view.filtros == {"contratos": ["C0"], "atcs": ["A1"]}
+
+
+def test_export_cache_key_follows_the_exported_view(client):
+    file_id = main.PENDENTE_STORE.put(pendente_frame())
+    for contrato in ("C0", "C1", "C0"):
+        client.post("/pendente/filter", json={"file_id": file_id, "filtros": {"contratos": [contrato]}})
+        res = client.post("/pendente/format", params={"formato": "csv"}, json={"file_id": file_id})
+        assert res.status_code == 200
+        df = pd.read_csv(io.BytesIO(res.content), sep=";", encoding="utf-8-sig")
+        assert set(df["contrato"]) == {contrato}
+
+
+def test_export_cache_reindexa_o_diretorio_no_start(tmp_path):
+    for nome, idade in (("velho", 300), ("novo", 100)):
+        (tmp_path / nome).write_bytes(b"x" * 10)
+        ts = time.time() - idade
+        os.utime(tmp_path / nome, (ts, ts))
+    tmp_antigo = tmp_path / ".k.1.tmp"
+    tmp_antigo.write_bytes(b"x")
+    ts = time.time() - main.EXPORT_CACHE_TMP_GRACE - 60
+    os.utime(tmp_antigo, (ts, ts))
+    (tmp_path / ".k.2.tmp").write_bytes(b"x")  # tee em andamento
+
+    cache = main.ExportCache(tmp_path, 15)
+
+    assert not tmp_antigo.exists() and (tmp_path / ".k.2.tmp").exists()
+    # cabe só um: o mais antigo sai, o índice e os bytes batem com o disco
+    assert not (tmp_path / "velho").exists()
+    assert cache.lookup("novo") == tmp_path / "novo"
+    assert cache.bytes_held == 10
+
+
+def test_export_roda_no_cpu_pool(client, monkeypatch):
+    pool = main.OffloadPool("cpu-teste", 1, 0)
+    monkeypatch.setattr(main, "CPU_POOL", pool)
+    file_id = main.PENDENTE_STORE.put(pendente_frame())
+
+    # pool cheio: o export é recusado com 429 antes de gerar qualquer coisa
+    pool.acquire()
+    res = client.post("/pendente/format", params={"formato": "csv.gz"}, json={"file_id": file_id})
+    assert res.status_code == 429
+    pool.release()
+
+    res = client.post("/pendente/format", params={"formato": "csv.gz"}, json={"file_id": file_id})
+    assert res.status_code == 200
+    df = pd.read_csv(io.BytesIO(res.content), sep=";", encoding="utf-8-sig", compression="gzip")
+    assert len(df) == 50
+    assert pool.completed == 2 and pool.inflight == 0
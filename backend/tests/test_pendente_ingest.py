@@ -0,0 +1,99 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import main
+from conftest import pendente_frame
+
+pytestmark = pytest.mark.skipif(not main.PENDENTE_STORE.spill, reason="requer pyarrow")
+
+
+def write_csv(tmp_path, df):
+    path = tmp_path / "pendente.csv"
+    df.to_csv(path, index=False, sep=";")
+    return path
+
+
+def test_stream_spill_matches_full_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PENDENTE_CHUNK_ROWS", 7)
+    df = pendente_frame(50)
+    df.loc[3, "atc"] = None
+    path = write_csv(tmp_path, df)
+
+    out = tmp_path / "out.parquet"
+    keys, n_rows = main.stream_pendente_spill(path, out)
+    esperado = main.build_filter_keys(main.read_pendente(path))
+
+    assert n_rows == 50
+    assert main.pq.ParquetFile(out).num_row_groups == 8
+    for chave, cat in esperado.items():
+        assert list(keys[chave].categories) == list(cat.categories)
+        np.testing.assert_array_equal(keys[chave].codes, cat.codes)
+
+
+def test_stream_spill_falls_back_when_types_change(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(main, "PENDENTE_CHUNK_ROWS", 10)
+    path = tmp_path / "pendente.xlsx"
+    df = pendente_frame(30).astype({"linha": object})
+    df.loc[25, "linha"] = "texto"  # numérica nos primeiros blocos, texto depois
+    df.to_excel(path, index=False)
+
+    out = tmp_path / "out.parquet"
+    keys, n_rows = main.stream_pendente_spill(path, out)
+    lido = main.pq.read_table(out).to_pandas()
+
+    assert "lendo a planilha inteira" in caplog.text
+    assert n_rows == len(lido) == 30
+    assert lido["linha"].astype(str).tolist()[25] == "texto"
+
+
+def test_upload_filters_streamed_dataset(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "PENDENTE_CHUNK_ROWS", 4)
+    path = write_csv(tmp_path, pendente_frame(40))
+    with open(path, "rb") as f:
+        res = client.post("/pendente/upload", files={"file": ("pendente.csv", f)})
+    assert res.status_code == 200
+    assert res.json()["contratos"] == ["C0", "C1"]
+
+    res = client.post("/pendente/filter", json={"file_id": res.json()["file_id"], "filtros": {"contratos": ["C1"]}})
+    assert res.json()["linhas_resultantes"] == 20
+
+
+def test_parse_cache_scan_keeps_recent_tmp(tmp_path):
+    antigo = tmp_path / ".abc.1.tmp"
+    recente = tmp_path / ".abc.2.tmp"
+    antigo.write_bytes(b"x")
+    recente.write_bytes(b"x")
+    velho = time.time() - main.PARSE_CACHE_TMP_GRACE - 60
+    os.utime(antigo, (velho, velho))
+
+    cache = main.ParseCache(tmp_path, 1024 * 1024, True)
+
+    assert not antigo.exists()
+    assert recente.exists()  # store() de outro worker em andamento
+    assert cache.bytes_held == 0
+
+
+def test_ttl_nao_apaga_spill_usado_por_outro_worker():
+    store = main.DatasetStore(1024 ** 3, 60)
+    file_id = store.put(pendente_frame(20))
+    parquet = main.spill_path(file_id)
+
+    # este worker não usa o dataset há mais que o TTL; o Parquet foi tocado agora
+    store._entries[file_id].last_access -= 120
+    store._sweep(time.time())
+    assert file_id not in store._entries and parquet.exists()
+    assert store.get(file_id).count() == 20  # reidratado do disco
+
+    # ninguém usou dentro do TTL: aí sim o dataset expira
+    store._entries[file_id].last_access -= 120
+    velho = time.time() - 120
+    os.utime(parquet, (velho, velho))
+    store._sweep(time.time())
+    assert not parquet.exists()
+    with pytest.raises(main.HTTPException) as err:
+        store.get(file_id)
+    assert err.value.status_code == 410
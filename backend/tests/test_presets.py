@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+
+import main
+from conftest import pendente_frame
+
+
+def test_presets_persistem_e_versionam(tmp_path):
+    path = tmp_path / "filtros_salvos.json"
+    presets = main.FilterPresets(path)
+
+    primeiro = presets.save("Norte", {"contratos": ["C1"], "atcs": [], "outro": ["x"]})
+    assert primeiro["versao"] == 1
+    assert primeiro["filtros"] == {"contratos": ["C1"]}  # vazios e chaves desconhecidas saem
+    assert presets.save("Norte", {"atcs": ["A1-x"]})["versao"] == 2
+    presets.save("abc", {"familias": ["f"]})
+
+    # outro worker (ou restart) relê o arquivo
+    relido = main.FilterPresets(path)
+    assert [p["nome"] for p in relido.list()] == ["abc", "Norte"]
+    assert relido.get("Norte")["filtros"] == {"atcs": ["A1-x"]}
+    assert relido.get("Norte")["versao"] == 2
+
+    relido.delete("abc")
+    # mtime mudou: a instância antiga percebe sem reiniciar
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert [p["nome"] for p in presets.list()] == ["Norte"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_presets_endpoints_aplicam_no_dataset(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "FILTERS", main.FilterPresets(tmp_path / "filtros_salvos.json"))
+    path = tmp_path / "pendente.csv"
+    pendente_frame(40).to_csv(path, index=False, sep=";")
+    with open(path, "rb") as f:
+        file_id = client.post("/pendente/upload", files={"file": ("pendente.csv", f)}).json()["file_id"]
+
+    res = client.post("/pendente/presets", json={"nome": "so C1", "filtros": {"contratos": ["C1"]}})
+    assert res.status_code == 200
+    assert client.post("/pendente/presets", json={"nome": "  ", "filtros": {}}).status_code == 400
+
+    res = client.post("/pendente/presets/so C1/apply", json={"file_id": file_id})
+    assert res.json()["linhas_resultantes"] == 20
+
+    # preset alterado recompila a máscara
+    client.post("/pendente/presets", json={"nome": "so C1", "filtros": {"contratos": ["C1"], "atcs": ["A1"]}})
+    res = client.post("/pendente/presets/so C1/apply", json={"file_id": file_id})
+    esperado = pendente_frame(40).query("contrato == 'C1' and atc == 'A1-x'")
+    assert res.json()["linhas_resultantes"] == len(esperado)
+
+    assert client.delete("/pendente/presets/so C1").status_code == 200
+    assert client.post("/pendente/presets/so C1/apply", json={"file_id": file_id}).status_code == 404
+    assert client.get("/pendente/presets").json() == []
@@ -0,0 +1,45 @@
+import pytest
+
+import main
+
+
+def novo_chamado(i: int) -> dict:
+    return {
+        "id": f"c{i}", "titulo": f"t{i}", "categoria": "x", "descricao": "d", "status": "Aberto",
+        "autor": "NovaSP", "autor_role": "comum", "mensagens": [], "criado_em": "", "nao_lido_por": ["ti"],
+    }
+
+
+def test_shared_snapshot_is_written_off_the_request_path(tmp_path):
+    backend = main.SQLiteStateBackend(tmp_path / "state.db")
+    store = main.TicketStore(shared=backend, snapshot_every=3)
+    for i in range(3):
+        store.add(novo_chamado(i))
+    store._snapshot_thread.join(timeout=5)
+
+    snap = backend.get("chamados:snapshot")
+    assert snap["seq"] == 3
+    assert [c["id"] for c in snap["chamados"]] == ["c0", "c1", "c2"]
+
+    # outro worker sobe do snapshot + log
+    outro = main.TicketStore(shared=backend, snapshot_every=3)
+    outro.load()
+    store.add(novo_chamado(3))
+    assert len(outro.all()) == 4
+    assert outro.unread_count("ti") == 4
+
+
+def test_notifications_count(client, ti_headers):
+    res = client.get("/notifications/count", headers=ti_headers)
+    assert res.status_code == 200
+    assert set(res.json()) == {"count", "version"}
+    assert client.get("/notifications/count").status_code == 401
+
+
+def test_backend_incompleto_falha_ao_criar():
+    class SoLeitura(main.StateBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        SoLeitura()
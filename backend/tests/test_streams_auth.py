@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import main
+from conftest import login
+
+
+def job_remoto(monkeypatch, status):
+    # job rodando em outro worker: só o StateBackend sabe dele
+    monkeypatch.setattr(main, "STATE_SYNC_INTERVAL", 0.01)
+    monkeypatch.setattr(main.JOB_MANAGER, "local", lambda job_id: None)
+    monkeypatch.setattr(main.JOB_MANAGER, "status", status)
+
+
+def test_ws_remoto_fecha_com_4401_quando_o_token_cai(client, monkeypatch):
+    job_remoto(monkeypatch, lambda job_id, info: {"status": "running", "version": 1})
+    token = login(client, "jaya", "697843")["Authorization"].split(" ", 1)[1]
+
+    with client.websocket_connect(f"/ws/jobs/j1?token={token}") as ws:
+        assert ws.receive_json()["status"] == "running"
+        client.post("/logout", json={"token": token})
+        with pytest.raises(WebSocketDisconnect) as err:
+            ws.receive_json()
+    assert err.value.code == 4401
+
+
+def test_ws_remoto_fecha_com_1011_em_erro(client, monkeypatch):
+    chamadas = []
+
+    def status(job_id, info):
+        chamadas.append(job_id)
+        if len(chamadas) > 1:
+            raise RuntimeError("StateBackend fora do ar")
+        return {"status": "running", "version": 1}
+
+    job_remoto(monkeypatch, status)
+    token = login(client, "jaya", "697843")["Authorization"].split(" ", 1)[1]
+
+    with client.websocket_connect(f"/ws/jobs/j1?token={token}") as ws:
+        ws.receive_json()
+        with pytest.raises(WebSocketDisconnect) as err:
+            ws.receive_json()
+    assert err.value.code == 1011
+
+
+def test_sse_encerra_quando_o_token_e_revogado(client):
+    token = login(client, "NovaSP", "cmnsp2025")["Authorization"].split(" ", 1)[1]
+
+    async def run():
+        res = await main.notifications_stream(token)
+        eventos = res.body_iterator
+        primeiro = await eventos.__anext__()
+        main.TOKEN_STORE.revoke(token)
+        main.notification_hub.bump("NovaSP")
+        resto = [e async for e in eventos]
+        return primeiro, resto
+
+    primeiro, resto = asyncio.run(asyncio.wait_for(run(), timeout=10))
+    assert primeiro.startswith("event: count")
+    assert resto[-1].startswith("event: expired")
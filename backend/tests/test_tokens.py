@@ -0,0 +1,77 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.fixture
+def signed(monkeypatch):
+    store = main.TokenStore(3600, "signed", b"segredo", main.MemoryStateBackend())
+    monkeypatch.setattr(main, "TOKEN_STORE", store)
+    return store
+
+
+def bearer(token):
+    return f"Bearer {token}"
+
+
+def test_signed_verifica_em_qualquer_instancia(signed):
+    token = signed.issue("jaya", "ti")
+    info = main.verify_token_header(bearer(token))
+    assert (info["user"], info["role"]) == ("jaya", "ti")
+
+    # outro worker com o mesmo segredo e sem estado compartilhado de tokens
+    outro = main.TokenStore(3600, "signed", b"segredo", main.MemoryStateBackend())
+    assert outro.lookup(token)["user"] == "jaya"
+    assert main.TokenStore(3600, "signed", b"outro", main.MemoryStateBackend()).lookup(token) is None
+
+
+def test_signed_rejeita_adulterado_e_lixo(signed):
+    payload, _, assinatura = signed.issue("NovaSP", "comum").partition(".")
+    forjado = main._b64e(b'{"u":"NovaSP","r":"admin","e":9999999999,"n":"x"}')
+    for token in (f"{forjado}.{assinatura}", payload, "a.b.c", f"{payload}.{assinatura}x"):
+        with pytest.raises(HTTPException) as err:
+            main.verify_token_header(bearer(token))
+        assert err.value.status_code == 403
+
+    with pytest.raises(HTTPException) as err:
+        main.verify_token_header(bearer("tokén.assinatura"))
+    assert err.value.status_code == 401
+    assert signed.lookup("tokén.assinatura") is None
+
+
+def test_signed_expirado_e_revogado(signed, monkeypatch):
+    token = signed.issue("jaya", "ti")
+    assert signed.revoke(token)
+    assert signed.backend.get(f"revoked:{token}") == 1
+    with pytest.raises(HTTPException) as err:
+        main.verify_token_header(bearer(token))
+    assert err.value.detail == "Token inválido"
+
+    agora = time.time()
+    monkeypatch.setattr(main.time, "time", lambda: agora + 7200)
+    with pytest.raises(HTTPException) as err:
+        main.verify_token_header(bearer(token))
+    assert err.value.detail == "Token expirado"
+    # a revogação some junto com o token
+    assert signed.backend.get(f"revoked:{token}") is None
+
+
+def test_store_expirado_sai_no_lookup(monkeypatch):
+    store = main.TokenStore(60, "store", backend=main.MemoryStateBackend())
+    monkeypatch.setattr(main, "TOKEN_STORE", store)
+    token = store.issue("renan", "admin")
+
+    agora = time.time()
+    monkeypatch.setattr(main.time, "time", lambda: agora + 120)
+    with pytest.raises(HTTPException) as err:
+        main.verify_token_header(bearer(token))
+    assert err.value.detail == "Token expirado"
+    assert store.backend.get(f"token:{token}") is None
+
+
+def test_header_nao_ascii_da_401(client, signed):
+    res = client.get("/current_user", headers={"Authorization": "Bearer tôken".encode("latin-1")})
+    assert res.status_code == 401
@@ -0,0 +1,126 @@
+import hashlib
+import io
+
+import main
+from conftest import pendente_frame
+
+
+def abrir(client, headers, tamanho, sha256=None, destino="pendente", filename="pendente.csv"):
+    res = client.post(
+        "/uploads",
+        json={"destino": destino, "filename": filename, "tamanho": tamanho, "sha256": sha256},
+        headers=headers,
+    )
+    assert res.status_code == 200
+    return res.json()["upload_id"]
+
+
+def enviar(client, headers, upload_id, offset, parte):
+    return client.put(
+        f"/uploads/{upload_id}?offset={offset}",
+        content=parte,
+        headers={**headers, "Content-Type": "application/octet-stream"},
+    )
+
+
+def pendente_csv() -> bytes:
+    buf = io.StringIO()
+    pendente_frame(40).to_csv(buf, index=False, sep=";")
+    return buf.getvalue().encode("utf-8")
+
+
+def test_upload_em_partes_offsets_e_complete(client, comum_headers):
+    data = pendente_csv()
+    upload_id = abrir(client, comum_headers, len(data), hashlib.sha256(data).hexdigest())
+
+    meio = len(data) // 2
+    res = enviar(client, comum_headers, upload_id, 0, data[:meio])
+    assert res.status_code == 200 and res.json()["offset"] == meio
+
+    # retomada: o backend diz de onde seguir
+    assert client.get(f"/uploads/{upload_id}", headers=comum_headers).json()["offset"] == meio
+
+    res = enviar(client, comum_headers, upload_id, meio, data[meio:])
+    assert res.json()["offset"] == len(data)
+
+    res = client.post(f"/uploads/{upload_id}/complete", headers=comum_headers)
+    assert res.status_code == 200
+    assert res.json()["contratos"] == ["C0", "C1"]
+    assert client.get(f"/uploads/{upload_id}", headers=comum_headers).status_code == 404
+
+
+def test_upload_offset_fora_de_sincronia_409(client, comum_headers):
+    upload_id = abrir(client, comum_headers, 10)
+    enviar(client, comum_headers, upload_id, 0, b"abcd")
+
+    res = enviar(client, comum_headers, upload_id, 2, b"cdef")
+    assert res.status_code == 409
+    assert res.json()["offset"] == 4
+
+    res = client.post(f"/uploads/{upload_id}/complete", headers=comum_headers)
+    assert res.status_code == 409
+    assert res.json()["detail"] == "Upload incompleto"
+
+
+def test_upload_parte_grande_demais_413(client, comum_headers, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_MAX", 4)
+    upload_id = abrir(client, comum_headers, 10)
+
+    res = enviar(client, comum_headers, upload_id, 0, b"abcdef")
+    assert res.status_code == 413
+    # a parte recusada não conta: o offset continua onde estava
+    assert client.get(f"/uploads/{upload_id}", headers=comum_headers).json()["offset"] == 0
+
+    # além do tamanho declarado também é recusado
+    enviar(client, comum_headers, upload_id, 0, b"abcd")
+    enviar(client, comum_headers, upload_id, 4, b"efgh")
+    assert enviar(client, comum_headers, upload_id, 8, b"ijk").status_code == 413
+
+    res = client.post(
+        "/uploads",
+        json={"destino": "pendente", "filename": "p.csv", "tamanho": main.UPLOAD_MAX_BYTES + 1},
+        headers=comum_headers,
+    )
+    assert res.status_code == 413
+
+
+def test_upload_exige_login_e_dono(client, comum_headers, ti_headers):
+    res = client.post("/uploads", json={"destino": "pendente", "filename": "p.csv", "tamanho": 4})
+    assert res.status_code == 401
+
+    upload_id = abrir(client, comum_headers, 4)
+    assert client.get(f"/uploads/{upload_id}").status_code == 401
+    assert client.get(f"/uploads/{upload_id}", headers=ti_headers).status_code == 403
+    assert enviar(client, ti_headers, upload_id, 0, b"abcd").status_code == 403
+    assert client.post(f"/uploads/{upload_id}/complete", headers=ti_headers).status_code == 403
+    assert client.delete(f"/uploads/{upload_id}", headers=ti_headers).status_code == 403
+
+    assert client.delete(f"/uploads/{upload_id}", headers=comum_headers).status_code == 200
+    assert client.get(f"/uploads/{upload_id}", headers=comum_headers).status_code == 404
+
+
+def test_upload_materiais_so_admin(client, comum_headers):
+    res = client.post(
+        "/uploads",
+        json={"destino": "materiais", "filename": "c.xlsx", "tamanho": 4},
+        headers=comum_headers,
+    )
+    assert res.status_code == 403
+
+
+def test_varredura_libera_os_locks(client, comum_headers, monkeypatch):
+    abandonada = abrir(client, comum_headers, 10)
+    enviar(client, comum_headers, abandonada, 0, b"abcd")
+    encerrada = abrir(client, comum_headers, 10)
+    enviar(client, comum_headers, encerrada, 0, b"abcd")
+    assert {abandonada, encerrada} <= set(main.UPLOAD_SESSIONS._locks)
+
+    # outro worker cancelou uma; a outra passou do TTL
+    main.UPLOAD_SESSIONS.part_path(encerrada).unlink()
+    main.UPLOAD_SESSIONS._meta_path(encerrada).unlink()
+    monkeypatch.setattr(main.UPLOAD_SESSIONS, "ttl", -1)
+    main.UPLOAD_SESSIONS._sweep()
+
+    assert abandonada not in main.UPLOAD_SESSIONS._locks
+    assert encerrada not in main.UPLOAD_SESSIONS._locks
+    assert client.get(f"/uploads/{abandonada}", headers=comum_headers).status_code == 404
@@ -1,8 +1,8 @@
 // src/context/NotificationContext.jsx
 import React, { createContext, useContext, useEffect, useState } from "react";
 import { useLocation } from "react-router-dom";
-import api from "../utils/apiAxios";
-import { isAuthenticated } from "../utils/auth";
+import api, { API_URL } from "../utils/apiAxios";
+import { isAuthenticated, getToken } from "../utils/auth";
 
 const NotificationContext = createContext();
 
@@ -10,6 +10,8 @@ export function NotificationProvider({ children }) {
   const [count, setCount] = useState(0);
   const [loading, setLoading] = useState(true);
   const location = useLocation();
+  // reabre o canal de push quando o usuário sai da tela de login
+  const naTelaDeLogin = location.pathname === "/login";
 
   const fetchCount = async () => {
     if (!isAuthenticated()) {
@@ -39,11 +41,53 @@ export function NotificationProvider({ children }) {
     fetchCount();
   }, [location.pathname]);
 
-  // 🔄 polling (garante TI atualizado)
+  // 🔔 push do backend (SSE); sem EventSource ou com erro → long-poll
+  // por versão: a requisição fica parada no servidor até o contador mudar
   useEffect(() => {
-    const interval = setInterval(fetchCount, 15000);
-    return () => clearInterval(interval);
-  }, []);
+    if (!isAuthenticated()) return undefined;
+
+    let ativo = true;
+    let source = null;
+
+    const longPoll = async () => {
+      let version = null;
+      while (ativo && isAuthenticated()) {
+        try {
+          const res = await api.get("/notifications/count", {
+            params: version === null ? {} : { since: version, wait: 25 },
+          });
+          version = res.data?.version ?? null;
+          setCount(res.data?.count || 0);
+        } catch (err) {
+          await new Promise((resolve) => setTimeout(resolve, 15000));
+        }
+      }
+    };
+
+    if (typeof window.EventSource === "function") {
+      source = new EventSource(
+        `${API_URL}/notifications/stream?token=${encodeURIComponent(getToken())}`
+      );
+      source.addEventListener("count", (e) => {
+        const data = JSON.parse(e.data);
+        setCount(data.count || 0);
+        setLoading(false);
+      });
+      // token venceu ou foi revogado: não adianta reconectar com ele
+      source.addEventListener("expired", () => source.close());
+      source.onerror = () => {
+        // EventSource reconecta sozinho; se fechou de vez, cai no long-poll
+        if (source.readyState === EventSource.CLOSED && ativo) longPoll();
+      };
+    } else {
+      longPoll();
+    }
+
+    return () => {
+      ativo = false;
+      if (source) source.close();
+    };
+  }, [naTelaDeLogin]);
 
   return (
     <NotificationContext.Provider
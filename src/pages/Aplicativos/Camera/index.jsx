@@ -1,5 +1,5 @@
 import React, { useState } from "react";
-import api from "../../../utils/apiAxios";
+import { executarJob } from "../../../utils/jobs";
 import { useTheme } from "../../../context/ThemeContext";
 
 export default function Camera() {
@@ -14,7 +14,7 @@ export default function Camera() {
     setLoading(true);
 
     try {
-      const res = await api.post("/camera/abrir");
+      const res = await executarJob("/camera/abrir");
 
       if (res.data?.status === "success") {
         setMensagem("✅ Login automático realizado. Sistema aberto no servidor.");
@@ -1,5 +1,6 @@
 import { useState } from "react";
 import api from "./../../../utils/apiAxios";
+import { enviarEmPartes } from "./../../../utils/uploads";
 import { motion } from "framer-motion";
 import { useTheme } from "../../../context/ThemeContext";
 import { Upload, Filter, Download } from "lucide-react";
@@ -33,10 +34,8 @@ export default function Pendente() {
     try {
       setLoading(true);
 
-      const form = new FormData();
-      form.append("file", file);
-
-      const res = await api.post("/pendente/upload", form);
+      // em partes: planilhas grandes sobrevivem a quedas de conexão
+      const res = await enviarEmPartes(file, "pendente");
 
       setFileId(res.data.file_id);
       setOptions({
@@ -1,5 +1,5 @@
 import React, { useState } from "react";
-import api from "../../../utils/apiAxios";
+import { executarJob } from "../../../utils/jobs";
 import { useTheme } from "../../../context/ThemeContext";
 
 export default function Rastreador() {
@@ -12,7 +12,7 @@ export default function Rastreador() {
     setLoading(true);
 
     try {
-      const res = await api.post("/rastreador/abrir-site");
+      const res = await executarJob("/rastreador/abrir-site");
 
       if (res.data?.status === "success") {
         setMensagem("✅ Login feito no servidor. Site aberto no navegador do servidor.");
@@ -0,0 +1,37 @@
+// src/utils/jobs.js
+import api from "./apiAxios";
+
+// ===================================
+// ⏳ Aguarda um job da fila de automação
+// - O backend responde 202 com { job_id } e executa em segundo plano
+// - Faz polling em /jobs/{id} até sair de queued/running
+// ===================================
+const ATIVOS = ["queued", "running"];
+
+export async function aguardarJob(jobId, { intervalo = 1000, onProgresso } = {}) {
+  for (;;) {
+    const res = await api.get(`/jobs/${jobId}`);
+    const job = res.data;
+
+    if (onProgresso) onProgresso(job);
+    if (!ATIVOS.includes(job.status)) return job;
+
+    await new Promise((resolve) => setTimeout(resolve, intervalo));
+  }
+}
+
+// POST que enfileira o job e devolve o resultado final no mesmo formato
+// que o endpoint síncrono devolvia ({ status, mensagem, ... })
+export async function executarJob(url, opcoes) {
+  const res = await api.post(url);
+  const job = ATIVOS.includes(res.data?.status)
+    ? await aguardarJob(res.data.job_id, opcoes)
+    : res.data;
+
+  if (job.status === "error") {
+    const err = new Error(job.erro || "Falha na automação");
+    err.response = { data: { detail: job.erro } };
+    throw err;
+  }
+  return { data: job.resultado || {} };
+}
@@ -0,0 +1,55 @@
+// src/utils/uploads.js
+import api from "./apiAxios";
+
+// ===================================
+// 📦 Upload em partes, retomável
+// - POST /uploads abre a sessão; cada parte vai com PUT ?offset=N
+// - Se a conexão cair, pergunta ao backend o offset e continua dali
+// - No fim, POST /uploads/{id}/complete confere o sha256 e processa
+// ===================================
+const TENTATIVAS = 5;
+const SHA_LIMITE = 64 * 1024 * 1024; // acima disso não vale ler tudo no navegador
+
+async function sha256(file) {
+  if (!window.crypto?.subtle || file.size > SHA_LIMITE) return null;
+  const digest = await window.crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((b) => b.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+export async function enviarEmPartes(file, destino, { onProgresso } = {}) {
+  const sessao = await api.post("/uploads", {
+    destino,
+    filename: file.name,
+    tamanho: file.size,
+    sha256: await sha256(file),
+  });
+  const { upload_id: id, chunk_max: parte } = sessao.data;
+
+  let offset = 0;
+  let falhas = 0;
+  while (offset < file.size) {
+    try {
+      const res = await api.put(
+        `/uploads/${id}?offset=${offset}`,
+        file.slice(offset, offset + parte),
+        { headers: { "Content-Type": "application/octet-stream" } }
+      );
+      offset = res.data.offset;
+      falhas = 0;
+      if (onProgresso) onProgresso(offset / file.size);
+    } catch (err) {
+      if (err.response?.status === 409) {
+        offset = err.response.data.offset;
+        continue;
+      }
+      if (err.response || ++falhas > TENTATIVAS) throw err;
+      // queda de rede: espera e retoma do que o backend já gravou
+      await new Promise((resolve) => setTimeout(resolve, 1000 * falhas));
+      offset = (await api.get(`/uploads/${id}`)).data.offset;
+    }
+  }
+
+  return api.post(`/uploads/${id}/complete`);
+}